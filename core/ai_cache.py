@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.cache import caches
+
+# How long a caller waits for another process that is already computing the same entry
+LOCK_TIMEOUT = 60
+POLL_INTERVAL = 0.1
+
+_lock = threading.Lock()
+_inflight = {}
+_stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0, 'compute_count': 0, 'compute_seconds': 0.0}
+
+
+def get_cache():
+    return caches[getattr(settings, 'AI_CACHE_ALIAS', 'default')]
+
+
+def make_key(*inputs):
+    # Content hash of everything the response depends on (prompt inputs, model name)
+    digest = hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+    return f"ai:response:{digest}"
+
+
+def _user_key(user_id):
+    return f"ai:user:{user_id}"
+
+
+class _Abandoned(Exception):
+    # Set on the shared future when its leader's request was cancelled; a follower computes instead
+    pass
+
+
+def _count(name, amount=1):
+    with _lock:
+        _stats[name] += amount
+
+
+def stats():
+    with _lock:
+        snapshot = dict(_stats)
+    count = snapshot['compute_count']
+    snapshot['compute_avg_seconds'] = snapshot['compute_seconds'] / count if count else 0.0
+    return snapshot
+
+
+def lookup(inputs):
+    return get_cache().get(make_key(*inputs))
+
+
+def store(user_id, inputs, value):
+    cache = get_cache()
+    key = make_key(*inputs)
+    cache.set(key, value)
+    cache.set(_user_key(user_id), key)
+
+
+def invalidate(user_id):
+    # Drop the user's latest response; anything older is unreachable anyway since its inputs changed
+    cache = get_cache()
+    key = cache.get(_user_key(user_id))
+    if key:
+        cache.delete_many([key, _user_key(user_id)])
+
+
+def _compute(cache, user_id, key, compute):
+    # Only one process computes a given key; the others poll for its result. The
+    # lock holds a token of its owner, so only the owner releases it -- not a caller
+    # that gave up waiting, nor an owner that outlived LOCK_TIMEOUT and a successor.
+    lock_key, token = f"{key}:lock", uuid.uuid4().hex
+    owner = cache.add(lock_key, token, LOCK_TIMEOUT)
+    if not owner:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            value = cache.get(key)
+            if value is not None:
+                _count('coalesced')
+                return value
+            if cache.get(lock_key) is None and cache.add(lock_key, token, LOCK_TIMEOUT):
+                # The other process gave up (or just finished): compute it ourselves
+                owner = True
+                value = cache.get(key)
+                if value is not None:
+                    _release(cache, lock_key, token)
+                    return value
+                break
+
+    try:
+        started = time.perf_counter()
+        value = compute()
+        _count('compute_seconds', time.perf_counter() - started)
+        _count('compute_count')
+        cache.set(key, value)
+        cache.set(_user_key(user_id), key)
+        return value
+    finally:
+        if owner:
+            _release(cache, lock_key, token)
+
+
+def _release(cache, lock_key, token):
+    # Not atomic, but only a lock that expired in between can be lost
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def get_or_compute(user_id, inputs, compute):
+    """Return the cached response for `inputs`, calling `compute()` on a miss.
+
+    Concurrent callers with the same inputs share one compute() call. Errors
+    raised by compute() are passed to every waiting caller and are not cached.
+    """
+    cache = get_cache()
+    key = make_key(*inputs)
+    value = cache.get(key)
+    if value is not None:
+        _count('hits')
+        return value
+    _count('misses')
+
+    while True:
+        with _lock:
+            future = _inflight.get(key)
+            leader = future is None
+            if leader:
+                future = _inflight[key] = Future()
+        if leader:
+            break
+        _count('coalesced')
+        try:
+            return future.result()
+        except _Abandoned:
+            continue
+
+    try:
+        value = _compute(cache, user_id, key, compute)
+        future.set_result(value)
+        return value
+    except Exception as e:
+        _count('errors')
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            del _inflight[key]
+
+
+async def _acompute(cache, user_id, key, acompute):
+    # _compute() without blocking the event loop
+    lock_key, token = f"{key}:lock", uuid.uuid4().hex
+    owner = await cache.aadd(lock_key, token, LOCK_TIMEOUT)
+    if not owner:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            value = await cache.aget(key)
+            if value is not None:
+                _count('coalesced')
+                return value
+            if await cache.aget(lock_key) is None and await cache.aadd(lock_key, token, LOCK_TIMEOUT):
+                owner = True
+                value = await cache.aget(key)
+                if value is not None:
+                    await _arelease(cache, lock_key, token)
+                    return value
+                break
+
+    try:
+        started = time.perf_counter()
+        value = await acompute()
+        _count('compute_seconds', time.perf_counter() - started)
+        _count('compute_count')
+        await cache.aset(key, value)
+        await cache.aset(_user_key(user_id), key)
+        return value
+    finally:
+        if owner:
+            await _arelease(cache, lock_key, token)
+
+
+async def _arelease(cache, lock_key, token):
+    if await cache.aget(lock_key) == token:
+        await cache.adelete(lock_key)
+
+
+async def aget_or_compute(user_id, inputs, acompute):
+    """get_or_compute() for async views: `acompute` is a coroutine function.
+
+    The in-flight calls are shared with get_or_compute(), so sync and async
+    callers in one process still make a single call per key.
+    """
+    cache = get_cache()
+    key = make_key(*inputs)
+    value = await cache.aget(key)
+    if value is not None:
+        _count('hits')
+        return value
+    _count('misses')
+
+    while True:
+        with _lock:
+            future = _inflight.get(key)
+            leader = future is None
+            if leader:
+                future = _inflight[key] = Future()
+        if leader:
+            break
+        _count('coalesced')
+        try:
+            return await asyncio.wrap_future(future)
+        except _Abandoned:
+            continue
+
+    try:
+        value = await _acompute(cache, user_id, key, acompute)
+        future.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        # Our client went away, not theirs: the callers waiting on us start over and one computes it
+        future.set_exception(_Abandoned())
+        raise
+    except Exception as e:
+        _count('errors')
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            del _inflight[key]
@@ -0,0 +1,140 @@
+import asyncio
+import json
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+
+from . import ai_cache, coach_prompt, llm, rolling
+from .views import AI_MODEL, AI_STREAM_PATH, arecent_logs, rule_based_summary
+
+# Served straight from healthyio_project/asgi.py, outside Django's handler:
+# Django 4.2 keeps iterating a streaming response after the client has gone,
+# which would keep paying for tokens nobody reads.
+STREAM_PATH = AI_STREAM_PATH
+
+# Tokens buffered between the provider and a slow client. When it is full we
+# stop reading from the provider, so TCP pushes back on it.
+QUEUE_SIZE = 32
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+@sync_to_async
+def load_prompt(scope):
+    # Authenticate from the session cookie, then build the same prompt as ai_analysis_view
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    session_key = cookies[settings.SESSION_COOKIE_NAME].value if settings.SESSION_COOKIE_NAME in cookies else None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+
+    user = auth.get_user(SimpleNamespace(session=session))
+    if not user.is_authenticated:
+        return None, None
+    window = rolling.for_user(user.id)
+    if window is None:
+        return user, None
+    return user, coach_prompt.for_user(user, user.userprofile, window)
+
+
+async def produce(prompt, user, queue):
+    # Read tokens from the provider (via the shared client in core/llm.py) into the queue
+    tokens = llm.stream(prompt)
+    sent_any = False
+    try:
+        async for token in tokens:
+            await queue.put(('token', token))
+            sent_any = True
+        await queue.put(('done', None))
+    except llm.LLMUnavailable:
+        if sent_any:
+            await queue.put(('error', "The AI coach was interrupted. Please try again."))
+        else:
+            logs = await arecent_logs(user)
+            await queue.put(('fallback', rule_based_summary(logs)))
+    finally:
+        await tokens.aclose()
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def send_text(send, status, text):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': text.encode()})
+
+
+async def application(scope, receive, send):
+    """ASGI endpoint streaming the AI coach answer as Server-Sent Events.
+
+    Events: `token` (a piece of HTML), `done`, and `error`. The upstream
+    request is cancelled as soon as the client disconnects.
+    """
+    if scope['method'] != 'GET':
+        await send_text(send, 405, "Method not allowed")
+        return
+    user, prompt = await load_prompt(scope)
+    if user is None:
+        await send_text(send, 403, "Login required")
+        return
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]})
+    # Flush the headers right away so the browser sees the first byte immediately
+    await send({'type': 'http.response.body', 'body': b": connected\n\n", 'more_body': True})
+
+    if prompt is None:
+        await send({'type': 'http.response.body', 'body': sse('error', "Not enough data!")})
+        return
+    inputs = [AI_MODEL, prompt]
+    cached = await sync_to_async(ai_cache.lookup)(inputs)
+    if cached is not None:
+        await send({'type': 'http.response.body', 'body': sse('token', cached) + sse('done', None)})
+        return
+
+    queue = asyncio.Queue(QUEUE_SIZE)
+    producer = asyncio.create_task(produce(prompt, user, queue))
+    disconnect = asyncio.create_task(wait_for_disconnect(receive))
+    parts = []
+    try:
+        while True:
+            next_event = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait({next_event, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                next_event.cancel()
+                return
+            event, data = next_event.result()
+            if event == 'token':
+                parts.append(data)
+                await send({'type': 'http.response.body', 'body': sse('token', data), 'more_body': True})
+                continue
+
+            if event == 'done':
+                await sync_to_async(ai_cache.store)(user.id, inputs, "".join(parts))
+                body = sse('done', None)
+            elif event == 'fallback':
+                # Degraded summary; not cached so the real answer shows up once the provider recovers
+                body = sse('token', data) + sse('done', None)
+            else:
+                body = sse('error', data)
+            await send({'type': 'http.response.body', 'body': body})
+            return
+    finally:
+        producer.cancel()
+        disconnect.cancel()
+        await asyncio.gather(producer, disconnect, return_exceptions=True)
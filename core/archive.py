@@ -0,0 +1,194 @@
+import datetime
+import gzip
+import json
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import ai_cache, rolling, rollups
+from .models import ArchivedMonth, HealthLog, UserProfile, UserSummary
+
+logger = logging.getLogger(__name__)
+
+# Cold-data archival (`manage.py archive_logs`). Logs from months that ended
+# more than ARCHIVE_AFTER_DAYS ago are folded into one ArchivedMonth row per
+# user and month and removed from HealthLog, so the hot table stays small.
+# The original rows go to a gzipped NDJSON file per month under
+# MEDIA_ROOT/archive/ (unless discarded), and restore() puts them back.
+# Whether a month's rows are kept is fixed when it is first archived.
+# UserSummary keeps counting archived logs, so dashboard totals don't move.
+
+ARCHIVE_DIR = 'archive'
+MAX_SCORE = 100
+FIELDS = tuple(field.attname for field in HealthLog._meta.concrete_fields)
+
+
+def cutoff(today=None, days=None):
+    """First day of the oldest month that stays in HealthLog."""
+    if days is None:
+        days = getattr(settings, 'ARCHIVE_AFTER_DAYS', 365)
+    return ((today or datetime.date.today()) - timedelta(days=days)).replace(day=1)
+
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def file_path(relative):
+    return os.path.join(settings.MEDIA_ROOT, relative)
+
+
+def _add(month, row):
+    # Fold one log (a values() dict) into the month's totals
+    score = row['health_score']
+    month.log_count += 1
+    month.sleep_sum += row['sleep_hours']
+    month.score_sum += score
+    month.water_sum += row['water_intake']
+    if row['log_type'] == 'EXERCISE':
+        month.workout_count += 1
+        month.calories_burned_sum += row['calories_burned']
+    else:
+        month.food_count += 1
+        month.calories_intake_sum += row['calories_intake']
+
+    month.score_min = score if month.score_min is None else min(month.score_min, score)
+    month.score_max = score if month.score_max is None else max(month.score_max, score)
+    month.sleep_min = row['sleep_hours'] if month.sleep_min is None else min(month.sleep_min, row['sleep_hours'])
+    month.sleep_max = row['sleep_hours'] if month.sleep_max is None else max(month.sleep_max, row['sleep_hours'])
+    if not month.score_counts:
+        month.score_counts = [0] * (MAX_SCORE + 1)
+    month.score_counts[min(MAX_SCORE, max(0, score))] += 1
+
+    if month.latest_date is None or (row['date'], row['id']) >= (month.latest_date, month.latest_log_id):
+        month.latest_date, month.latest_log_id, month.latest_suggestion = row['date'], row['id'], row['suggestion']
+
+
+def _write_rows(relative, rows):
+    # Rows already in the month's file are kept, unless they are being written
+    # again (a run that stopped before deleting them); the new file is swapped in whole
+    target = file_path(relative)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial = f"{target}.{os.getpid()}.part"
+    ids = {row['id'] for row in rows}
+    with gzip.open(partial, 'wt', encoding='utf-8') as out:
+        if os.path.exists(target):
+            with gzip.open(target, 'rt', encoding='utf-8') as old:
+                out.writelines(line for line in old if json.loads(line)['id'] not in ids)
+        for row in rows:
+            out.write(json.dumps(row, default=str) + "\n")
+    os.replace(partial, target)
+
+
+def read_rows(relative):
+    """The original log rows (values() dicts, date parsed) of one archived month's file."""
+    with gzip.open(file_path(relative), 'rt', encoding='utf-8') as lines:
+        for line in lines:
+            row = json.loads(line)
+            row['date'] = datetime.date.fromisoformat(row['date'])
+            yield row
+
+
+def archive_month(user_id, month, keep_raw=True):
+    """Move one user's logs dated in `month` into its ArchivedMonth. Returns the number of logs moved.
+
+    A month archived before keeps the keep_raw it was first archived with.
+    """
+    end = next_month(month)
+    rows = list(
+        HealthLog.objects.filter(user_id=user_id, date__gte=month, date__lt=end).order_by('date', 'id').values(*FIELDS)
+    )
+    if not rows:
+        return 0
+
+    # Mixing the two would leave a file missing some of the month's rows, which
+    # export would miss and restore would take back out of the totals
+    stored = ArchivedMonth.objects.filter(user_id=user_id, month=month).values_list('keep_raw', flat=True).first()
+    if stored is not None and stored != keep_raw:
+        logger.warning("%s for user %s was archived with keep_raw=%s; archiving its new logs the same way",
+                       f"{month:%Y-%m}", user_id, stored)
+        keep_raw = stored
+
+    relative = os.path.join(ARCHIVE_DIR, str(user_id), f"{month:%Y-%m}.ndjson.gz")
+    if keep_raw:
+        # Written before the rows are deleted; if we stop in between, restore skips rows still in HealthLog
+        _write_rows(relative, rows)
+
+    with transaction.atomic():
+        archived = (ArchivedMonth.objects.select_for_update().filter(user_id=user_id, month=month).first()
+                    or ArchivedMonth(user_id=user_id, month=month))
+        for row in rows:
+            _add(archived, row)
+        archived.keep_raw = keep_raw
+        if keep_raw:
+            archived.archive_path = relative
+        archived.save()
+
+        # Not HealthLog.delete(): the logs stay counted in UserSummary. A raw delete,
+        # too: post_delete would touch the profile and the AI cache once per log
+        moved = HealthLog.objects.filter(id__in=[row['id'] for row in rows])
+        moved._raw_delete(moved.db)
+        rollups.rebuild_buckets(user_id, month, end)
+        rolling.rebuild(user_id)  # only moves for users whose latest logs are this old
+        # The PDF report shows archived months differently, so it needs a new version
+        UserSummary.objects.filter(user_id=user_id).update(updated_at=timezone.now())
+        UserProfile.touch([user_id])
+        ai_cache.invalidate(user_id)
+    return len(rows)
+
+
+def archive(before=None, keep_raw=None, user_ids=None):
+    """Archive every month before `before` (default: cutoff()). Returns (months, logs) archived."""
+    before = before or cutoff()
+    if keep_raw is None:
+        keep_raw = getattr(settings, 'ARCHIVE_KEEP_RAW', True)
+    cold = HealthLog.objects.filter(date__lt=before)
+    if user_ids is not None:
+        cold = cold.filter(user_id__in=user_ids)
+
+    months = logs = 0
+    for user_id in list(cold.order_by('user_id').values_list('user_id', flat=True).distinct()):
+        user_months = (cold.filter(user_id=user_id).annotate(month=TruncMonth('date'))
+                       .order_by('month').values_list('month', flat=True).distinct())
+        for month in list(user_months):
+            if isinstance(month, datetime.datetime):  # some backends truncate to a datetime
+                month = month.date()
+            logs += archive_month(user_id, month, keep_raw)
+            months += 1
+    return months, logs
+
+
+def restore(user_id, months=None):
+    """Put a user's archived rows back into HealthLog. Returns the number of logs restored.
+
+    Months whose rows were discarded when archiving stay archived.
+    """
+    archived = ArchivedMonth.objects.filter(user_id=user_id).exclude(archive_path='')
+    if months is not None:
+        archived = archived.filter(month__in=months)
+    archived = list(archived)
+
+    restored = 0
+    with transaction.atomic():
+        for month in archived:
+            rows = list(read_rows(month.archive_path))
+            present = set(HealthLog.objects.filter(id__in=[row['id'] for row in rows]).values_list('id', flat=True))
+            # bulk_create keeps the ids and stored scores; the rollups are rebuilt below
+            logs = [HealthLog(**row) for row in rows if row['id'] not in present]
+            HealthLog.objects.bulk_create(logs)
+            month.delete()
+            restored += len(logs)
+        if archived:
+            rollups.rebuild([user_id])
+
+    for month in archived:
+        try:
+            os.remove(file_path(month.archive_path))
+        except OSError:
+            pass
+    return restored
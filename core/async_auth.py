@@ -0,0 +1,59 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib import auth
+from django.contrib.auth.views import redirect_to_login
+
+from .backends import ProfileBackend
+
+# Session and auth access for async views. Django 4.2 has no async auth API
+# (request.auser(), alogin() and friends arrive in 5.0), so these run the sync
+# functions in a thread and are named after the 5.0 ones, to be swapped for
+# them on upgrade. The user is read once per request (with its profile, see
+# core/backends.py) and cached on the request the way AuthenticationMiddleware
+# does, so request.user is then free to use from async code.
+
+PROFILE_BACKEND = 'core.backends.ProfileBackend'
+
+
+def _get_user(request):
+    user = auth.get_user(request)
+    if user.is_authenticated and request.session.get(auth.BACKEND_SESSION_KEY) != PROFILE_BACKEND:
+        # Logged in through plain ModelBackend, before ProfileBackend: the profile isn't
+        # loaded, and async code can't load it lazily. Load it, and store the session
+        # under ProfileBackend from now on.
+        user = ProfileBackend().get_user(user.pk) or user
+        request.session[auth.BACKEND_SESSION_KEY] = PROFILE_BACKEND
+    return user
+
+
+async def aget_user(request):
+    """The request's user; the session and user are read on first use only."""
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = await sync_to_async(_get_user)(request)
+    return request._cached_user
+
+
+async def alogin(request, user, backend=None):
+    await sync_to_async(auth.login)(request, user, backend)
+    request._cached_user = user
+
+
+async def alogout(request):
+    await sync_to_async(auth.logout)(request)
+    request._cached_user = request.user  # AnonymousUser
+
+
+async def aupdate_session_auth_hash(request, user):
+    await sync_to_async(auth.update_session_auth_hash)(request, user)
+
+
+def login_required(view):
+    """django.contrib.auth's login_required, for async views."""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,615 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache.backends.dummy import DummyCache
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from . import ai_cache, coach_prompt, foods, history, llm, reports, rolling, synthetic, views
+from .fake_llm import FakeLLMServer
+from .models import HealthLog
+from .urls import urlpatterns
+
+# Per-view budgets: (max queries, max p95 latency in ms).
+# Query budgets must not depend on how many logs the user has -- a view that
+# grows with history is an N+1 and should fail here.
+BUDGETS = {
+    'home': (2, 150),
+    'register': (2, 150),
+    'login': (2, 150),
+    'logout': (4, 150),
+    'dashboard': (9, 250),
+    'add_log': (2, 150),
+    'edit_log': (3, 150),
+    'delete_log': (3, 150),
+    'history': (3, 150),
+    'api_logs': (3, 150),
+    'api_trends': (5, 150),
+    'api_foods': (0, 50),
+    'import_logs': (2, 150),
+    'export_logs': (4, 150),  # + the archived months, listed and streamed
+    'export_all': (2, 150),
+    'profile': (2, 250),
+    'tips': (2, 150),
+    'ai_coach': (5, 250),
+    'change_password': (2, 250),
+    'download_pdf': (8, 250),  # + whether a report worker is running, while the PDF is queued
+    'metrics': (2, 150),
+    'password_reset': (2, 150),
+    'password_reset_done': (2, 150),
+    'password_reset_confirm': (3, 150),
+    'password_reset_complete': (2, 150),
+}
+
+# Start-up budgets for a fresh process: (max median seconds, max peak RSS in MB).
+# 'check' is `manage.py check`; 'wsgi' imports the WSGI application and loads the
+# URLconf, which is what a worker does before its first response; 'wsgi_preloaded'
+# also warms up the PDF and LLM libraries (PRELOAD_SERVICES, see core/warmup.py).
+STARTUP_BUDGETS = {
+    'check': (1.0, 70),
+    'wsgi': (1.0, 70),
+    'wsgi_preloaded': (3.0, 150),
+}
+
+# Only imported on first use; a plain 'wsgi' start-up that loads one is a regression
+LAZY_MODULES = ('xhtml2pdf', 'reportlab', 'groq', 'httpx')
+
+WSGI_PROBE = """
+import json, sys
+from healthyio_project.wsgi import application
+from core.warmup import warm_up
+warm_up(['urls'] + sys.argv[1:])
+print(json.dumps(sorted({name.split('.')[0] for name in sys.modules})))
+"""
+
+STUB_AI_RESPONSE = "<p>Stubbed coach response.</p>"
+
+
+@contextmanager
+def stub_llm(**options):
+    # Routes the AI coach to the local stub provider so nothing leaves the machine
+    providers = {'stub': {'BACKEND': 'core.llm.StubProvider', 'REPLY': STUB_AI_RESPONSE, **options}}
+    with override_settings(LLM_PROVIDERS=providers, LLM_ROUTE=['stub']):
+        yield
+
+
+def url_kwargs(name, user):
+    if name in ('edit_log', 'delete_log'):
+        return {'log_id': HealthLog.objects.filter(user=user).values_list('id', flat=True).first() or 0}
+    if name == 'password_reset_confirm':
+        return {'uidb64': 'MQ', 'token': 'set-password'}
+    return {}
+
+
+# Query strings for views that do little without one
+QUERY_STRINGS = {'api_foods': '?q=chi'}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure_view(client, user, name, iterations):
+    url = reverse(name, kwargs=url_kwargs(name, user)) + QUERY_STRINGS.get(name, '')
+    timings, queries = [], []
+    client.force_login(user)
+    if name == 'download_pdf':
+        # Measured with a report worker running; without one the first request builds the PDF itself
+        reports.heartbeat()
+    for _ in range(iterations):
+        if name == 'logout':
+            client.force_login(user)
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+
+    # One extra traced request for memory; tracemalloc would skew the timings
+    if name == 'logout':
+        client.force_login(user)
+    tracemalloc.start()
+    client.get(url)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    max_queries, max_p95 = BUDGETS[name]
+    result = {
+        'view': name,
+        'iterations': iterations,
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'queries': max(queries),
+        'peak_kb': round(peak / 1024, 1),
+        'budget_queries': max_queries,
+        'budget_p95_ms': max_p95,
+    }
+    result['violations'] = []
+    if result['queries'] > max_queries:
+        result['violations'].append(f"{result['queries']} queries > budget {max_queries}")
+    if result['p95_ms'] > max_p95:
+        result['violations'].append(f"p95 {result['p95_ms']}ms > budget {max_p95}ms")
+    return result
+
+
+def run(sizes, iterations=20, views=None, seed=0):
+    """Benchmark every named view in core/urls.py for a user with each history size.
+
+    Expects to run against a throwaway database. Returns a list of result dicts.
+    """
+    names = [p.name for p in urlpatterns if p.name]
+    missing = [name for name in names if name not in BUDGETS]
+    if missing:
+        raise ValueError(f"No benchmark budget for views: {', '.join(missing)}")
+    if views:
+        names = [name for name in names if name in views]
+
+    # The bundled foods, indexed up front like PRELOAD_SERVICES = ['foods'] does
+    foods.load()
+    foods.preload()
+    results = []
+    with stub_llm():
+        for size in sizes:
+            user = synthetic.generate(1, size, seed=seed, prefix=f"bench{size}")[0]
+            client = Client()
+            for name in names:
+                result = measure_view(client, user, name, iterations)
+                result['size'] = size
+                results.append(result)
+    return results
+
+
+def startup_command(name):
+    if name == 'check':
+        return [sys.executable, 'manage.py', 'check', '--settings', settings.SETTINGS_MODULE]
+    return [sys.executable, '-c', WSGI_PROBE] + (['pdf', 'llm'] if name == 'wsgi_preloaded' else [])
+
+
+def start_process(name):
+    """Run one start-up in a fresh interpreter: (seconds, peak RSS in MB, lazy modules it imported)."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+    started = time.perf_counter()
+    process = subprocess.Popen(startup_command(name), cwd=settings.BASE_DIR, env=env, text=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    with process.stdout:
+        output = process.stdout.read()
+    # wait4 rather than wait() for the child's own resource usage (Unix only)
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise RuntimeError(f"{name} start-up failed:\n{output}")
+
+    rss_mb = usage.ru_maxrss / 1024 / (1024 if sys.platform == 'darwin' else 1)  # bytes on macOS, KB elsewhere
+    loaded = [] if name == 'check' else [m for m in LAZY_MODULES if m in json.loads(output.splitlines()[-1])]
+    return seconds, rss_mb, loaded
+
+
+def run_startup(iterations=5):
+    """Time and measure each STARTUP_BUDGETS start-up over `iterations` fresh processes."""
+    results = []
+    for name, (max_seconds, max_mb) in STARTUP_BUDGETS.items():
+        runs = [start_process(name) for _ in range(iterations)]
+        result = {
+            'name': name,
+            'iterations': iterations,
+            'p50_ms': round(statistics.median(run[0] for run in runs) * 1000),
+            'max_ms': round(max(run[0] for run in runs) * 1000),
+            'rss_mb': round(max(run[1] for run in runs), 1),
+            'lazy_loaded': runs[-1][2],
+            'budget_ms': max_seconds * 1000,
+            'budget_mb': max_mb,
+        }
+        result['violations'] = []
+        if result['p50_ms'] > result['budget_ms']:
+            result['violations'].append(f"p50 {result['p50_ms']}ms > budget {result['budget_ms']:.0f}ms")
+        if result['rss_mb'] > max_mb:
+            result['violations'].append(f"RSS {result['rss_mb']}MB > budget {max_mb}MB")
+        if name == 'wsgi' and result['lazy_loaded']:
+            result['violations'].append(f"imports {', '.join(result['lazy_loaded'])} at start-up")
+        results.append(result)
+    return results
+
+
+def run_pagination(rows, users=10, depths=(0, 0.01, 0.1, 0.5, 0.99), page_size=history.PAGE_SIZE,
+                   iterations=20, seed=0):
+    """Latency of one history page at several depths of a user's logs: keyset vs OFFSET.
+
+    `rows` logs are spread over `users` users, so the table is shared like in
+    production. Expects to run against a throwaway database.
+    """
+    per_user = rows // users
+    user = synthetic.generate(users, per_user, days=3650, seed=seed, prefix=f"page{rows}", batch_size=5000)[0]
+    ordered = HealthLog.objects.filter(user=user).order_by('-date', '-id')
+
+    results = []
+    for depth in depths:
+        position = min(per_user - 1, int(depth * per_user))
+        cursor = history.encode_cursor(ordered.only('date', 'id')[position - 1]) if position else None
+        keyset, offset = [], []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            history.page(user, cursor, page_size)
+            keyset.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            list(ordered[position:position + page_size + 1])
+            offset.append((time.perf_counter() - started) * 1000)
+        results.append({
+            'rows': rows,
+            'position': position,
+            'keyset_p50_ms': round(statistics.median(keyset), 2),
+            'keyset_p95_ms': round(percentile(keyset, 95), 2),
+            'offset_p50_ms': round(statistics.median(offset), 2),
+            'offset_p95_ms': round(percentile(offset, 95), 2),
+        })
+    return results
+
+
+PROMPT_LOOKBACKS = (7, 30, 90)
+PROMPT_TOKEN_DELAY = 0.0005  # stub model: seconds of prefill per prompt token
+
+
+def run_prompts(users=5, logs_per_user=730, lookbacks=PROMPT_LOOKBACKS, iterations=10, seed=0,
+                prompt_token_delay=PROMPT_TOKEN_DELAY):
+    """Prompt size, build time and stub-model latency: the raw-logs prompt vs coach_prompt at each look-back.
+
+    The stub model (FakeLLMServer) waits `prompt_token_delay` per prompt token
+    before answering, like a real model's prefill. Expects to run against a
+    throwaway database.
+    """
+    created = synthetic.generate(users, logs_per_user, seed=seed, prefix=f"prompt{logs_per_user}")
+    budget = getattr(settings, 'COACH_PROMPT_TOKENS', coach_prompt.DEFAULT_TOKENS)
+
+    def raw(user, days):
+        logs = views.recent_logs(user)
+        return coach_prompt.raw_logs_prompt(user, user.userprofile, logs, rolling.for_user(user.id))
+
+    def compact(user, days):
+        return coach_prompt.for_user(user, user.userprofile, rolling.for_user(user.id), days)
+
+    builders = [('raw logs', 7, raw)] + [('summary', days, compact) for days in lookbacks]
+    results = []
+    with FakeLLMServer(prompt_token_delay=prompt_token_delay) as server, \
+            override_settings(GROQ_BASE_URL=server.url, LLM_MAX_RETRIES=0):
+        for name, days, build in builders:
+            tokens, build_ms, latency_ms, deterministic = [], [], [], True
+            for user in created:
+                for _ in range(iterations):
+                    started = time.perf_counter()
+                    prompt = build(user, days)
+                    build_ms.append((time.perf_counter() - started) * 1000)
+                    deterministic &= prompt == build(user, days)
+                    started = time.perf_counter()
+                    llm.complete(prompt)
+                    latency_ms.append((time.perf_counter() - started) * 1000)
+                tokens.append(coach_prompt.estimate_tokens(prompt))
+            result = {
+                'builder': name,
+                'days': days,
+                'tokens_p50': round(statistics.median(tokens)),
+                'tokens_max': max(tokens),
+                'build_p50_ms': round(statistics.median(build_ms), 2),
+                'latency_p50_ms': round(statistics.median(latency_ms), 1),
+                'latency_p95_ms': round(percentile(latency_ms, 95), 1),
+                'deterministic': deterministic,
+                'violations': [],
+            }
+            if name == 'summary' and result['tokens_max'] > budget:
+                result['violations'].append(f"{result['tokens_max']} tokens > budget {budget}")
+            if not deterministic:
+                result['violations'].append("prompt changed between two builds")
+            results.append(result)
+    return results
+
+
+# Load-test scenarios for the AI coach: (LLM_ROUTE, LLM_PROVIDERS, other settings).
+# The fast stub has a slow tail (every 10th call takes a second) for hedging to cut.
+STUB = 'core.llm.StubProvider'
+LOAD_SCENARIOS = {
+    'single': (['fast'], {'fast': {'BACKEND': STUB, 'LATENCY': 0.05, 'SLOW_EVERY': 10, 'SLOW_LATENCY': 1.0}}, {}),
+    'hedged': (['fast', 'backup'], {
+        'fast': {'BACKEND': STUB, 'LATENCY': 0.05, 'SLOW_EVERY': 10, 'SLOW_LATENCY': 1.0},
+        'backup': {'BACKEND': STUB, 'LATENCY': 0.08},
+    }, {'LLM_HEDGE_DELAY': 0.15, 'LLM_HEDGE_MIN_SAMPLES': 20}),
+    'flaky': (['flaky'], {'flaky': {'BACKEND': STUB, 'LATENCY': 0.05, 'FAIL_EVERY': 4}},
+              {'LLM_MAX_RETRIES': 0, 'LLM_BREAKER_THRESHOLD': 1000}),
+    'failover': (['flaky', 'backup'], {
+        'flaky': {'BACKEND': STUB, 'LATENCY': 0.05, 'FAIL_EVERY': 4},
+        'backup': {'BACKEND': STUB, 'LATENCY': 0.08},
+    }, {'LLM_MAX_RETRIES': 0, 'LLM_BREAKER_THRESHOLD': 1000}),
+}
+FALLBACK_MARKER = "The AI coach is busy right now"
+
+
+def run_load(users=20, requests=10, scenarios=None, seed=0):
+    """Drive the AI coach page with `users` concurrent users, `requests` each, per LOAD_SCENARIOS entry.
+
+    Every request reaches the LLM: the AI cache is swapped for a dummy one.
+    Expects to run against a throwaway database.
+    """
+    created = synthetic.generate(users, 60, days=30, seed=seed, prefix=f"load{users}")
+    clients = []
+    for user in created:
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+    url = reverse('ai_coach')
+
+    results = []
+    for name in scenarios or LOAD_SCENARIOS:
+        route, providers, extra = LOAD_SCENARIOS[name]
+        latencies, fallbacks = [], []
+        start = threading.Barrier(users + 1)
+
+        def drive(client):
+            try:
+                start.wait()
+                for _ in range(requests):
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    fallbacks.append(FALLBACK_MARKER in response.content.decode())
+            finally:
+                connections.close_all()
+
+        with override_settings(LLM_ROUTE=route, LLM_PROVIDERS=providers, AI_STREAMING=False, **extra), \
+                mock.patch.object(ai_cache, 'get_cache', return_value=DummyCache('load', {})):
+            llm._reset_metrics()
+            threads = [threading.Thread(target=drive, args=(client,)) for client in clients]
+            for thread in threads:
+                thread.start()
+            start.wait()
+            started = time.perf_counter()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            stats = llm.metrics()
+
+        results.append({
+            'scenario': name,
+            'route': route,
+            'users': users,
+            'requests': len(latencies),
+            'p50_ms': round(statistics.median(latencies), 1),
+            'p95_ms': round(percentile(latencies, 95), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+            'per_second': round(len(latencies) / elapsed, 1),
+            'fallbacks': sum(fallbacks),
+            'hedged': stats['hedged'],
+            'hedge_wins': stats['hedge_wins'],
+            'failovers': stats['failovers'],
+            'answered_by': {provider: numbers['successes'] for provider, numbers in stats['providers'].items()},
+        })
+    return results
+
+
+# ASGI against WSGI: the same site served by uvicorn as an ASGI app (async views
+# on the event loop) and through its WSGI adapter, which runs Django in a pool of
+# 10 threads like a threaded WSGI server. Each server is a child process
+# on the benchmark's test database; SERVER_PROBE applies the settings overrides
+# before Django starts. uvicorn and aiohttp are in requirements-dev.txt.
+SERVER_PROBE = """
+import json, sys
+import uvicorn
+from django.conf import settings
+for name, value in json.loads(sys.argv[1]).items():
+    setattr(settings, name, value)
+server, port = sys.argv[2], int(sys.argv[3])
+if server == 'asgi':
+    from healthyio_project.asgi import application as app
+else:
+    from healthyio_project.wsgi import application
+
+    def app(environ, start_response):
+        # Django 4.2 writes Set-Cookie values with a leading space, which uvicorn's HTTP parser refuses
+        def start(status, headers, *exc_info):
+            return start_response(status, [(name, value.strip()) for name, value in headers], *exc_info)
+        return application(environ, start)
+uvicorn.run(app, host='127.0.0.1', port=port, interface='asgi3' if server == 'asgi' else 'wsgi',
+            log_level='warning', access_log=False)
+"""
+SERVERS = ('asgi', 'wsgi')
+SERVER_VIEWS = ('dashboard', 'ai_coach')
+SERVER_LLM_LATENCY = 1.0  # stub provider: seconds per AI coach answer, about a fast real one
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def serve(server, overrides, timeout=30):
+    """Run the site under uvicorn in a child process; yields its base URL."""
+    port = free_port()
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+    process = subprocess.Popen([sys.executable, '-c', SERVER_PROBE, json.dumps(overrides, default=str), server, str(port)],
+                               cwd=settings.BASE_DIR, env=env)
+    try:
+        started = time.monotonic()
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() - started > timeout:
+                    raise RuntimeError(f"uvicorn ({server}) did not start")
+                time.sleep(0.1)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+async def drive(url, cookies, concurrency, requests):
+    """GET `url` from `concurrency` connections, `requests` times each, after one warm-up round.
+
+    Returns (latencies in ms, non-200 responses, seconds).
+    """
+    import aiohttp
+
+    latencies, errors = [], []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    # Sessions are sent by hand; the jar would mix up the users' cookies
+    async with aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar(),
+                                     timeout=aiohttp.ClientTimeout(total=120)) as session:
+        async def user(number, count, record=True):
+            headers = {'Cookie': cookies[number % len(cookies)]}
+            for _ in range(count):
+                started = time.perf_counter()
+                async with session.get(url, headers=headers, allow_redirects=False) as response:
+                    await response.read()
+                if record:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    errors.append(response.status != 200)
+
+        # Opens the connections and fills each server process's caches
+        await asyncio.gather(*(user(number, 1, record=False) for number in range(concurrency)))
+        started = time.perf_counter()
+        await asyncio.gather(*(user(number, requests) for number in range(concurrency)))
+        return latencies, sum(errors), time.perf_counter() - started
+
+
+def run_servers(concurrency=100, requests=20, users=20, servers=SERVERS, views=SERVER_VIEWS, seed=0):
+    """Requests/sec and tail latency of SERVER_VIEWS under uvicorn, as ASGI and as WSGI.
+
+    The AI coach answers from a stub provider after SERVER_LLM_LATENCY seconds
+    and its cache is off, so every coach request waits on the "provider".
+    Expects to run against a throwaway database the child processes can open
+    (not SQLite in memory).
+    """
+    created = synthetic.generate(users, 60, days=30, seed=seed, prefix=f"serve{users}")
+    cookies = []
+    for user in created:
+        client = Client()
+        client.force_login(user)
+        cookies.append(f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}")
+    connections.close_all()
+
+    overrides = {
+        'DATABASES': {'default': connection.settings_dict},
+        'DATABASE_REPLICAS': [],
+        'CACHES': dict(settings.CACHES, ai={'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}),
+        'AI_CACHE_ALIAS': 'ai',
+        'AI_STREAMING': False,
+        'LLM_PROVIDERS': {'stub': {'BACKEND': STUB, 'REPLY': STUB_AI_RESPONSE, 'LATENCY': SERVER_LLM_LATENCY}},
+        'LLM_ROUTE': ['stub'],
+        # So the page, not the provider cap, is what gets measured
+        'LLM_MAX_CONCURRENCY': concurrency,
+        'ALLOWED_HOSTS': ['127.0.0.1'],
+        'METRICS_SLOW_REQUEST_MS': 60_000,
+    }
+
+    results = []
+    for server in servers:
+        with serve(server, overrides) as base_url:
+            for name in views:
+                latencies, errors, elapsed = asyncio.run(drive(base_url + reverse(name), cookies, concurrency, requests))
+                results.append({
+                    'server': server,
+                    'view': name,
+                    'concurrency': concurrency,
+                    'requests': len(latencies),
+                    'per_second': round(len(latencies) / elapsed, 1),
+                    'p50_ms': round(statistics.median(latencies), 1),
+                    'p95_ms': round(percentile(latencies, 95), 1),
+                    'p99_ms': round(percentile(latencies, 99), 1),
+                    'errors': errors,
+                })
+    return results
+
+
+# Food search: index sizes, and budgets for (max lookup p95 in µs, max index MB per 100k foods)
+FOOD_SIZES = (1000, 10_000, 100_000, 200_000)
+FOOD_BUDGETS = {'lookup_p95_us': 200, 'mb_per_100k': 60}
+BRAND_SYLLABLES = ('ka', 'lo', 'mi', 'ver', 'sun', 'to', 'ra', 'bel', 'no', 'fi', 'gran', 'zu', 'pe', 'dor', 'al')
+QUALIFIERS = ('organic', 'light', 'classic', 'low fat', 'family size', 'homestyle', 'extra', 'original',
+              'spicy', 'frozen', 'fresh', 'mini', 'wholegrain', 'salted', 'unsalted', 'sweetened')
+
+
+def synthetic_foods(count, seed=0):
+    """`count` index rows like a branded food database: "<Brand> <qualifier> <bundled food>", all distinct."""
+    rng = random.Random(seed)
+    base = [(food.name, food.serving, *(getattr(food, field) for field in foods.NUMBERS))
+            for food in foods.read(foods.DATA_PATH)]
+    names, rows = set(), []
+    while len(rows) < count:
+        brand = "".join(rng.choice(BRAND_SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        name, serving, grams, *nutrients = rng.choice(base)
+        name = f"{brand} {rng.choice(QUALIFIERS)} {name}"
+        if name in names:
+            continue
+        names.add(name)
+        noisy = [round(value * rng.uniform(0.8, 1.2), 1) for value in nutrients]
+        rows.append((len(rows) + 1, name, serving, grams, *noisy))
+    return rows
+
+
+def run_foods(sizes=FOOD_SIZES, lookups=2000, requests=200, seed=0):
+    """Build time, memory and lookup latency of the food index at each size, plus the endpoint's latency.
+
+    Queries are random 1-8 character prefixes of words in the indexed names, as
+    typed into the search box. The endpoint runs against the same index, so it
+    needs no Food rows, but does need the test environment.
+    """
+    rng = random.Random(seed)
+    results = []
+    for size in sizes:
+        rows = synthetic_foods(size, seed)
+        started = time.perf_counter()
+        index = foods.FoodIndex(rows)
+        build_s = time.perf_counter() - started
+
+        words = [word for _, name, *_ in rng.sample(rows, min(len(rows), 500)) for word in foods.normalize(name).split()]
+        queries = [rng.choice(words)[:rng.randint(1, 8)] for _ in range(lookups)]
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query)
+            latencies.append((time.perf_counter() - started) * 1_000_000)
+
+        client, endpoint = Client(), []
+        with mock.patch.object(foods, '_index', index):
+            for query in queries[:requests]:
+                started = time.perf_counter()
+                client.get(reverse('api_foods'), {'q': query})
+                endpoint.append((time.perf_counter() - started) * 1000)
+
+        mb = index.nbytes() / 1024 / 1024
+        result = {
+            'foods': size,
+            'entries': len(index.entries),
+            'build_s': round(build_s, 2),
+            'index_mb': round(mb, 1),
+            'lookup_p50_us': round(statistics.median(latencies), 1),
+            'lookup_p95_us': round(percentile(latencies, 95), 1),
+            'lookup_p99_us': round(percentile(latencies, 99), 1),
+            'endpoint_p50_ms': round(statistics.median(endpoint), 2),
+            'endpoint_p95_ms': round(percentile(endpoint, 95), 2),
+            'violations': [],
+        }
+        if result['lookup_p95_us'] > FOOD_BUDGETS['lookup_p95_us']:
+            result['violations'].append(f"lookup p95 {result['lookup_p95_us']}µs > {FOOD_BUDGETS['lookup_p95_us']}µs")
+        if mb * 100_000 / size > FOOD_BUDGETS['mb_per_100k'] and size >= 10_000:
+            result['violations'].append(f"{result['index_mb']} MB > {FOOD_BUDGETS['mb_per_100k']} MB per 100k foods")
+        results.append(result)
+    return results
@@ -0,0 +1,152 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from . import ai_cache, coach_prompt, llm, rolling
+from .models import CoachSummary, RollingState, UserSummary
+from .views import AI_MODEL
+
+# The AI coach page for every active user, computed overnight by
+# `manage.py run_coach_batch` so the page is a row read instead of an LLM call.
+# Users are loaded a batch at a time and handed to a fixed number of asyncio
+# workers, which wait on token buckets sized to the provider's quotas. Each
+# answer is saved as soon as it arrives and users whose prompt is unchanged
+# are skipped, so a run that crashed just picks up where it stopped.
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+REPLY_TOKENS = 600  # expected reply length, charged against the token quota up front
+BURST_SECONDS = 10  # a bucket holds this many seconds of quota
+
+
+class TokenBucket:
+    """Hands out `rate` units per second on average, in bursts of at most `capacity`."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        # Callers queue on the lock, so they are served in order
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def per_minute(quota):
+    # A bucket for a provider limit given per minute
+    rate = quota / 60
+    return TokenBucket(rate, max(1, rate * BURST_SECONDS))
+
+
+def next_user_ids(days, after, size):
+    # Users with a log in the last `days` days, in id order
+    since = datetime.date.today() - datetime.timedelta(days=days)
+    active = UserSummary.objects.filter(latest_date__gte=since, user_id__gt=after).order_by('user_id')
+    return list(active.values_list('user_id', flat=True)[:size])
+
+
+def prepare(user_ids):
+    """([(user_id, inputs_key, prompt)] to send, number skipped as unchanged) for a batch of users.
+
+    Four queries per batch: the users with their profiles, their rolling
+    states, their daily sums over the look-back window (one GROUP BY) and the
+    keys of their stored summaries.
+    """
+    # Users without a rolling state yet are left to the coach page, which computes one
+    windows = {state.user_id: rolling.features(state) for state in RollingState.objects.filter(user_id__in=user_ids)}
+    windows = {user_id: window for user_id, window in windows.items() if window}
+    days = coach_prompt.lookback_days()
+    rows = {}
+    if windows:
+        since = min(window['end_date'] for window in windows.values()) - datetime.timedelta(days=days - 1)
+        rows = coach_prompt.daily_rows(list(windows), since)
+    stored = dict(CoachSummary.objects.filter(user_id__in=user_ids).values_list('user_id', 'inputs_key'))
+
+    jobs, unchanged = [], 0
+    for user in User.objects.filter(id__in=user_ids).select_related('userprofile'):
+        profile = getattr(user, 'userprofile', None)
+        window = windows.get(user.id)
+        if profile is None or window is None:
+            continue
+        # Same prompt as the coach page builds, so the page can tell the summary is current
+        prompt = coach_prompt.build(user, profile, rows.get(user.id, []), window['end_date'], window, days)
+        key = ai_cache.make_key(AI_MODEL, prompt)
+        if stored.get(user.id) == key:
+            unchanged += 1
+            continue
+        jobs.append((user.id, key, prompt))
+    return jobs, unchanged
+
+
+def save(user_id, inputs_key, content):
+    CoachSummary.objects.update_or_create(
+        user_id=user_id, defaults={'inputs_key': inputs_key, 'model': AI_MODEL, 'content': content},
+    )
+
+
+async def run(days=7, concurrency=None, rpm=None, tpm=None, batch_size=BATCH_SIZE):
+    """Write a coach summary for every user active in the last `days` days.
+
+    Returns {'written', 'unchanged', 'failed'} counts. Failed users keep their
+    old summary (if any) and are retried by the next run.
+    """
+    concurrency = concurrency or getattr(settings, 'COACH_BATCH_CONCURRENCY', 4)
+    requests = per_minute(rpm or getattr(settings, 'COACH_BATCH_RPM', 30))
+    tokens = per_minute(tpm or getattr(settings, 'COACH_BATCH_TPM', 6000))
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    counts = {'written': 0, 'unchanged': 0, 'failed': 0}
+
+    async def produce():
+        after = 0
+        while True:
+            user_ids = await sync_to_async(next_user_ids)(days, after, batch_size)
+            if not user_ids:
+                break
+            after = user_ids[-1]
+            jobs, unchanged = await sync_to_async(prepare)(user_ids)
+            counts['unchanged'] += unchanged
+            for job in jobs:
+                await queue.put(job)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def work():
+        while (job := await queue.get()) is not None:
+            user_id, inputs_key, prompt = job
+            await requests.acquire()
+            await tokens.acquire(coach_prompt.estimate_tokens(prompt) + REPLY_TOKENS)
+            try:
+                content = await llm.acomplete(prompt)
+            except llm.LLMUnavailable as e:
+                counts['failed'] += 1
+                logger.warning("Coach summary for user %s failed: %s", user_id, e)
+                continue
+            await sync_to_async(save)(user_id, inputs_key, content)
+            counts['written'] += 1
+
+    # A worker that raises (say, the database went away) stops the whole run
+    tasks = [asyncio.create_task(produce())] + [asyncio.create_task(work()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return counts
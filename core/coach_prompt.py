@@ -0,0 +1,248 @@
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Max, Min, Q, Sum
+
+from .models import HealthLog
+
+# The AI coach prompt. Rather than pasting raw logs, the last
+# COACH_LOOKBACK_DAYS days up to the user's latest log are aggregated by the
+# database into one row per day and written up as a few lines of statistics:
+# averages and ranges, trends per week, streaks and the macro split. A 90-day
+# look-back costs fewer tokens than the seven raw logs the page used to send.
+# Lines are added in priority order while they fit in COACH_PROMPT_TOKENS. The text depends
+# only on the data (the window ends at the latest log, not today), so the same
+# history always gives the same prompt, which is also the AI cache key.
+
+DEFAULT_LOOKBACK_DAYS = 30
+DEFAULT_TOKENS = 500
+CHARS_PER_TOKEN = 4  # rough average for English text
+HYDRATED_GLASSES = 8
+# kcal per gram
+MACRO_CALORIES = (('protein', 4), ('carbs', 4), ('fats', 9))
+EXERCISE_TYPES = [value for value, _ in HealthLog.EXERCISE_CHOICES if value != 'None']
+
+DAY_SUMS = {
+    'logs': Count('id'),
+    'workouts': Count('id', filter=Q(log_type='EXERCISE')),
+    'food_logs': Count('id', filter=~Q(log_type='EXERCISE')),
+    'score_sum': Sum('health_score'),
+    'score_min': Min('health_score'),
+    'score_max': Max('health_score'),
+    'sleep_sum': Sum('sleep_hours'),
+    'sleep_min': Min('sleep_hours'),
+    'sleep_max': Max('sleep_hours'),
+    'water_sum': Sum('water_intake'),
+    'intake': Sum('calories_intake', filter=~Q(log_type='EXERCISE')),
+    'burned': Sum('calories_burned', filter=Q(log_type='EXERCISE')),
+    'protein': Sum('protein', filter=~Q(log_type='EXERCISE')),
+    'carbs': Sum('carbs', filter=~Q(log_type='EXERCISE')),
+    'fats': Sum('fats', filter=~Q(log_type='EXERCISE')),
+    **{f'type_{name}': Count('id', filter=Q(log_type='EXERCISE', exercise_type=name)) for name in EXERCISE_TYPES},
+}
+
+INSTRUCTIONS = """Based on their BMI status ({bmi_status}) and this summary, provide:
+1. A summary of their recent weeks.
+2. Three actionable improvements specific to their body type.
+3. Use a motivating tone.
+Format with HTML tags."""
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def lookback_days():
+    return getattr(settings, 'COACH_LOOKBACK_DAYS', DEFAULT_LOOKBACK_DAYS)
+
+
+def _day_sums(user_ids, since):
+    return (
+        HealthLog.objects.filter(user_id__in=user_ids, date__gte=since)
+        .values('user_id', 'date').order_by('user_id', 'date')
+        .annotate(**DAY_SUMS)
+    )
+
+
+def daily_rows(user_ids, since):
+    """{user_id: [one dict of DAY_SUMS per logged day since `since`, oldest first]} in one GROUP BY."""
+    return _by_user(_day_sums(user_ids, since))
+
+
+async def adaily_rows(user_ids, since):
+    return _by_user([row async for row in _day_sums(user_ids, since)])
+
+
+def _by_user(rows):
+    by_user = {}
+    for row in rows:
+        # Rounded so the text doesn't depend on the order the database added things up in
+        by_user.setdefault(row['user_id'], []).append(
+            {key: round(value, 6) if isinstance(value, float) else (value or 0) if key != 'date' else value
+             for key, value in row.items()}
+        )
+    return by_user
+
+
+def _slope_per_week(points):
+    # Least-squares slope of (day number, value) pairs, per 7 days
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return None
+    return 7 * sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def _trend(slope, unit=""):
+    if slope is None:
+        return ""
+    return f", trend {round(slope, 1) or 0.0:+}{unit}/week"
+
+
+def _number(value):
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def summary_lines(rows, end, days, window=None):
+    """The statistics, most important first, as a list of lines."""
+    if not rows:
+        return []
+    start = end - timedelta(days=days - 1)
+    total = {key: sum(row[key] for row in rows) for key in DAY_SUMS if not key.endswith(('_min', '_max'))}
+    logs = total['logs']
+    daily_score = [((row['date'] - start).days, row['score_sum'] / row['logs']) for row in rows]
+    daily_sleep = [((row['date'] - start).days, row['sleep_sum'] / row['logs']) for row in rows]
+    hydrated = sum(1 for row in rows if row['water_sum'] >= HYDRATED_GLASSES * row['logs'])
+
+    lines = [
+        f"LAST {days} DAYS ({start} to {end}): {len(rows)} days logged, {logs} logs, {total['workouts']} workouts",
+        f"- Health score: avg {round(total['score_sum'] / logs)}, range {min(r['score_min'] for r in rows)}-"
+        f"{max(r['score_max'] for r in rows)}{_trend(_slope_per_week(daily_score))}",
+        f"- Sleep: avg {total['sleep_sum'] / logs:.1f}h, range {_number(min(r['sleep_min'] for r in rows))}-"
+        f"{_number(max(r['sleep_max'] for r in rows))}h{_trend(_slope_per_week(daily_sleep), 'h')}",
+        f"- Water: avg {total['water_sum'] / logs:.1f} glasses, target met on {hydrated} of {len(rows)} days",
+    ]
+
+    weeks = days / 7
+    calories = []
+    if total['food_logs']:
+        calories.append(f"eaten {round(total['intake'] / total['food_logs'])} per food log")
+    if total['workouts']:
+        calories.append(f"burned {round(total['burned'] / total['workouts'])} per workout")
+    calories.append(f"balance {round((total['intake'] - total['burned']) / weeks):+} kcal/week")
+    lines.append("- Calories: " + ", ".join(calories))
+
+    macro_kcal = {name: total[name] * kcal for name, kcal in MACRO_CALORIES}
+    if sum(macro_kcal.values()):
+        split = ", ".join(f"{name} {round(100 * value / sum(macro_kcal.values()))}%"
+                          for name, value in macro_kcal.items())
+        lines.append(f"- Macros (share of calories): {split}; protein {total['protein'] / len(rows):.0f}g per logged day")
+
+    if window:
+        lines.append(f"- Streaks: logging {window['logging_streak']} days, hydration {window['hydration_streak']} days")
+    types = [f"{name} {total[f'type_{name}']}" for name in EXERCISE_TYPES if total[f'type_{name}']]
+    if types:
+        lines.append("- Workouts: " + ", ".join(types))
+
+    if days >= 14:
+        # Average score per 7-day block, oldest first
+        blocks = {}
+        for row in rows:
+            block = blocks.setdefault((end - row['date']).days // 7, [0, 0])
+            block[0] += row['score_sum']
+            block[1] += row['logs']
+        weekly = [str(round(blocks[k][0] / blocks[k][1])) if k in blocks else "-" for k in range(math.ceil(days / 7))]
+        lines.append("- Score by week (oldest first): " + ", ".join(reversed(weekly)))
+    return lines
+
+
+def build(user, profile, rows, end, window=None, days=None, budget=None):
+    """The coach prompt for one user, at most `budget` (default COACH_PROMPT_TOKENS) tokens.
+
+    `rows` are the user's daily_rows() (others are ignored); `window` is
+    rolling.features() for the streaks. Raises ValueError if even the profile
+    and instructions don't fit.
+    """
+    days = days or lookback_days()
+    budget = budget or getattr(settings, 'COACH_PROMPT_TOKENS', DEFAULT_TOKENS)
+    head = (
+        "Act as a professional Health Coach.\n"
+        "USER PROFILE:\n"
+        f"- Name: {user.first_name}\n"
+        f"- Age: {profile.age}\n"
+        f"- Weight: {profile.weight}kg, Height: {profile.height}cm\n"
+        f"- BMI: {profile.get_bmi()} ({profile.get_bmi_status()})\n\n"
+    )
+    tail = "\n\n" + INSTRUCTIONS.format(bmi_status=profile.get_bmi_status())
+    used = estimate_tokens(head + tail)
+    if used > budget:
+        raise ValueError(f"A coach prompt needs at least {used} tokens, the budget is {budget}")
+
+    start = end - timedelta(days=days - 1)
+    kept = []
+    for line in summary_lines([row for row in rows if start <= row['date'] <= end], end, days, window):
+        cost = estimate_tokens(line + "\n")
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    return head + "\n".join(kept) + tail
+
+
+def raw_logs_prompt(user, profile, logs, window=None):
+    """The previous prompt: the last seven logs pasted line by line.
+
+    Kept as the baseline for `manage.py benchmark --prompts`.
+    """
+    data_summary = ""
+    for log in logs:
+        data_summary += f"- Date: {log.date}, Type: {log.log_type}, Score: {log.health_score}, Sleep: {log.sleep_hours}h, Water: {log.water_intake}gls\n"
+
+    window_summary = ""
+    if window:
+        window_summary = (
+            f"LAST 7 DAYS (up to {window['end_date']}):\n"
+            f"    - Logged on {window['days_logged']} days; logging streak: {window['logging_streak']} days\n"
+            f"    - Average sleep: {window['avg_sleep']}h, average water: {window['avg_water']}gls, "
+            f"hydration streak: {window['hydration_streak']} days\n"
+            f"    - Calorie balance (eaten minus burned): {window['calorie_balance']:+} kcal\n"
+        )
+
+    prompt = f"""
+    Act as a professional Health Coach.
+    USER PROFILE:
+    - Name: {user.first_name}
+    - Age: {profile.age}
+    - Weight: {profile.weight}kg, Height: {profile.height}cm
+    - BMI: {profile.get_bmi()} ({profile.get_bmi_status()})
+
+    RECENT LOGS:
+    {data_summary}
+    {window_summary}
+
+    Based on their BMI status ({profile.get_bmi_status()}) and logs, provide:
+    1. A summary of their week.
+    2. Three actionable improvements specific to their body type.
+    3. Use a motivating tone.
+    Format with HTML tags.
+    """
+    return prompt
+
+
+def for_user(user, profile, window, days=None, budget=None):
+    """build() for one user, reading their daily rows (one query). `window` is rolling.features()."""
+    days = days or lookback_days()
+    end = window['end_date']
+    rows = daily_rows([user.id], end - timedelta(days=days - 1)).get(user.id, [])
+    return build(user, profile, rows, end, window, days, budget)
+
+
+async def afor_user(user, profile, window, days=None, budget=None):
+    days = days or lookback_days()
+    end = window['end_date']
+    rows = (await adaily_rows([user.id], end - timedelta(days=days - 1))).get(user.id, [])
+    return build(user, profile, rows, end, window, days, budget)
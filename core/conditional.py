@@ -0,0 +1,129 @@
+import datetime
+import functools
+import hashlib
+import os
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+# Conditional GETs (ETag / Last-Modified -> 304 Not Modified). Validators are
+# built from values already in memory -- the user's data_changed_at, loaded
+# with request.user (see core/backends.py), and a stamp of the templates and
+# code read once per process -- so answering a 304 costs no query, no template
+# and no PDF work. Responses are marked private and must be revalidated each
+# time, so a browser always asks before reusing a page.
+
+SITE_ROOTS = (os.path.join(settings.BASE_DIR, 'core'),)
+SITE_EXTENSIONS = ('.py', '.html')
+
+
+def _site_stamp():
+    # (hash, newest mtime) of every template and module a page could be built from
+    digest = hashlib.sha256()
+    newest = 0
+    for root in SITE_ROOTS:
+        for directory, dirs, files in sorted(os.walk(root)):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.endswith(SITE_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, name)
+                with open(path, 'rb') as f:
+                    digest.update(path.encode() + b'\0' + f.read())
+                newest = max(newest, os.path.getmtime(path))
+    return digest.hexdigest()[:16], datetime.datetime.fromtimestamp(int(newest), datetime.timezone.utc)
+
+
+SITE_VERSION, SITE_MODIFIED = _site_stamp()
+
+
+def _etag(*parts):
+    return '"' + hashlib.sha256(repr((SITE_VERSION,) + parts).encode()).hexdigest()[:32] + '"'
+
+
+def conditional(validators):
+    """Decorator: answer GET/HEAD with 304 when `validators(request)` still matches.
+
+    `validators` returns (etag, last_modified), or None to serve the view as
+    usual. Only 200 responses that may be stored get the validators, so a
+    "being prepared" page or a redirect is never revalidated into a 304.
+    Works on async views too; `validators` must not query the database.
+    """
+    def check(request):
+        # (etag, last_modified, 304 response or None), or None to just serve the view
+        found = validators(request) if request.method in ('GET', 'HEAD') else None
+        if found is None:
+            return None
+        etag, last_modified = found
+        last_modified = int(last_modified.timestamp())
+        return etag, last_modified, get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    def stamp(response, etag, last_modified):
+        response.headers.setdefault('ETag', etag)
+        response.headers.setdefault('Last-Modified', http_date(last_modified))
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def storable(response):
+        return response.status_code == 200 and 'no-store' not in response.get('Cache-Control', '')
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                checked = check(request)
+                if checked is None:
+                    return await view(request, *args, **kwargs)
+                etag, last_modified, response = checked
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                    if not storable(response):
+                        return response
+                return stamp(response, etag, last_modified)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            checked = check(request)
+            if checked is None:
+                return view(request, *args, **kwargs)
+            etag, last_modified, response = checked
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if not storable(response):
+                    return response
+            return stamp(response, etag, last_modified)
+        return wrapper
+    return decorator
+
+
+def user_data(*parts):
+    """For pages built from the request user's data: valid until their data_changed_at moves.
+
+    `parts` go into the ETag too, e.g. a template version. The CSRF secret
+    does as well, since the pages carry forms.
+    """
+    def validators(request):
+        profile = getattr(request.user, 'userprofile', None)
+        if profile is None:
+            return None
+        changed = profile.data_changed_at
+        etag = _etag(request.user.pk, changed.isoformat(), request.META.get('CSRF_COOKIE', ''), *parts)
+        return etag, max(changed, SITE_MODIFIED)
+    return conditional(validators)
+
+
+def static_page(anonymous_only=False):
+    """For pages that only change with a deploy: valid for as long as this build is running.
+
+    The header shows who is logged in, so the user is part of the ETag. With
+    `anonymous_only`, logged-in users get the view as usual (e.g. a redirect).
+    """
+    def validators(request):
+        if anonymous_only and request.user.is_authenticated:
+            return None
+        who = (request.user.pk, request.user.get_username()) if request.user.is_authenticated else None
+        return _etag(who, request.META.get('CSRF_COOKIE', '')), SITE_MODIFIED
+    return conditional(validators)
@@ -0,0 +1,147 @@
+import csv
+import datetime
+import heapq
+import json
+import logging
+from datetime import timedelta
+
+from django.db import router
+from django.db.models import Max, Min
+
+from . import archive
+from .models import ArchivedMonth, HealthLog
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+# Rows fetched per round trip (a server-side cursor on PostgreSQL) and rows per chunk sent to the client
+CHUNK_SIZE = 2000
+ROWS_PER_WRITE = 500
+
+# Same columns as the importer reads, so an export can be imported again;
+# external_id keeps a re-import from duplicating rows
+COLUMNS = (
+    'date', 'log_type', 'sleep_hours', 'water_intake', 'exercise_type', 'calories_burned',
+    'calories_intake', 'protein', 'carbs', 'fats', 'health_score', 'suggestion',
+)
+BULK_COLUMNS = ('user_id', 'username') + COLUMNS
+
+
+class _Line:
+    # csv.writer wants a file; hand each formatted line straight back instead
+    def write(self, value):
+        return value
+
+
+def _encode(fmt, header):
+    if fmt == 'csv':
+        writer = csv.writer(_Line())
+        return writer.writerow
+    return lambda values: json.dumps(dict(zip(header, values)), default=str) + "\n"
+
+
+def stream(rows, header, fmt):
+    """Yield the encoded export a few hundred rows at a time.
+
+    `rows` is an iterator of value tuples in `header` order; nothing is held
+    in memory beyond the current chunk.
+    """
+    encode = _encode(fmt, header)
+    if fmt == 'csv':
+        yield encode(header).encode()
+
+    buffer = []
+    for values in rows:
+        buffer.append(encode(values))
+        if len(buffer) >= ROWS_PER_WRITE:
+            yield "".join(buffer).encode()
+            buffer = []
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+def _with_external_id(rows):
+    # The log id goes out as external_id, the column the importer dedupes on
+    for values in rows:
+        yield values[1:] + (values[0],)
+
+
+def _archived_rows(user, using):
+    # Rows `manage.py archive_logs` moved out of HealthLog, read back from the month files in (date, id) order
+    months = (ArchivedMonth.objects.using(using).filter(user=user).exclude(archive_path='')
+              .order_by('month').values_list('archive_path', flat=True))
+    for path in months.iterator():
+        try:
+            for row in archive.read_rows(path):
+                yield (row['id'],) + tuple(row[column] for column in COLUMNS)
+        except FileNotFoundError:
+            logger.warning("Archive file %s is missing; its logs are not in the export", path)
+
+
+def _unique(rows):
+    # A month whose archiving stopped halfway has rows in the file and the table; they sort next to each other
+    last_id = None
+    for values in rows:
+        if values[0] != last_id:
+            yield values
+        last_id = values[0]
+
+
+def omitted_months(user):
+    """Archived months of `user` whose rows were discarded (ARCHIVE_KEEP_RAW = False), so no export has them."""
+    return list(ArchivedMonth.objects.filter(user=user, archive_path='').order_by('month').values_list('month', flat=True))
+
+
+def user_rows(user):
+    """The user's logs oldest first, archived months included."""
+    logs = HealthLog.objects.filter(user=user).order_by('date', 'id').values_list('id', *COLUMNS)
+    # Choose the database now: the rows are read after the view has returned
+    logs = logs.using(logs.db)
+    merged = heapq.merge(_archived_rows(user, logs.db), logs.iterator(chunk_size=CHUNK_SIZE),
+                         key=lambda values: (values[1], values[0]))  # (date, id)
+    return _with_external_id(_unique(merged))
+
+
+def user_export(user, fmt):
+    return stream(user_rows(user), COLUMNS + ('external_id',), fmt)
+
+
+def date_partitions(start, end, days):
+    # [start, end] split into consecutive half-open ranges of `days` days
+    lo = start
+    while lo <= end:
+        hi = min(lo + timedelta(days=days), end + timedelta(days=1))
+        yield lo, hi
+        lo = hi
+
+
+def bulk_rows(start=None, end=None, days=31, using=None):
+    """Every user's logs between start and end (inclusive), one date range at a time.
+
+    Each partition is a separate, bounded query over the date index instead of
+    one cursor held open across the whole table. Only logs still in HealthLog
+    are included; archived months are in ArchivedMonth (totals) and their files.
+    """
+    logs = HealthLog.objects.using(using).order_by()
+    if start is None or end is None:
+        bounds = logs.aggregate(first=Min('date'), last=Max('date'))
+        start = start or bounds['first']
+        end = end or bounds['last']
+    if start is None or end is None:
+        return
+
+    columns = ('user_id', 'user__username') + COLUMNS
+    for lo, hi in date_partitions(start, end, days):
+        part = logs.filter(date__gte=lo, date__lt=hi).order_by('date', 'id').values_list('id', *columns)
+        yield from _with_external_id(part.iterator(chunk_size=CHUNK_SIZE))
+
+
+def bulk_export(fmt, start=None, end=None, days=31):
+    using = router.db_for_read(HealthLog)  # see user_rows
+    return stream(bulk_rows(start, end, days, using), BULK_COLUMNS + ('external_id',), fmt)
+
+
+def filename(prefix, fmt):
+    return f"{prefix}-{datetime.date.today().isoformat()}.{'csv' if fmt == 'csv' else 'ndjson'}"
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import threading
+import time
+
+# A tiny OpenAI/Groq-compatible chat completions server for tests and load tests.
+# Point the client's base_url at FakeLLMServer.url; nothing leaves the machine.
+
+
+class FakeLLMServer:
+    def __init__(self, reply="<p>Keep it up!</p>", token_delay=0.0, latency=0.0, fail_every=0, prompt_token_delay=0.0):
+        self.reply = reply
+        self.token_delay = token_delay  # seconds between streamed tokens
+        self.latency = latency  # seconds before the first byte
+        self.prompt_token_delay = prompt_token_delay  # more seconds before the first byte per prompt token
+        self.fail_every = fail_every  # every Nth request returns a 500
+        self.requests = []
+        self.disconnects = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0  # most requests handled at once
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    def tokens(self):
+        words = self.reply.split(" ")
+        return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, '127.0.0.1', 0))
+            port = self._server.sockets[0].getsockname()[1]
+            self.url = f"http://127.0.0.1:{port}"
+            ready.set()
+            self._loop.run_forever()
+            # Let in-flight handlers unwind before closing the loop
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        def shutdown():
+            self._server.close()
+            self._loop.stop()
+
+        self._loop.call_soon_threadsafe(shutdown)
+        self._thread.join()
+
+    async def _handle(self, reader, writer):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode().partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            payload = json.loads(body or b'{}')
+            self.requests.append({'path': request_line.split()[1].decode(), 'body': payload, 'at': time.monotonic()})
+
+            delay = self.latency + self.prompt_token_delay * self.prompt_tokens(payload)
+            if delay:
+                await asyncio.sleep(delay)
+            if self.fail_every and len(self.requests) % self.fail_every == 0:
+                await self._send(writer, 500, 'application/json', json.dumps({'error': {'message': "fake failure"}}))
+            elif payload.get('stream'):
+                await self._stream(writer, payload)
+            else:
+                await self._send(writer, 200, 'application/json', json.dumps(self._completion(payload)))
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            self.disconnects += 1
+        finally:
+            self.in_flight -= 1
+            writer.close()
+
+    @staticmethod
+    def prompt_tokens(payload):
+        # ~4 characters per token, like a real tokenizer on English text
+        chars = sum(len(message.get('content') or "") for message in payload.get('messages', []))
+        return -(-chars // 4)
+
+    def _completion(self, payload):
+        return {
+            'id': 'fake', 'object': 'chat.completion', 'created': int(time.time()), 'model': payload.get('model', ''),
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': self.reply}}],
+            'usage': {'prompt_tokens': self.prompt_tokens(payload), 'completion_tokens': len(self.tokens()),
+                      'total_tokens': self.prompt_tokens(payload) + len(self.tokens())},
+        }
+
+    async def _send(self, writer, status, content_type, body):
+        writer.write(
+            f"HTTP/1.1 {status} OK\r\nContent-Type: {content_type}\r\nContent-Length: {len(body.encode())}\r\n"
+            f"Connection: close\r\n\r\n{body}".encode()
+        )
+        await writer.drain()
+
+    async def _stream(self, writer, payload):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nConnection: close\r\n\r\n")
+        for token in self.tokens():
+            chunk = {
+                'id': 'fake', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': payload.get('model', ''),
+                'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}],
+            }
+            writer.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await writer.drain()
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+        writer.write(b"data: [DONE]\n\n")
+        await writer.drain()
\ No newline at end of file
@@ -0,0 +1,175 @@
+import array
+import bisect
+import csv
+import os
+import sys
+import threading
+import unicodedata
+
+from django.db import transaction
+
+from .models import Food
+
+# Food search for the log form. Every food is indexed once per process, in
+# memory: names are normalised (lower case, no accents or punctuation) and
+# each place a word starts becomes one entry of a sorted array, so a query is
+# a binary search for the first entry starting with it -- "chick" and
+# "breast" both find "Chicken breast (grilled)" in microseconds, with no
+# database query. Entries are packed as food number << 8 | offset into 32-bit
+# ints and the nutrients sit in parallel float arrays, so 100k foods take a
+# few tens of MB. The index is built on first use (or at start-up with
+# PRELOAD_SERVICES = ['foods']) and again after the foods change; other
+# running processes see a new `manage.py load_foods` when they restart. The
+# bundled foods are loaded by migration core.0017, and an empty table is never
+# kept as an index, so a process that searched before the foods were loaded
+# still picks them up.
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), 'data', 'foods.csv')
+COLUMNS = ('name', 'serving', 'serving_grams', 'calories', 'protein', 'carbs', 'fats')
+NUMBERS = COLUMNS[2:]  # all per 100 g, except serving_grams
+MAX_OFFSET = 0xFF  # words starting further into a name are not indexed
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+BROWSER_CACHE_SECONDS = 60 * 60  # answers only change with the data
+
+_lock = threading.Lock()
+_index = None
+
+
+def normalize(text):
+    # "Crème brûlée (baked)" -> "creme brulee baked"
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return " ".join("".join(c if c.isalnum() else " " for c in text if not unicodedata.combining(c)).split())
+
+
+def _word_starts(key):
+    return [i for i in range(min(len(key), MAX_OFFSET + 1)) if i == 0 or key[i - 1] == " "]
+
+
+class FoodIndex:
+    """Prefix search over (id, name, serving, serving_grams, calories, protein, carbs, fats) rows."""
+
+    def __init__(self, rows):
+        self.ids = array.array('q')
+        self.names, self.servings, self.keys = [], [], []
+        self.numbers = {field: array.array('f') for field in NUMBERS}
+        entries = array.array('I')
+        for number, (food_id, name, serving, *values) in enumerate(rows):
+            key = normalize(name)
+            self.ids.append(food_id)
+            self.names.append(name)
+            self.servings.append(sys.intern(serving))  # a handful of distinct portions
+            self.keys.append(key)
+            for field, value in zip(NUMBERS, values):
+                self.numbers[field].append(value)
+            entries.extend(number << 8 | offset for offset in _word_starts(key))
+
+        # Every word start, and whole names only, each in order of the text from there on
+        self.entries = array.array('I', sorted(entries, key=self._text))
+        self.by_name = array.array('I', sorted((number << 8 for number in range(len(self.keys))), key=self._text))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _text(self, entry):
+        return self.keys[entry >> 8][entry & 0xFF:]
+
+    def _matches(self, entries, prefix, found, limit):
+        keys = self.keys
+        for i in range(bisect.bisect_left(entries, prefix, key=self._text), len(entries)):
+            number, offset = entries[i] >> 8, entries[i] & 0xFF
+            if len(found) >= limit or not keys[number].startswith(prefix, offset):
+                return
+            found.setdefault(number)
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Numbers of up to `limit` foods with a word starting with `query`; names that start with it come first."""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        found = {}  # ordered set
+        self._matches(self.by_name, prefix, found, limit)
+        self._matches(self.entries, prefix, found, limit)
+        return list(found)
+
+    def food(self, number):
+        return {
+            'id': self.ids[number],
+            'name': self.names[number],
+            'serving': self.servings[number],
+            **{field: round(self.numbers[field][number], 2) for field in NUMBERS},
+        }
+
+    def nbytes(self):
+        """Roughly the memory the index holds, in bytes."""
+        columns = (self.names, self.servings, self.keys)
+        arrays = (self.ids, self.entries, self.by_name, *self.numbers.values())
+        return (sum(sys.getsizeof(column) for column in columns)
+                + sum(sys.getsizeof(text) for column in (self.names, self.keys) for text in column)
+                + sum(sys.getsizeof(text) for text in set(self.servings))
+                + sum(a.itemsize * len(a) for a in arrays))
+
+
+def rows():
+    return Food.objects.order_by('id').values_list('id', *COLUMNS).iterator(chunk_size=10_000)
+
+
+def get_index():
+    global _index
+    index = _index
+    if index is None:
+        with _lock:
+            index = _index
+            if index is None:
+                index = FoodIndex(rows())
+                if len(index):
+                    _index = index
+    return index
+
+
+def reset():
+    # Rebuilt on next use
+    global _index
+    _index = None
+
+
+def preload():
+    get_index()
+
+
+def search(query, limit=DEFAULT_LIMIT):
+    """Foods matching `query` as dicts: per-100 g nutrients plus the usual serving."""
+    index = get_index()
+    return [index.food(number) for number in index.search(query, limit)]
+
+
+def read(path):
+    """Unsaved Foods from a CSV with COLUMNS. Raises ValueError naming the first bad line."""
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in COLUMNS if column not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        names = set()
+        for line_no, row in enumerate(reader, start=2):
+            try:
+                values = {field: float(row[field]) for field in NUMBERS}
+            except (TypeError, ValueError):
+                raise ValueError(f"line {line_no}: {', '.join(NUMBERS)} must be numbers")
+            name = (row['name'] or "").strip()
+            if not name or name in names:
+                raise ValueError(f"line {line_no}: missing or repeated name {name!r}")
+            if values['serving_grams'] <= 0 or min(values.values()) < 0:
+                raise ValueError(f"line {line_no}: serving_grams must be positive and nutrients not negative")
+            names.add(name)
+            yield Food(name=name, serving=(row['serving'] or "").strip(), **values)
+
+
+def load(path=DATA_PATH, batch_size=1000):
+    """Replace every Food with the rows of `path` (default: the bundled data). Returns the number loaded."""
+    foods = list(read(path))
+    with transaction.atomic():
+        Food.objects.all().delete()
+        Food.objects.bulk_create(foods, batch_size=batch_size)
+    reset()
+    return len(foods)
@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.template.backends.utils import csrf_input
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# Rendered page fragments cached per user under a "data version": the user's
+# UserProfile.data_changed_at, which every write to their logs, profile or
+# snapshots moves (see UserProfile.touch and its callers). It lives in the
+# database, so a write made by any process -- a web worker, rebuild_rollups,
+# archive_logs, build_percentiles -- reaches every other one, and it is loaded
+# with request.user (core/backends.py), so finding the version costs no query.
+# Old entries are simply never looked up again. The HTML itself may sit in a
+# per-process cache: at worst each process renders a fragment once.
+# Stands in for {% csrf_token %} in cached HTML; the current token is put back on every request
+CSRF_PLACEHOLDER = '<!--csrf-token-->'
+
+
+def get_cache():
+    return caches[getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'default')]
+
+
+def data_version(user):
+    """The user's data version, or None for a user without a profile (nothing is cached then)."""
+    profile = getattr(user, 'userprofile', None)
+    return profile.data_changed_at.isoformat() if profile is not None else None
+
+
+def _key(name, user):
+    version = data_version(user)
+    return f"frag:{name}:{user.id}:{version}" if version else None
+
+
+def _render(template, context):
+    return render_to_string(template, dict(context, csrf_input=mark_safe(CSRF_PLACEHOLDER)))
+
+
+def _timeout():
+    return getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def _with_csrf(request, html):
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, csrf_input(request))
+    return mark_safe(html)
+
+
+def render_cached(request, name, template, get_context):
+    """Return the HTML of `template` for the current user, rendering it only on a miss.
+
+    `get_context` is only called on a miss, so the queries behind the fragment
+    are skipped whenever it is cached.
+    """
+    cache = get_cache()
+    key = _key(name, request.user)
+    html = cache.get(key) if key else None
+    if html is None:
+        html = _render(template, get_context())
+        if key:
+            cache.set(key, html, _timeout())
+    return _with_csrf(request, html)
+
+
+async def arender_cached(request, name, template, get_context):
+    """render_cached() for async views: `get_context` is a coroutine function.
+
+    The context must be fully loaded (lists, not querysets), since the
+    template is rendered on the event loop.
+    """
+    cache = get_cache()
+    key = _key(name, request.user)
+    html = await cache.aget(key) if key else None
+    if html is None:
+        html = _render(template, await get_context())
+        if key:
+            await cache.aset(key, html, _timeout())
+    return _with_csrf(request, html)
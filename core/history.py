@@ -0,0 +1,66 @@
+import base64
+import datetime
+
+from django.db.models import Q
+
+from .models import HealthLog
+
+# Keyset ("seek") pagination over a user's logs, newest first. A page is
+# "the next N rows after (date, id)", which the (user, -date, -id) index
+# answers directly, so page 1000 costs the same as page 1: no OFFSET, no COUNT.
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+
+# Fields returned by the JSON API
+API_FIELDS = (
+    'id', 'date', 'log_type', 'sleep_hours', 'water_intake', 'exercise_type', 'calories_burned',
+    'calories_intake', 'protein', 'carbs', 'fats', 'health_score', 'suggestion',
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(log):
+    raw = f"{log.date.isoformat()}:{log.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        day, log_id = raw.split(':')
+        return datetime.date.fromisoformat(day), int(log_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {token!r}") from e
+
+
+def page(user, cursor=None, size=PAGE_SIZE, fields=None):
+    """Return (logs, next_cursor) for the page after `cursor` (or the newest page).
+
+    next_cursor is None on the last page. One extra row is fetched to know
+    whether there is a next page, instead of counting.
+    """
+    logs = HealthLog.objects.filter(user=user).order_by('-date', '-id')
+    if fields:
+        logs = logs.only(*fields)
+    if cursor:
+        day, log_id = decode_cursor(cursor)
+        # (date, id) < (day, log_id). The plain date__lte bound is what lets the
+        # database seek into the index; the OR alone would be a filter on a scan.
+        logs = logs.filter(date__lte=day).filter(Q(date__lt=day) | Q(id__lt=log_id))
+
+    rows = list(logs[:size + 1])
+    if len(rows) > size:
+        return rows[:size], encode_cursor(rows[size - 1])
+    return rows, None
+
+
+def page_size(value):
+    # ?limit= from the query string, clamped to 1..MAX_PAGE_SIZE
+    try:
+        return max(1, min(MAX_PAGE_SIZE, int(value)))
+    except (TypeError, ValueError):
+        return PAGE_SIZE
@@ -0,0 +1,181 @@
+import codecs
+import csv
+import datetime
+import hashlib
+import json
+import time
+from collections import Counter
+
+from django import forms
+from django.core.exceptions import ValidationError
+
+from . import rollups
+from .forms import HealthLogForm
+from .models import HealthLog, UserProfile
+
+FORMATS = ('csv', 'ndjson')
+BATCH_SIZE = 1000
+# Only the first errors are kept for the report; the rest are just counted
+MAX_REPORTED_ERRORS = 200
+
+# What undecodable bytes are read as; a row containing one is reported, not imported
+REPLACEMENT = '\ufffd'
+NOT_UTF8 = ValueError("Not valid UTF-8 text; save the file as UTF-8 and import it again")
+
+# Field rules are taken from HealthLogForm once, instead of building a form per row
+LOG_FIELDS = HealthLogForm.base_fields
+DATE_FIELD = forms.DateField(required=False)
+
+
+def guess_format(filename):
+    return 'ndjson' if filename.lower().endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, dict or ValueError) from a binary stream, one row at a time."""
+    # Bad bytes must not abort an import halfway through, after earlier batches are written
+    lines = codecs.iterdecode(stream, 'utf-8-sig', errors='replace')
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield reader.line_num, ValueError(f"Invalid CSV: {e}")
+                continue
+            text = [value for value in row.values() if isinstance(value, str)]
+            yield reader.line_num, NOT_UTF8 if any(REPLACEMENT in value for value in text) else row
+        return
+
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        if REPLACEMENT in line:
+            yield line_no, NOT_UTF8
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f"Invalid JSON: {e}")
+            continue
+        yield line_no, row if isinstance(row, dict) else ValueError("Expected a JSON object")
+
+
+def parse_date(value):
+    # ISO dates are by far the common case and fromisoformat is much cheaper than the form field
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return DATE_FIELD.clean(value)
+
+
+def clean_row(row, repeats=None):
+    # Same rules as the add_log form, plus an optional date and external id.
+    # `repeats` counts the id-less rows of one file, see below
+    if isinstance(row, Exception):
+        raise ValidationError(str(row))
+
+    cleaned, errors = {}, []
+    for name, field in LOG_FIELDS.items():
+        value = row.get(name)
+        if value in (None, '') and (not field.required or HealthLog._meta.get_field(name).has_default()):
+            continue  # missing columns fall back to the model default
+        try:
+            cleaned[name] = field.clean(value if value is None else str(value))
+        except ValidationError as e:
+            errors.append(f"{name}: {' '.join(e.messages)}")
+    try:
+        cleaned['date'] = parse_date(row.get('date'))
+    except ValidationError as e:
+        errors.append(f"date: {' '.join(e.messages)}")
+    if errors:
+        raise ValidationError(errors)
+
+    external_id = row.get('external_id') or row.get('id')
+    if external_id not in (None, ''):
+        key = f"id:{external_id}"
+    else:
+        # No id in the file: the nth identical row is the same log on every run, so
+        # re-importing skips it while the same meal logged twice in one file stays twice
+        key = json.dumps(cleaned, sort_keys=True, default=str)
+        if repeats is not None:
+            repeats[key] += 1
+            if repeats[key] > 1:
+                key = f"{key}#{repeats[key]}"  # the first one keeps the key earlier imports gave it
+    cleaned['import_key'] = hashlib.sha256(key.encode()).hexdigest()
+    if cleaned['date'] is None:
+        del cleaned['date']
+    return cleaned
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    def add_error(self, line_no, messages):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_no, "; ".join(messages)))
+
+    @property
+    def rows_per_second(self):
+        return round(self.rows / self.elapsed) if self.elapsed else 0
+
+
+def _write_batch(user, batch, result):
+    # Skip rows an earlier (possibly interrupted) run already imported
+    keys = [log.import_key for log in batch]
+    existing = set(HealthLog.objects.filter(user=user, import_key__in=keys).values_list('import_key', flat=True))
+    new, seen = [], set()
+    for log in batch:
+        if log.import_key in existing or log.import_key in seen:
+            result.skipped += 1
+            continue
+        seen.add(log.import_key)
+        log.calculate_metrics()
+        new.append(log)
+    HealthLog.objects.bulk_create(new, ignore_conflicts=True)
+    result.created += len(new)
+
+
+def import_logs(user, stream, fmt='csv', batch_size=BATCH_SIZE):
+    """Import health logs for `user` from a CSV or NDJSON byte stream.
+
+    Rows are validated with the HealthLogForm field rules, scored against a
+    single profile fetch and written with bulk_create in batches. Returns an
+    ImportResult; rows already imported (same import_key) are skipped.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+    started = time.perf_counter()
+    result = ImportResult()
+    # One profile fetch for the whole import; calculate_metrics reads it from the cache
+    user.userprofile = UserProfile.objects.get_or_create(user=user)[0]
+
+    batch, repeats = [], Counter()
+    for line_no, row in read_rows(stream, fmt):
+        result.rows += 1
+        try:
+            cleaned = clean_row(row, repeats)
+        except ValidationError as e:
+            result.add_error(line_no, e.messages)
+            continue
+        batch.append(HealthLog(user=user, **cleaned))
+        if len(batch) >= batch_size:
+            _write_batch(user, batch, result)
+            batch = []
+    if batch:
+        _write_batch(user, batch, result)
+
+    if result.created:
+        rollups.rebuild([user.id])
+    result.elapsed = time.perf_counter() - started
+    return result
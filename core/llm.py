@@ -0,0 +1,880 @@
+import asyncio
+import contextvars
+import hashlib
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from . import metrics as request_metrics
+
+# Process-wide access to the LLM providers: pooled keep-alive connections,
+# a deadline per call, jittered retries, a circuit breaker per provider and a
+# cap on how many calls may be in flight at once. Callers get LLMUnavailable
+# instead of hanging.
+#
+# Providers (Groq, Gemini, a local stub) are adapters configured in
+# LLM_PROVIDERS, like CACHES. LLM_ROUTE lists the ones to use: each call goes
+# to the fastest healthy one (by the median of its recent latencies), and with
+# LLM_HEDGE a second one is fired once the first has taken longer than its own
+# p95 -- whichever answers first wins. A provider that fails hands over to the
+# next. The SDKs are imported on the first call rather than with this module,
+# so pages and commands that never reach the LLM don't pay for them; see
+# core/warmup.py to load them up front instead.
+
+DEFAULT_MODEL = "llama-3.3-70b-versatile"
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+DEFAULT_PROVIDERS = {
+    'groq': {'BACKEND': 'core.llm.GroqProvider', 'MODEL': DEFAULT_MODEL},
+    'stub': {'BACKEND': 'core.llm.StubProvider'},
+}
+
+
+class LLMUnavailable(Exception):
+    pass
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# --- Metrics ---
+
+_metrics_lock = threading.Lock()
+_metrics = {}
+
+
+def _reset_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+        _metrics.update({
+            'calls': 0, 'successes': 0, 'errors': 0, 'retries': 0,
+            'short_circuited': 0, 'rejected': 0,
+            'hedged': 0, 'hedge_wins': 0, 'failovers': 0,
+            'latency_sum': 0.0, 'latency_count': 0,
+            'latency_buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        })
+
+
+_reset_metrics()
+
+
+def _count(name, amount=1):
+    with _metrics_lock:
+        _metrics[name] += amount
+
+
+def _observe(seconds):
+    with _metrics_lock:
+        _metrics['latency_sum'] += seconds
+        _metrics['latency_count'] += 1
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        _metrics['latency_buckets'][index] += 1
+    request_metrics.record_span('llm', seconds)
+
+
+def metrics():
+    """Upstream call counters, latency histogram and error rate for this process, plus per-provider health."""
+    with _metrics_lock:
+        snapshot = {k: (list(v) if isinstance(v, list) else v) for k, v in _metrics.items()}
+    finished = snapshot['successes'] + snapshot['errors']
+    snapshot['error_rate'] = snapshot['errors'] / finished if finished else 0.0
+    for name in _setting('LLM_ROUTE', ['groq']):
+        get_provider(name)
+    with _providers_lock:
+        providers = dict(_providers)
+    snapshot['providers'] = {
+        name: {
+            'breaker_state': provider.breaker.state,
+            'successes': provider.successes,
+            'errors': provider.errors,
+            'p50': provider.latency.percentile(50),
+            'p95': provider.latency.percentile(95),
+        }
+        for name, provider in providers.items()
+    }
+    return snapshot
+
+
+# --- Circuit breaker ---
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `reset_after` seconds one trial call is let through."""
+
+    def __init__(self, threshold=5, reset_after=30.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def release(self):
+        # A call ended without telling us anything about the provider (e.g. the client left)
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """The last `size` latencies (seconds) of a provider's successful calls."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, pct):
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+# --- Concurrency cap ---
+
+_slots = threading.BoundedSemaphore(_setting('LLM_MAX_CONCURRENCY', 8))
+SLOT_POLL_INTERVAL = 0.05
+
+
+def _acquire(timeout):
+    # Wait at most `timeout` seconds for a free slot; timeout=0 never blocks (for async callers)
+    acquired = _slots.acquire(timeout=timeout) if timeout else _slots.acquire(blocking=False)
+    if not acquired:
+        _count('rejected')
+        raise LLMUnavailable("Too many AI requests in flight")
+
+
+@contextmanager
+def slot(timeout):
+    _acquire(timeout)
+    try:
+        yield
+    finally:
+        _slots.release()
+
+
+@asynccontextmanager
+async def aslot(timeout):
+    # slot() for async views: the slots are shared with sync callers, so the loop polls instead of blocking
+    waited_until = time.monotonic() + timeout
+    while not _slots.acquire(blocking=False):
+        if time.monotonic() >= waited_until:
+            _count('rejected')
+            raise LLMUnavailable("Too many AI requests in flight")
+        await asyncio.sleep(SLOT_POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        _slots.release()
+
+
+# --- Groq clients ---
+
+_client_lock = threading.Lock()
+_clients = {}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _limits():
+    import httpx
+
+    size = _setting('LLM_MAX_CONCURRENCY', 8)
+    return httpx.Limits(max_connections=size, max_keepalive_connections=size, keepalive_expiry=60)
+
+
+def _client_options():
+    api_key = _setting('GROQ_API_KEY', None)
+    if not api_key:
+        raise LLMUnavailable("GROQ_API_KEY is not set")
+    return {
+        'api_key': api_key,
+        'base_url': _setting('GROQ_BASE_URL', None) or None,
+        'max_retries': 0,  # retries are ours, with jitter and a shared deadline
+        'timeout': _setting('LLM_TIMEOUT', 20),
+    }
+
+
+def get_client():
+    # Shared, thread-safe client; connections are kept alive between requests
+    import groq
+    import httpx
+
+    options = _client_options()
+    key = options['base_url']
+    with _client_lock:
+        if key not in _clients:
+            _clients[key] = groq.Groq(http_client=httpx.Client(limits=_limits()), **options)
+        return _clients[key]
+
+
+def get_async_client():
+    # Async connections belong to an event loop, so there is one client per loop
+    import groq
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    options = _client_options()
+    clients = _async_clients.setdefault(loop, {})
+    if options['base_url'] not in clients:
+        clients[options['base_url']] = groq.AsyncGroq(http_client=httpx.AsyncClient(limits=_limits()), **options)
+    return clients[options['base_url']]
+
+
+# --- Providers ---
+
+class Provider:
+    """One LLM backend. Subclasses send a single attempt; retries, breaker and metrics are done here.
+
+    `options` is the provider's LLM_PROVIDERS entry: MODEL, plus whatever the
+    adapter reads.
+    """
+
+    default_model = None
+
+    def __init__(self, name, options):
+        self.name = name
+        self.options = options
+        self.model = options.get('MODEL', self.default_model)
+        self.breaker = CircuitBreaker(
+            threshold=_setting('LLM_BREAKER_THRESHOLD', 5),
+            reset_after=_setting('LLM_BREAKER_RESET', 30),
+        )
+        window = _setting('LLM_LATENCY_WINDOW', 200)
+        self.latency = LatencyTracker(window)  # whole replies
+        self.first_token = LatencyTracker(window)  # streams, up to the first token
+        self.successes = self.errors = 0
+
+    def preload(self):
+        pass
+
+    def retryable(self, error):
+        return False
+
+    def complete(self, prompt, timeout):
+        raise NotImplementedError
+
+    async def acomplete(self, prompt, timeout):
+        raise NotImplementedError
+
+    async def stream(self, prompt, timeout):
+        # An async generator of reply tokens; closing it cancels the upstream request
+        raise NotImplementedError
+        yield
+
+
+class GroqProvider(Provider):
+    default_model = DEFAULT_MODEL
+
+    def preload(self):
+        import groq  # noqa: F401
+
+    def retryable(self, error):
+        import groq
+
+        return isinstance(error, (groq.APIConnectionError, groq.RateLimitError, groq.InternalServerError))
+
+    def complete(self, prompt, timeout):
+        chat_completion = get_client().with_options(timeout=timeout).chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.model,
+        )
+        return chat_completion.choices[0].message.content
+
+    async def acomplete(self, prompt, timeout):
+        chat_completion = await get_async_client().with_options(timeout=timeout).chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.model,
+        )
+        return chat_completion.choices[0].message.content
+
+    async def stream(self, prompt, timeout):
+        response = await get_async_client().with_options(timeout=timeout).chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.model,
+            stream=True,
+        )
+        try:
+            async for chunk in response:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if token:
+                    yield token
+        finally:
+            await response.close()
+
+
+class GeminiProvider(Provider):
+    """Google Gemini through google-generativeai. API_KEY defaults to settings.GEMINI_API_KEY."""
+
+    default_model = "gemini-1.5-flash"
+
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self._lock = threading.Lock()
+        self._model = None
+
+    def preload(self):
+        import google.generativeai  # noqa: F401
+
+    def retryable(self, error):
+        from google.api_core import exceptions
+
+        return isinstance(error, (exceptions.ServiceUnavailable, exceptions.TooManyRequests,
+                                  exceptions.InternalServerError, exceptions.DeadlineExceeded))
+
+    def client(self):
+        import google.generativeai as genai
+
+        with self._lock:
+            if self._model is None:
+                genai.configure(api_key=self.options.get('API_KEY') or _setting('GEMINI_API_KEY', None))
+                self._model = genai.GenerativeModel(self.model)
+            return self._model
+
+    def complete(self, prompt, timeout):
+        return self.client().generate_content(prompt, request_options={'timeout': timeout}).text
+
+    async def acomplete(self, prompt, timeout):
+        response = await self.client().generate_content_async(prompt, request_options={'timeout': timeout})
+        return response.text
+
+    async def stream(self, prompt, timeout):
+        response = await self.client().generate_content_async(
+            prompt, stream=True, request_options={'timeout': timeout}
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class StubError(Exception):
+    pass
+
+
+class StubProvider(Provider):
+    """A local, deterministic stand-in for load tests and offline development.
+
+    Options: REPLY, LATENCY (seconds per call), SLOW_EVERY and SLOW_LATENCY
+    (every Nth call takes that long instead), FAIL_EVERY (every Nth call
+    fails) and TOKEN_DELAY (seconds between streamed tokens).
+    """
+
+    default_model = "stub"
+
+    def __init__(self, name, options):
+        super().__init__(name, options)
+        self.reply = options.get('REPLY', "<p>Keep logging, you are doing well!</p>")
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def retryable(self, error):
+        return isinstance(error, (StubError, TimeoutError))
+
+    def _next(self, timeout):
+        # (seconds to wait, error to raise after waiting or None) for the next call
+        with self._lock:
+            self.calls += 1
+            number = self.calls
+        latency = self.options.get('LATENCY', 0.0)
+        slow_every = self.options.get('SLOW_EVERY', 0)
+        if slow_every and number % slow_every == 0:
+            latency = self.options.get('SLOW_LATENCY', 1.0)
+        fail_every = self.options.get('FAIL_EVERY', 0)
+        if latency > timeout:
+            return timeout, TimeoutError(f"{self.name} timed out")
+        if fail_every and number % fail_every == 0:
+            return latency, StubError(f"{self.name} failed call {number}")
+        return latency, None
+
+    def _reply(self, prompt):
+        # Same prompt, same answer
+        return self.reply.replace("{digest}", hashlib.sha256(prompt.encode()).hexdigest()[:8])
+
+    def complete(self, prompt, timeout):
+        delay, error = self._next(timeout)
+        time.sleep(delay)
+        if error:
+            raise error
+        return self._reply(prompt)
+
+    async def acomplete(self, prompt, timeout):
+        delay, error = self._next(timeout)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return self._reply(prompt)
+
+    async def stream(self, prompt, timeout):
+        delay, error = self._next(timeout)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        words = self._reply(prompt).split(" ")
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.options.get('TOKEN_DELAY', 0.0))
+            yield word + (" " if i < len(words) - 1 else "")
+
+
+_providers_lock = threading.Lock()
+_providers = {}
+
+
+def get_provider(name):
+    with _providers_lock:
+        if name not in _providers:
+            config = dict(_setting('LLM_PROVIDERS', DEFAULT_PROVIDERS)[name])
+            _providers[name] = import_string(config.pop('BACKEND'))(name, config)
+        return _providers[name]
+
+
+@receiver(setting_changed)
+def _forget_providers(setting, **kwargs):
+    if setting in ('LLM_PROVIDERS', 'LLM_BREAKER_THRESHOLD', 'LLM_BREAKER_RESET', 'LLM_LATENCY_WINDOW'):
+        with _providers_lock:
+            _providers.clear()
+
+
+def reset():
+    """Close every breaker and forget the latencies (tests, or after an incident)."""
+    with _providers_lock:
+        providers = list(_providers.values())
+    for provider in providers:
+        provider.breaker.reset()
+        provider.latency.clear()
+        provider.first_token.clear()
+
+
+def route(streaming=False):
+    """LLM_ROUTE's providers whose breaker isn't open, fastest first.
+
+    Speed is the median of recent replies (first tokens when `streaming`);
+    providers with no numbers yet go first so they get some, and ties keep
+    the LLM_ROUTE order.
+    """
+    providers = [get_provider(name) for name in _setting('LLM_ROUTE', ['groq'])]
+    healthy = [provider for provider in providers if provider.breaker.state != 'open']
+    return sorted(healthy, key=lambda p: (p.first_token if streaming else p.latency).percentile(50) or 0.0)
+
+
+def preload():
+    for provider in route():
+        provider.preload()
+
+
+def hedge_delay(provider, streaming=False):
+    """Seconds to wait on `provider` before trying the next one too, or None when hedging is off.
+
+    The provider's own p95 once it has LLM_HEDGE_MIN_SAMPLES latencies,
+    LLM_HEDGE_DELAY until then.
+    """
+    if not _setting('LLM_HEDGE', True):
+        return None
+    tracker = provider.first_token if streaming else provider.latency
+    if len(tracker) >= _setting('LLM_HEDGE_MIN_SAMPLES', 20):
+        return tracker.percentile(95)
+    return _setting('LLM_HEDGE_DELAY', 2.0)
+
+
+def backoff(attempt):
+    # Full jitter: a random wait between 0 and an exponentially growing cap
+    cap = min(_setting('LLM_BACKOFF_MAX', 4.0), _setting('LLM_BACKOFF_BASE', 0.25) * 2 ** attempt)
+    return random.uniform(0, cap)
+
+
+def _succeeded(provider, seconds, tracker=None):
+    _observe(seconds)
+    _count('successes')
+    with _metrics_lock:
+        provider.successes += 1
+    if tracker is not None:
+        tracker.add(seconds)
+    provider.breaker.record_success()
+
+
+def _failed(provider, seconds):
+    _observe(seconds)
+    _count('errors')
+    with _metrics_lock:
+        provider.errors += 1
+
+
+def _allow(provider):
+    if not provider.breaker.allow():
+        _count('short_circuited')
+        raise LLMUnavailable(f"AI provider {provider.name} is temporarily unavailable")
+
+
+def _retry_wait(provider, error, attempt, deadline):
+    # Seconds to back off before the next attempt, or None to give up
+    wait = backoff(attempt)
+    if (provider.retryable(error) and attempt < _setting('LLM_MAX_RETRIES', 2)
+            and time.monotonic() + wait < deadline):
+        _count('retries')
+        return wait
+    provider.breaker.record_failure()
+    return None
+
+
+def _complete_with(provider, prompt, deadline):
+    # One provider, retried until `deadline`
+    _allow(provider)
+    attempt = 0
+    while True:
+        _count('calls')
+        started = time.monotonic()
+        try:
+            reply = provider.complete(prompt, max(0.01, deadline - started))
+        except Exception as e:
+            _failed(provider, time.monotonic() - started)
+            wait = _retry_wait(provider, e, attempt, deadline)
+            if wait is None:
+                raise LLMUnavailable(str(e)) from e
+            attempt += 1
+            time.sleep(wait)
+            continue
+        _succeeded(provider, time.monotonic() - started, provider.latency)
+        return reply
+
+
+async def _acomplete_with(provider, prompt, deadline):
+    _allow(provider)
+    attempt = 0
+    while True:
+        _count('calls')
+        started = time.monotonic()
+        try:
+            reply = await provider.acomplete(prompt, max(0.01, deadline - started))
+        except asyncio.CancelledError:
+            provider.breaker.release()
+            raise
+        except Exception as e:
+            _failed(provider, time.monotonic() - started)
+            wait = _retry_wait(provider, e, attempt, deadline)
+            if wait is None:
+                raise LLMUnavailable(str(e)) from e
+            attempt += 1
+            await asyncio.sleep(wait)
+            continue
+        _succeeded(provider, time.monotonic() - started, provider.latency)
+        return reply
+
+
+_executor_lock = threading.Lock()
+_executor = None
+
+
+def _threads():
+    # Hedged calls run here so the caller can wait on whichever answers first
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2 * _setting('LLM_MAX_CONCURRENCY', 8),
+                                           thread_name_prefix='llm')
+        return _executor
+
+
+def complete(prompt, deadline=None):
+    """Send one chat prompt and return the reply text.
+
+    Goes to the fastest healthy provider in LLM_ROUTE, retrying transient
+    failures with jittered backoff until `deadline` seconds (default
+    LLM_TIMEOUT) have passed, hedging and failing over to the next provider
+    as described at the top. Raises LLMUnavailable when every breaker is open,
+    no slot frees up in time, or every attempt failed.
+    """
+    deadline = time.monotonic() + (deadline or _setting('LLM_TIMEOUT', 20))
+    providers = route()
+    if not providers:
+        _count('short_circuited')
+        raise LLMUnavailable("AI coach is temporarily unavailable")
+    if len(providers) == 1:
+        with slot(timeout=max(0.01, deadline - time.monotonic())):
+            return _complete_with(providers[0], prompt, deadline)
+
+    # A losing call can't be interrupted; it runs on (up to the deadline) in its thread.
+    # So every call holds a slot until it finishes, not until we return: calls in flight
+    # stay within LLM_MAX_CONCURRENCY, and so do the threads they occupy.
+    running = {}
+
+    def launch(provider, hedge):
+        try:
+            future = _threads().submit(contextvars.copy_context().run, _complete_with, provider, prompt, deadline)
+        except BaseException:
+            _slots.release()
+            raise
+        future.add_done_callback(lambda future: _slots.release())
+        running[future] = hedge
+
+    primary, *backups = providers
+    _acquire(timeout=max(0.01, deadline - time.monotonic()))
+    launch(primary, False)
+    delay = hedge_delay(primary)
+    hedge_at = time.monotonic() + delay if delay is not None else None
+    error = None
+    while True:
+        if not running:
+            if not backups or time.monotonic() >= deadline:
+                raise error
+            _count('failovers')
+            _acquire(timeout=max(0.01, deadline - time.monotonic()))
+            launch(backups.pop(0), False)
+        until = min(deadline, hedge_at) if hedge_at is not None and backups else deadline
+        done, _ = wait(running, timeout=max(0, until - time.monotonic()), return_when=FIRST_COMPLETED)
+        for future in done:
+            hedge = running.pop(future)
+            try:
+                reply = future.result()
+            except LLMUnavailable as e:
+                error = e
+                continue
+            if hedge:
+                _count('hedge_wins')
+            return reply
+        if done:
+            continue
+        if time.monotonic() >= deadline:
+            raise LLMUnavailable("AI coach timed out")
+        if hedge_at is not None and backups and time.monotonic() >= hedge_at:
+            hedge_at = None
+            # The hedge needs a slot of its own; when none is free we keep waiting on the first call
+            if _slots.acquire(blocking=False):
+                _count('hedged')
+                launch(backups.pop(0), True)
+
+
+async def acomplete(prompt, deadline=None, wait_for_slot=False):
+    """complete() for asyncio code (the coach page, and the nightly run in core/coach_batch.py).
+
+    Same routing, hedging, deadline, retries, breakers and metrics; a losing
+    call is cancelled. It takes no slot unless `wait_for_slot` (the page,
+    sharing complete()'s cap); the nightly run bounds its own calls.
+    """
+    deadline = time.monotonic() + (deadline or _setting('LLM_TIMEOUT', 20))
+    if not wait_for_slot:
+        return await _acomplete(prompt, deadline, False)
+    async with aslot(timeout=max(0.01, deadline - time.monotonic())):
+        return await _acomplete(prompt, deadline, True)
+
+
+async def _acomplete(prompt, deadline, slotted):
+    # With `slotted`, the caller's slot covers one call at a time (a failover only
+    # starts once nothing is running); a hedge runs beside it, so it takes a slot of
+    # its own, held until the task ends, and is skipped when none is free.
+    providers = route()
+    if not providers:
+        _count('short_circuited')
+        raise LLMUnavailable("AI coach is temporarily unavailable")
+    if len(providers) == 1:
+        return await _acomplete_with(providers[0], prompt, deadline)
+
+    running = {}
+    primary, *backups = providers
+    running[asyncio.ensure_future(_acomplete_with(primary, prompt, deadline))] = False
+    delay = hedge_delay(primary)
+    hedge_at = time.monotonic() + delay if delay is not None else None
+    error = None
+    try:
+        while True:
+            if not running:
+                if not backups or time.monotonic() >= deadline:
+                    raise error
+                _count('failovers')
+                running[asyncio.ensure_future(_acomplete_with(backups.pop(0), prompt, deadline))] = False
+            until = min(deadline, hedge_at) if hedge_at is not None and backups else deadline
+            done, _ = await asyncio.wait(running, timeout=max(0, until - time.monotonic()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                hedge = running.pop(task)
+                try:
+                    reply = task.result()
+                except LLMUnavailable as e:
+                    error = e
+                    continue
+                if hedge:
+                    _count('hedge_wins')
+                return reply
+            if done:
+                continue
+            if time.monotonic() >= deadline:
+                raise LLMUnavailable("AI coach timed out")
+            if hedge_at is not None and backups and time.monotonic() >= hedge_at:
+                hedge_at = None
+                if not slotted or _slots.acquire(blocking=False):
+                    _count('hedged')
+                    task = asyncio.ensure_future(_acomplete_with(backups.pop(0), prompt, deadline))
+                    if slotted:
+                        task.add_done_callback(lambda task: _slots.release())
+                    running[task] = True
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+async def _stream_with(provider, prompt, timeout):
+    # One provider's tokens, with the breaker and metrics; no retries once a token may have been sent
+    _allow(provider)
+    _count('calls')
+    started = time.monotonic()
+    tokens = provider.stream(prompt, timeout)
+    first = True
+    try:
+        async for token in tokens:
+            if first:
+                provider.first_token.add(time.monotonic() - started)
+                first = False
+            yield token
+    except (asyncio.CancelledError, GeneratorExit):
+        provider.breaker.release()
+        raise
+    except Exception as e:
+        _failed(provider, time.monotonic() - started)
+        provider.breaker.record_failure()
+        raise LLMUnavailable(str(e)) from e
+    finally:
+        await tokens.aclose()
+    # Only the first token is tracked: the whole stream's time depends on the reply's length
+    _succeeded(provider, time.monotonic() - started)
+
+
+async def _first_token(providers, prompt, timeout):
+    """(token generator, its first token) from whichever provider starts answering first.
+
+    Same hedging and failover as complete(), raced up to the first token;
+    the other streams are closed then.
+    """
+    deadline = time.monotonic() + timeout
+    running = {}  # task for the next token -> (generator, hedge)
+    hedge_slot = False
+
+    def launch(provider, hedge):
+        tokens = _stream_with(provider, prompt, timeout)
+        running[asyncio.ensure_future(tokens.__anext__())] = (tokens, hedge)
+
+    primary, *backups = providers
+    launch(primary, False)
+    delay = hedge_delay(primary, streaming=True) if backups else None
+    hedge_at = time.monotonic() + delay if delay is not None else None
+    error = LLMUnavailable("AI coach timed out")
+    try:
+        while True:
+            if not running:
+                if not backups or time.monotonic() >= deadline:
+                    raise error
+                _count('failovers')
+                launch(backups.pop(0), False)
+            until = min(deadline, hedge_at) if hedge_at is not None and backups else deadline
+            done, _ = await asyncio.wait(running, timeout=max(0, until - time.monotonic()),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tokens, hedge = running.pop(task)
+                try:
+                    token = task.result()
+                except StopAsyncIteration:
+                    token = ""  # an empty reply
+                except LLMUnavailable as e:
+                    error = e
+                    continue
+                if hedge:
+                    _count('hedge_wins')
+                return tokens, token
+            if done:
+                continue
+            if time.monotonic() >= deadline:
+                raise error
+            if hedge_at is not None and backups and time.monotonic() >= hedge_at:
+                hedge_at = None
+                # The hedge holds a slot only while the two race; the winner goes on under the caller's
+                if _slots.acquire(blocking=False):
+                    hedge_slot = True
+                    _count('hedged')
+                    launch(backups.pop(0), True)
+    finally:
+        for task, (tokens, _) in running.items():
+            task.cancel()
+        for task, (tokens, _) in running.items():
+            await asyncio.gather(task, return_exceptions=True)
+            await tokens.aclose()
+        if hedge_slot:
+            _slots.release()
+
+
+async def stream(prompt, deadline=None):
+    """Async generator of reply tokens from the fastest healthy provider's streaming API.
+
+    Shares the breakers, concurrency cap and metrics with complete(). It never
+    waits for a slot. Providers are hedged and failed over only up to the
+    first token; after that nothing is retried, since tokens may already have
+    been forwarded. Close it with aclose() to cancel the upstream request.
+    """
+    with slot(0):
+        providers = route(streaming=True)
+        if not providers:
+            _count('short_circuited')
+            raise LLMUnavailable("AI coach is temporarily unavailable")
+        tokens, first = await _first_token(providers, prompt, deadline or _setting('LLM_TIMEOUT', 20))
+        try:
+            if first:
+                yield first
+            async for token in tokens:
+                yield token
+        finally:
+            await tokens.aclose()
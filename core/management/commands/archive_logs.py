@@ -0,0 +1,44 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import archive
+
+
+class Command(BaseCommand):
+    help = ("Move logs from months older than ARCHIVE_AFTER_DAYS into monthly totals and compressed files, "
+            "or put them back with --restore.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Archive months that ended this many days ago")
+        parser.add_argument('--discard-raw', action='store_true', help="Keep only the monthly totals, no files")
+        parser.add_argument('--user', action='append', dest='usernames', help="Only this user (repeatable)")
+        parser.add_argument('--restore', action='store_true', help="Put archived logs back into the log table")
+        parser.add_argument('--month', action='append', dest='months', help="With --restore: only this YYYY-MM")
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            user_ids = list(User.objects.filter(username__in=options['usernames']).values_list('id', flat=True))
+            if len(user_ids) != len(set(options['usernames'])):
+                raise CommandError("Unknown user in --user")
+
+        if options['restore']:
+            if user_ids is None:
+                raise CommandError("--restore needs --user")
+            months = None
+            if options['months']:
+                try:
+                    months = [datetime.datetime.strptime(month, '%Y-%m').date() for month in options['months']]
+                except ValueError:
+                    raise CommandError("--month must be YYYY-MM")
+            restored = sum(archive.restore(user_id, months) for user_id in user_ids)
+            self.stdout.write(self.style.SUCCESS(f"Restored {restored} logs."))
+            return
+
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError("--days must not be negative")
+        before = archive.cutoff(days=options['days'])
+        months, logs = archive.archive(before, keep_raw=False if options['discard_raw'] else None, user_ids=user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Archived {logs} logs before {before} into {months} monthly summaries."))
@@ -0,0 +1,173 @@
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Benchmark every view in core/urls.py (latency percentiles, query count, peak memory) "
+            "at several history sizes, in a throwaway test database with the LLM stubbed out. "
+            "--startup times process start-up (manage.py check, WSGI import) instead, --prompts "
+            "compares AI coach prompt builders against a local stub model, --load drives the AI "
+            "coach with concurrent users against stub providers, and --servers compares the site "
+            "served by uvicorn as ASGI and as WSGI at high concurrency, and --foods times food "
+            "search lookups and index memory at up to 200k foods.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000', help="Comma separated logs-per-user sizes")
+        parser.add_argument('--iterations', type=int, help="Runs per measurement (default 20, 5 with --startup)")
+        parser.add_argument('--view', action='append', dest='views', help="Only this view (repeatable)")
+        parser.add_argument('--output', help="Append the run as one JSON line to this file")
+        parser.add_argument('--no-fail', action='store_true', help="Report budget violations without failing")
+        parser.add_argument('--pagination', type=int, metavar='ROWS',
+                            help="Instead of the views, time history pages at several depths in a table of ROWS logs")
+        parser.add_argument('--startup', action='store_true',
+                            help="Instead of the views, time start-up and peak memory of fresh processes")
+        parser.add_argument('--prompts', action='store_true',
+                            help="Instead of the views, compare coach prompt size and model latency per builder")
+        parser.add_argument('--load', type=int, metavar='USERS',
+                            help="Instead of the views, load-test the AI coach with USERS concurrent users "
+                                 "(--iterations requests each, default 10) against stub LLM providers")
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            choices=list(benchmarks.LOAD_SCENARIOS), help="Only this --load scenario (repeatable)")
+        parser.add_argument('--servers', type=int, metavar='CONNECTIONS',
+                            help="Instead of the views, compare requests/sec and tail latency of the dashboard and "
+                                 "AI coach under uvicorn as ASGI and as WSGI, from CONNECTIONS concurrent connections "
+                                 "(--iterations requests each, default 20)")
+        parser.add_argument('--foods', action='store_true',
+                            help="Instead of the views, time food search lookups and the index's build and memory "
+                                 "at several numbers of foods")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        iterations = options['iterations'] or 20
+        if options['startup']:
+            # Fresh interpreters; no test database needed
+            results = benchmarks.run_startup(options['iterations'] or 5)
+            self.report_startup(results)
+            self.finish(options, results, [f"{r['name']}: {v}" for r in results for v in r['violations']])
+            return
+
+        if options['servers']:
+            missing = [name for name in ('uvicorn', 'aiohttp') if importlib.util.find_spec(name) is None]
+            if missing:
+                raise CommandError(f"--servers needs {' and '.join(missing)} installed "
+                                   "(pip install -r requirements-dev.txt)")
+            if connection.vendor == 'sqlite':
+                # The servers are separate processes, so the test database has to be a file
+                connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            if options['pagination']:
+                results = benchmarks.run_pagination(options['pagination'], iterations=iterations)
+                self.report_pagination(results)
+                self.finish(options, results, [])
+                return
+            if options['load']:
+                results = benchmarks.run_load(options['load'], options['iterations'] or 10, options['scenarios'])
+                self.report_load(results)
+                self.finish(options, results, [])
+                return
+            if options['servers']:
+                results = benchmarks.run_servers(options['servers'], options['iterations'] or 20)
+                self.report_servers(results)
+                self.finish(options, results, [])
+                return
+            if options['foods']:
+                results = benchmarks.run_foods()
+                self.report_foods(results)
+                self.finish(options, results, [f"{r['foods']} foods: {v}" for r in results for v in r['violations']])
+                return
+            if options['prompts']:
+                results = benchmarks.run_prompts(iterations=options['iterations'] or 10)
+                self.report_prompts(results)
+                self.finish(options, results, [f"{r['builder']} @ {r['days']}d: {v}" for r in results for v in r['violations']])
+                return
+            results = benchmarks.run(sizes, iterations, options['views'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f"{'view':<26}{'size':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}{'peak KB':>10}")
+        for r in results:
+            line = (f"{r['view']:<26}{r['size']:>7}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+                    f"{r['queries']:>9}{r['peak_kb']:>10}")
+            self.stdout.write(self.style.ERROR(line) if r['violations'] else line)
+        self.finish(options, results, [f"{r['view']} @ {r['size']}: {v}" for r in results for v in r['violations']])
+
+    def finish(self, options, results, violations):
+        if options['output']:
+            run = {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'commit': self.git_commit(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'results': results,
+            }
+            with open(options['output'], 'a') as f:
+                f.write(json.dumps(run) + "\n")
+
+        if violations and not options['no_fail']:
+            raise CommandError("Over budget:\n" + "\n".join(violations))
+
+    def report_pagination(self, results):
+        self.stdout.write(f"{'rows':>9}{'position':>10}{'keyset p50':>12}{'keyset p95':>12}{'offset p50':>12}{'offset p95':>12}")
+        for r in results:
+            self.stdout.write(f"{r['rows']:>9}{r['position']:>10}{r['keyset_p50_ms']:>12}{r['keyset_p95_ms']:>12}"
+                              f"{r['offset_p50_ms']:>12}{r['offset_p95_ms']:>12}")
+
+    def report_prompts(self, results):
+        self.stdout.write(f"{'builder':<10}{'days':>6}{'tokens':>8}{'max':>6}{'build ms':>10}{'model p50':>11}{'model p95':>11}")
+        for r in results:
+            line = (f"{r['builder']:<10}{r['days']:>6}{r['tokens_p50']:>8}{r['tokens_max']:>6}{r['build_p50_ms']:>10}"
+                    f"{r['latency_p50_ms']:>11}{r['latency_p95_ms']:>11}")
+            self.stdout.write(self.style.ERROR(line) if r['violations'] else line)
+
+    def report_load(self, results):
+        self.stdout.write(f"{'scenario':<10}{'users':>6}{'requests':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>8}"
+                          f"{'fallback':>9}{'hedged':>7}{'won':>5}{'failover':>9}  answered by")
+        for r in results:
+            answered = ", ".join(f"{name} {count}" for name, count in sorted(r['answered_by'].items()))
+            self.stdout.write(f"{r['scenario']:<10}{r['users']:>6}{r['requests']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+                              f"{r['p99_ms']:>9}{r['per_second']:>8}{r['fallbacks']:>9}{r['hedged']:>7}"
+                              f"{r['hedge_wins']:>5}{r['failovers']:>9}  {answered}")
+
+    def report_servers(self, results):
+        self.stdout.write(f"{'server':<8}{'view':<12}{'conns':>6}{'requests':>9}{'req/s':>8}{'p50':>9}{'p95':>9}"
+                          f"{'p99':>9}{'errors':>7}")
+        for r in results:
+            line = (f"{r['server']:<8}{r['view']:<12}{r['concurrency']:>6}{r['requests']:>9}{r['per_second']:>8}"
+                    f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['errors']:>7}")
+            self.stdout.write(self.style.ERROR(line) if r['errors'] else line)
+
+    def report_foods(self, results):
+        self.stdout.write(f"{'foods':>8}{'entries':>9}{'build s':>9}{'MB':>7}{'p50 µs':>9}{'p95 µs':>9}{'p99 µs':>9}"
+                          f"{'endpoint p50':>14}{'p95 ms':>8}")
+        for r in results:
+            line = (f"{r['foods']:>8}{r['entries']:>9}{r['build_s']:>9}{r['index_mb']:>7}{r['lookup_p50_us']:>9}"
+                    f"{r['lookup_p95_us']:>9}{r['lookup_p99_us']:>9}{r['endpoint_p50_ms']:>14}{r['endpoint_p95_ms']:>8}")
+            self.stdout.write(self.style.ERROR(line) if r['violations'] else line)
+
+    def report_startup(self, results):
+        self.stdout.write(f"{'start-up':<18}{'p50':>9}{'max':>9}{'RSS MB':>9}  lazy modules loaded")
+        for r in results:
+            line = (f"{r['name']:<18}{r['p50_ms']:>9}{r['max_ms']:>9}{r['rss_mb']:>9}  "
+                    f"{', '.join(r['lazy_loaded']) or '-'}")
+            self.stdout.write(self.style.ERROR(line) if r['violations'] else line)
+
+    def git_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+        except OSError:
+            return None
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import percentiles
+
+
+class Command(BaseCommand):
+    help = "Rebuild the health score distributions behind the dashboard's percentile (run it nightly)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=percentiles.CHUNK_SIZE,
+                            help="Log ids per query (default %(default)s)")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        started = time.monotonic()
+        count = percentiles.build(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Built score distributions from {count} logs in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import synthetic
+
+
+class Command(BaseCommand):
+    help = "Create synthetic users with realistic profiles and health logs (for benchmarks and load tests)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--logs', type=int, default=100, help="Logs per user")
+        parser.add_argument('--days', type=int, default=365, help="Spread logs over this many past days")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--prefix', default='synthetic', help="Usernames are <prefix>_<n>")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        users = synthetic.generate(
+            options['users'], options['logs'], days=options['days'], seed=options['seed'],
+            prefix=options['prefix'], batch_size=options['batch_size'],
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users and {len(users) * options['logs']} logs in {elapsed:.1f}s."
+        ))
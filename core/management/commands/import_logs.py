@@ -0,0 +1,33 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import importer
+
+
+class Command(BaseCommand):
+    help = "Import historical health logs for a user from a CSV or NDJSON file. Safe to re-run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help="Username to import for")
+        parser.add_argument('--format', choices=importer.FORMATS, help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=importer.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user: {options['user']}")
+
+        fmt = options['format'] or importer.guess_format(options['path'])
+        with open(options['path'], 'rb') as f:
+            result = importer.import_logs(user, f, fmt, batch_size=options['batch_size'])
+
+        for line_no, message in result.errors:
+            self.stderr.write(f"line {line_no}: {message}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"... and {result.error_count - len(result.errors)} more errors")
+        self.stdout.write(self.style.SUCCESS(
+            f"{result.rows} rows read: {result.created} imported, {result.skipped} already present, "
+            f"{result.error_count} errors ({result.rows_per_second} rows/s)."
+        ))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import foods
+
+
+class Command(BaseCommand):
+    help = ("Replace the food nutrient table behind the log form's food search with a CSV "
+            "(default: the bundled core/data/foods.csv). Restart the servers afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=foods.DATA_PATH,
+                            help=f"CSV with the columns {', '.join(foods.COLUMNS)}; nutrients per 100 g")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        try:
+            count = foods.load(options['path'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"{options['path']}: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Loaded {count} foods in {time.monotonic() - started:.1f}s."))
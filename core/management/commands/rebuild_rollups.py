@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the dashboard rollups from HealthLog, or check them with --verify."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', help="Only this user (repeatable)")
+        parser.add_argument('--verify', action='store_true', help="Only compare stored rollups, don't write")
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            user_ids = list(User.objects.filter(username__in=options['usernames']).values_list('id', flat=True))
+            if len(user_ids) != len(set(options['usernames'])):
+                raise CommandError("Unknown user in --user")
+
+        if options['verify']:
+            problems = rollups.verify(user_ids)
+            for problem in problems:
+                self.stderr.write(problem)
+            if problems:
+                raise CommandError(f"{len(problems)} rollup mismatches found")
+            self.stdout.write(self.style.SUCCESS("Rollups are consistent."))
+            return
+
+        count = rollups.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups for {count} users."))
@@ -0,0 +1,26 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core import scoring
+
+
+class Command(BaseCommand):
+    help = "Recompute health_score and suggestion for existing logs (after profile or scoring rule changes)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', help="Only this user (repeatable)")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Users per UPDATE statement")
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            user_ids = list(User.objects.filter(username__in=options['usernames']).values_list('id', flat=True))
+            if len(user_ids) != len(set(options['usernames'])):
+                raise CommandError("Unknown user in --user")
+
+        started = time.perf_counter()
+        updated = scoring.rescore(user_ids, chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Rescored {updated} logs in {elapsed:.1f}s."))
@@ -0,0 +1,27 @@
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandError
+
+from core import coach_batch
+
+
+class Command(BaseCommand):
+    help = "Precompute the AI coach summary of every recently active user (run it nightly). Safe to re-run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help="Only users with a log in this many days")
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help="LLM calls in flight (default COACH_BATCH_CONCURRENCY)")
+        parser.add_argument('--rpm', type=int, default=None, help="Requests per minute (default COACH_BATCH_RPM)")
+        parser.add_argument('--tpm', type=int, default=None, help="Tokens per minute (default COACH_BATCH_TPM)")
+
+    def handle(self, *args, **options):
+        for name in ('days', 'concurrency', 'rpm', 'tpm'):
+            if options[name] is not None and options[name] < 1:
+                raise CommandError(f"--{name} must be at least 1")
+
+        # async_to_sync keeps the ORM calls of the run on this thread
+        counts = async_to_sync(coach_batch.run)(
+            days=options['days'], concurrency=options['concurrency'], rpm=options['rpm'], tpm=options['tpm'],
+        )
+        message = f"Wrote {counts['written']} coach summaries, {counts['unchanged']} unchanged, {counts['failed']} failed."
+        self.stdout.write(self.style.SUCCESS(message) if not counts['failed'] else self.style.WARNING(message))
@@ -0,0 +1,42 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import reports
+
+
+def _worker(options):
+    connections.close_all()  # never share the parent's database connections
+    reports.work(once=options['once'], poll_interval=options['poll_interval'], max_jobs=options['max_jobs'])
+
+
+class Command(BaseCommand):
+    help = "Build queued PDF reports. Runs until stopped; use --once to drain the queue and exit."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help="Worker processes (forked)")
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds between polls of an empty queue")
+        parser.add_argument('--max-jobs', type=int, default=None,
+                            help="Exit a worker after this many jobs, so a supervisor can restart it with fresh memory")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+
+        if options['workers'] == 1:
+            processed = reports.work(once=options['once'], poll_interval=options['poll_interval'],
+                                     max_jobs=options['max_jobs'])
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} report job(s)."))
+            return
+
+        # Each PDF is rendered in pure Python, so parallelism needs processes, not threads
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=_worker, args=(options,)) for _ in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS(f"{len(workers)} report workers finished."))
@@ -0,0 +1,318 @@
+import bisect
+import contextvars
+import hmac
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# Request instrumentation: latency, SQL queries and template time per URL name,
+# plus named spans around slow upstream work (the LLM, PDF rendering). Kept in
+# memory per process and served in the Prometheus text format on /metrics.
+# Recording is a lock and a few additions, cheap enough to leave on.
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+HELP = {
+    'healthyio_requests_total': ('counter', "Requests by URL name, method and status."),
+    'healthyio_request_duration_seconds': ('histogram', "Time spent in Django per request."),
+    'healthyio_request_queries': ('histogram', "SQL queries per request."),
+    'healthyio_request_db_seconds': ('histogram', "Time spent in SQL per request."),
+    'healthyio_request_template_seconds': ('histogram', "Time spent rendering templates per request."),
+    'healthyio_span_seconds': ('histogram', "Duration of instrumented calls (LLM, PDF rendering, ...)."),
+    'healthyio_slow_requests_total': ('counter', "Requests slower than METRICS_SLOW_REQUEST_MS."),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # bisect_left finds the first bucket whose bound is >= value
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def observe(name, labels, value, buckets=SECONDS_BUCKETS):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def inc(name, labels, amount=1):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+# --- Per-request state ---
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.template = 0.0
+        self.template_depth = 0
+        self.spans = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+
+_current = contextvars.ContextVar('metrics_request', default=None)
+
+
+def record_span(name, seconds):
+    observe('healthyio_span_seconds', {'span': name}, seconds)
+    timings = _current.get()
+    if timings is not None:
+        timings.spans[name] = timings.spans.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name):
+    """Time a block as a named span, e.g. `with metrics.span('pdf'): ...`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+# --- Template timing ---
+
+_installed = False
+
+
+def install():
+    # Wraps the Django template backend once, so every render (views, fragments,
+    # render_to_string) is timed. Nested renders are only counted once.
+    global _installed
+    if _installed:
+        return
+    from django.template.backends.django import Template
+
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return original(self, context, request)
+        timings.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original(self, context, request)
+        finally:
+            timings.template_depth -= 1
+            if not timings.template_depth:
+                timings.template += time.perf_counter() - started
+
+    Template.render = render
+    _installed = True
+
+
+# --- Middleware ---
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or 'unnamed'
+
+
+def server_timing(total, timings):
+    parts = [
+        f"total;dur={total * 1000:.1f}",
+        f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries"',
+        f"tpl;dur={timings.template * 1000:.1f}",
+    ]
+    parts += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.spans.items()]
+    return ", ".join(parts)
+
+
+@contextmanager
+def _measured():
+    # Times every query on every connection until the block ends
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(timings))
+            yield timings
+    finally:
+        _current.reset(token)
+
+
+class MetricsMiddleware:
+    """Records per-view latency, SQL and template time; see METRICS_* in settings.
+
+    Sync and async: under ASGI it runs on the event loop, so async views
+    are reached without a hop to a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.server_timing = getattr(settings, 'METRICS_SERVER_TIMING', False)
+        self.slow_seconds = getattr(settings, 'METRICS_SLOW_REQUEST_MS', 1000) / 1000
+        self.slow_sample_rate = getattr(settings, 'METRICS_SLOW_SAMPLE_RATE', 1.0)
+        install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with _measured() as timings:
+            response = self.get_response(request)
+        return self.record(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with _measured() as timings:
+            response = await self.get_response(request)
+        return self.record(request, response, timings, time.perf_counter() - started)
+
+    def record(self, request, response, timings, total):
+        view = _view_name(request)
+        labels = {'view': view}
+        inc('healthyio_requests_total', dict(labels, method=request.method, status=str(response.status_code)))
+        observe('healthyio_request_duration_seconds', labels, total)
+        observe('healthyio_request_queries', labels, timings.queries, QUERY_BUCKETS)
+        observe('healthyio_request_db_seconds', labels, timings.db)
+        observe('healthyio_request_template_seconds', labels, timings.template)
+
+        if total >= self.slow_seconds:
+            inc('healthyio_slow_requests_total', labels)
+            if random.random() < self.slow_sample_rate:
+                logger.warning(
+                    "Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, templates %.0f ms%s",
+                    request.method, request.path, view, total * 1000, timings.queries, timings.db * 1000,
+                    timings.template * 1000,
+                    "".join(f", {name} {seconds * 1000:.0f} ms" for name, seconds in timings.spans.items()),
+                )
+
+        if self.server_timing:
+            response['Server-Timing'] = server_timing(total, timings)
+        return response
+
+
+# --- Exposition ---
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _bound(value):
+    return "+Inf" if value is None else repr(float(value))
+
+
+def _llm_lines():
+    from . import llm  # llm records its spans here
+
+    stats = llm.metrics()
+    lines = [
+        "# HELP healthyio_llm_calls_total Upstream LLM calls by outcome.",
+        "# TYPE healthyio_llm_calls_total counter",
+    ]
+    for outcome in ('successes', 'errors', 'retries', 'short_circuited', 'rejected', 'hedged', 'hedge_wins', 'failovers'):
+        lines.append(f'healthyio_llm_calls_total{{outcome="{outcome}"}} {stats[outcome]}')
+    lines += [
+        "# HELP healthyio_llm_breaker_open 1 while a provider's circuit breaker is open.",
+        "# TYPE healthyio_llm_breaker_open gauge",
+    ]
+    for name, provider in sorted(stats['providers'].items()):
+        lines.append(f'healthyio_llm_breaker_open{{provider="{name}"}} {int(provider["breaker_state"] == "open")}')
+    lines += [
+        "# HELP healthyio_llm_provider_latency_seconds Recent reply latency per provider, as used for routing.",
+        "# TYPE healthyio_llm_provider_latency_seconds gauge",
+    ]
+    for name, provider in sorted(stats['providers'].items()):
+        for quantile in ('p50', 'p95'):
+            if provider[quantile] is not None:
+                lines.append(f'healthyio_llm_provider_latency_seconds{{provider="{name}",quantile="0.{quantile[1:]}"}} '
+                             f'{provider[quantile]}')
+    return lines
+
+
+def render():
+    """Everything recorded by this process in the Prometheus text format."""
+    with _lock:
+        histograms = {key: (list(h.buckets), list(h.counts), h.sum, h.count) for key, h in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for name, (kind, text) in HELP.items():
+        lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+        if kind == 'counter':
+            for (key_name, labels), value in sorted(counters.items()):
+                if key_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            continue
+        for (key_name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            if key_name != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + [None], counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', _bound(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    lines += _llm_lines()
+    return "\n".join(lines) + "\n"
+
+
+def allowed(request):
+    # Staff, a scraper sending "Authorization: Bearer <METRICS_TOKEN>", or one on METRICS_ALLOWED_IPS
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return True
+    if request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ()):
+        return True
+    return request.user.is_active and request.user.is_staff
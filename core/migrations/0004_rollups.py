@@ -0,0 +1,52 @@
+# Generated by Django 4.2 on 2026-10-18 07:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0003_userprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('log_count', models.IntegerField(default=0)),
+                ('sleep_sum', models.FloatField(default=0.0)),
+                ('score_sum', models.IntegerField(default=0)),
+                ('workout_count', models.IntegerField(default=0)),
+                ('latest_date', models.DateField(blank=True, null=True)),
+                ('latest_log_id', models.BigIntegerField(blank=True, null=True)),
+                ('latest_suggestion', models.TextField(blank=True, null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='health_summary', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='HealthRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('log_count', models.IntegerField(default=0)),
+                ('sleep_sum', models.FloatField(default=0.0)),
+                ('score_sum', models.IntegerField(default=0)),
+                ('workout_count', models.IntegerField(default=0)),
+                ('latest_date', models.DateField(blank=True, null=True)),
+                ('latest_log_id', models.BigIntegerField(blank=True, null=True)),
+                ('latest_suggestion', models.TextField(blank=True, null=True)),
+                ('period', models.CharField(choices=[('DAY', 'Daily'), ('WEEK', 'Weekly')], max_length=4)),
+                ('bucket_start', models.DateField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'period', 'bucket_start')},
+            },
+        ),
+    ]
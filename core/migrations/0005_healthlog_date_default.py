@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 07:43
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='healthlog',
+            name='date',
+            field=models.DateField(default=datetime.date.today),
+        ),
+    ]
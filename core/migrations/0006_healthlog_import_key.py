@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 07:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0005_healthlog_date_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='healthlog',
+            name='import_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='healthlog',
+            unique_together={('user', 'import_key')},
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_report_jobs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='healthlog',
+            index=models.Index(fields=['date'], name='core_health_date_db558f_idx'),
+        ),
+    ]
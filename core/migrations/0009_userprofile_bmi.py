@@ -0,0 +1,46 @@
+# Generated by Django 4.2 on 2026-10-18 08:06
+
+from django.db import migrations, models
+
+
+def bmi_status(bmi):
+    # Same thresholds as UserProfile.get_bmi_status(); historical models don't carry its methods
+    if bmi < 18.5: return "Underweight"
+    if 18.5 <= bmi < 24.9: return "Normal"
+    if 25 <= bmi < 29.9: return "Overweight"
+    return "Obese"
+
+
+def fill_bmi(apps, schema_editor):
+    UserProfile = apps.get_model('core', 'UserProfile')
+    batch = []
+    for profile in UserProfile.objects.only('height', 'weight').iterator(chunk_size=2000):
+        height_m = profile.height / 100
+        profile.bmi = round(profile.weight / height_m ** 2, 1) if height_m > 0 else 0
+        profile.bmi_status = bmi_status(profile.bmi)
+        batch.append(profile)
+        if len(batch) >= 2000:
+            UserProfile.objects.bulk_update(batch, ['bmi', 'bmi_status'])
+            batch = []
+    UserProfile.objects.bulk_update(batch, ['bmi', 'bmi_status'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_healthlog_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='bmi',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='bmi_status',
+            field=models.CharField(default='Normal', editable=False, max_length=12),
+        ),
+        migrations.RunPython(fill_bmi, migrations.RunPython.noop),
+    ]
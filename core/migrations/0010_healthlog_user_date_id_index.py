@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_userprofile_bmi'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='healthlog',
+            index=models.Index(fields=['user', '-date', '-id'], name='core_log_user_date_id_idx'),
+        ),
+    ]
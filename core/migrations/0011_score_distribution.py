@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_healthlog_user_date_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreDistribution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bmi_status', models.CharField(max_length=12)),
+                ('age_band', models.CharField(max_length=8)),
+                ('cumulative', models.JSONField()),
+                ('total', models.BigIntegerField()),
+                ('built_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('bmi_status', 'age_band')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 08:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0011_score_distribution'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoachSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inputs_key', models.CharField(max_length=100)),
+                ('model', models.CharField(max_length=100)),
+                ('content', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='coach_summary', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-18 08:23
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0012_coach_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('log_count', models.IntegerField(default=0)),
+                ('sleep_sum', models.FloatField(default=0.0)),
+                ('score_sum', models.IntegerField(default=0)),
+                ('workout_count', models.IntegerField(default=0)),
+                ('latest_date', models.DateField(blank=True, null=True)),
+                ('latest_log_id', models.BigIntegerField(blank=True, null=True)),
+                ('latest_suggestion', models.TextField(blank=True, null=True)),
+                ('month', models.DateField()),
+                ('food_count', models.IntegerField(default=0)),
+                ('water_sum', models.FloatField(default=0.0)),
+                ('calories_intake_sum', models.BigIntegerField(default=0)),
+                ('calories_burned_sum', models.BigIntegerField(default=0)),
+                ('score_min', models.IntegerField(blank=True, null=True)),
+                ('score_max', models.IntegerField(blank=True, null=True)),
+                ('sleep_min', models.FloatField(blank=True, null=True)),
+                ('sleep_max', models.FloatField(blank=True, null=True)),
+                ('score_counts', models.JSONField(default=list)),
+                ('archive_path', models.CharField(blank=True, max_length=255)),
+                ('archived_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'month')},
+            },
+        ),
+    ]
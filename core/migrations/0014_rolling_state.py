@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-18 08:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0013_archived_month'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('days', models.JSONField(default=list)),
+                ('logging_run', models.IntegerField(default=0)),
+                ('hydration_run', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rolling_state', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
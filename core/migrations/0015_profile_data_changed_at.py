@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 08:37
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_rolling_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='data_changed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_profile_data_changed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Food',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=120, unique=True)),
+                ('serving', models.CharField(max_length=40)),
+                ('serving_grams', models.FloatField()),
+                ('calories', models.FloatField()),
+                ('protein', models.FloatField()),
+                ('carbs', models.FloatField()),
+                ('fats', models.FloatField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 11:40
+
+import csv
+import os
+
+from django.db import migrations
+
+# The bundled food table, so food search works on a fresh install without `manage.py load_foods`
+DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'foods.csv')
+NUMBERS = ('serving_grams', 'calories', 'protein', 'carbs', 'fats')
+
+
+def load_foods(apps, schema_editor):
+    Food = apps.get_model('core', 'Food')
+    if Food.objects.exists():
+        return  # loaded by hand already
+    with open(DATA_PATH, newline='', encoding='utf-8') as f:
+        Food.objects.bulk_create([
+            Food(name=row['name'].strip(), serving=row['serving'].strip(),
+                 **{field: float(row[field]) for field in NUMBERS})
+            for row in csv.DictReader(f)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_food'),
+    ]
+
+    operations = [
+        migrations.RunPython(load_foods, migrations.RunPython.noop),
+    ]
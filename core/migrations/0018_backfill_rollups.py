@@ -0,0 +1,78 @@
+# Generated by Django 4.2 on 2026-10-18 13:05
+
+from datetime import timedelta
+
+from django.db import migrations
+
+# Build UserSummary/HealthRollup from the logs already in the table, so existing
+# users' dashboards are right straight after the deploy and the first new log is
+# added to their real totals, not to zero. The same computation as
+# core.rollups.compute(), written against the historical models; RollingState is
+# left out as core/rolling.py computes it on the fly and saves it on the next write.
+FIELDS = ('id', 'user_id', 'date', 'log_type', 'sleep_hours', 'health_score', 'suggestion')
+TOTALS = ('log_count', 'sleep_sum', 'score_sum', 'workout_count')
+BUCKETS = {
+    'DAY': lambda day: day,
+    'WEEK': lambda day: day - timedelta(days=day.weekday()),
+}
+
+
+def _add(row, log):
+    row.log_count += 1
+    row.sleep_sum += log['sleep_hours']
+    row.score_sum += log['health_score']
+    if log['log_type'] == 'EXERCISE':
+        row.workout_count += 1
+    # Logs arrive in (date, id) order, so each one is the latest so far
+    # (only archived months can hold a later one)
+    if row.latest_date is None or (log['date'], log['id']) >= (row.latest_date, row.latest_log_id):
+        row.latest_date, row.latest_log_id, row.latest_suggestion = log['date'], log['id'], log['suggestion']
+
+
+def backfill(apps, schema_editor):
+    HealthLog = apps.get_model('core', 'HealthLog')
+    HealthRollup = apps.get_model('core', 'HealthRollup')
+    UserSummary = apps.get_model('core', 'UserSummary')
+    ArchivedMonth = apps.get_model('core', 'ArchivedMonth')
+
+    # Whatever is there was counted from zero by the first writes after 0004; start over
+    HealthRollup.objects.all().delete()
+    UserSummary.objects.all().delete()
+
+    summaries = {}
+    for month in ArchivedMonth.objects.order_by('user_id', 'month').iterator(chunk_size=2000):
+        summary = summaries.setdefault(month.user_id, UserSummary(user_id=month.user_id))
+        for field in TOTALS:
+            setattr(summary, field, getattr(summary, field) + getattr(month, field))
+        summary.latest_date, summary.latest_log_id = month.latest_date, month.latest_log_id
+        summary.latest_suggestion = month.latest_suggestion
+
+    # period -> the bucket the current user's logs are going into; the ones before it are done
+    current, done = {}, []
+    for log in HealthLog.objects.order_by('user_id', 'date', 'id').values(*FIELDS).iterator(chunk_size=2000):
+        _add(summaries.setdefault(log['user_id'], UserSummary(user_id=log['user_id'])), log)
+        for period, start_of in BUCKETS.items():
+            row = current.get(period)
+            start = start_of(log['date'])
+            if row is None or (row.user_id, row.bucket_start) != (log['user_id'], start):
+                if row is not None:
+                    done.append(row)
+                row = current[period] = HealthRollup(user_id=log['user_id'], period=period, bucket_start=start)
+            _add(row, log)
+        if len(done) >= 2000:
+            HealthRollup.objects.bulk_create(done)
+            done = []
+
+    HealthRollup.objects.bulk_create(done + list(current.values()))
+    UserSummary.objects.bulk_create(summaries.values(), batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_load_foods'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
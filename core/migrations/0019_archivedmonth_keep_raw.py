@@ -0,0 +1,25 @@
+# Generated by Django 4.2 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+def mark_discarded(apps, schema_editor):
+    # Months archived without a file had their rows discarded
+    ArchivedMonth = apps.get_model('core', 'ArchivedMonth')
+    ArchivedMonth.objects.filter(archive_path='').update(keep_raw=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_backfill_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedmonth',
+            name='keep_raw',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(mark_discarded, migrations.RunPython.noop),
+    ]
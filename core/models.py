@@ -1,7 +1,10 @@
-from django.db import models
+import datetime
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 
 # 1. NEW: Profile Model to store body stats
 class UserProfile(models.Model):
@@ -9,6 +12,16 @@ class UserProfile(models.Model):
     age = models.IntegerField(default=25)
     height = models.FloatField(default=170.0, help_text="in cm")
     weight = models.FloatField(default=70.0, help_text="in kg")
+    # Stored copies of get_bmi()/get_bmi_status(), kept current by save(), so
+    # scoring and the profile page read a column instead of recomputing
+    bmi = models.FloatField(default=0.0, editable=False)
+    bmi_status = models.CharField(max_length=12, default="Normal", editable=False)
+    # Last change to anything the user's pages are built from (logs, profile, name,
+    # nightly snapshots); their ETag/Last-Modified validators read it (core/conditional.py)
+    data_changed_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    # Fields a user can edit; save() skips the write when none of them changed
+    TRACKED_FIELDS = ('user_id', 'age', 'height', 'weight')
     
     def get_bmi(self):
         # BMI = kg / m^2
@@ -23,6 +36,47 @@ class UserProfile(models.Model):
         if 18.5 <= bmi < 24.9: return "Normal"
         if 25 <= bmi < 29.9: return "Overweight"
         return "Obese"
+
+    def update_bmi(self):
+        self.bmi = self.get_bmi()
+        self.bmi_status = self.get_bmi_status()
+
+    def _tracked_values(self):
+        return {field: self.__dict__.get(field) for field in self.TRACKED_FIELDS}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded = instance._tracked_values()
+        instance._loaded_bmi_status = instance.__dict__.get('bmi_status')
+        return instance
+
+    def has_changes(self):
+        loaded = getattr(self, '_loaded', None)
+        return loaded is None or loaded != self._tracked_values()
+
+    @classmethod
+    def touch(cls, user_ids=None):
+        # Mark the users' data (everyone's, with None) as changed now
+        profiles = cls.objects.all()
+        if user_ids is not None:
+            profiles = profiles.filter(user_id__in=user_ids)
+        profiles.update(data_changed_at=timezone.now())
+
+    def save(self, *args, **kwargs):
+        if self.pk and not kwargs.get('force_insert') and not self.has_changes():
+            return  # nothing a user can edit has changed, so there is nothing to write
+        self.update_bmi()
+        self.data_changed_at = timezone.now()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Log scores depend on the BMI status, so rescore the history when it changes
+            old_status = getattr(self, '_loaded_bmi_status', None)
+            if old_status is not None and old_status != self.bmi_status:
+                from . import scoring
+                scoring.rescore([self.user_id])
+        self._loaded = self._tracked_values()
+        self._loaded_bmi_status = self.bmi_status
     
     def __str__(self):
         return f"{self.user.username}'s Profile"
@@ -33,10 +87,6 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.userprofile.save()
-
 # 2. UPDATED: HealthLog to use BMI
 class HealthLog(models.Model):
     LOG_TYPES = (
@@ -53,7 +103,8 @@ class HealthLog(models.Model):
     )
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    date = models.DateField(auto_now_add=True)
+    # Defaults to today; bulk imports and synthetic data can set older dates
+    date = models.DateField(default=datetime.date.today)
     log_type = models.CharField(max_length=20, choices=LOG_TYPES)
     
     # Common Fields
@@ -74,16 +125,24 @@ class HealthLog(models.Model):
     health_score = models.IntegerField(default=0)
     suggestion = models.TextField(blank=True, null=True)
 
+    # Set for rows that came from a bulk import, so re-running an import skips them
+    import_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    class Meta:
+        unique_together = ('user', 'import_key')
+        indexes = [
+            # Date-range scans (the admin bulk export walks the table one range at a time)
+            models.Index(fields=['date']),
+            # A user's logs newest first: dashboard, AI coach and keyset pagination (core/history.py)
+            models.Index(fields=['user', '-date', '-id'], name='core_log_user_date_id_idx'),
+        ]
+
     def calculate_metrics(self):
         score = 50 # Base Score
         tips = []
 
         # --- NEW LOGIC: BMI Impact ---
-        # We try to get the profile. If it fails (rare), assume normal.
-        try:
-            bmi_status = self.user.userprofile.get_bmi_status()
-        except:
-            bmi_status = "Normal"
+        bmi_status = self.get_bmi_status()
 
         # Sleep Logic
         if 7 <= self.sleep_hours <= 9:
@@ -125,9 +184,258 @@ class HealthLog(models.Model):
         self.health_score = min(100, max(0, score))
         self.suggestion = " ".join(tips) if tips else "Good routine. Keep it up!"
 
+    def get_bmi_status(self):
+        # Use the profile already loaded with the user when there is one (request.user
+        # carries it, see core/backends.py); otherwise read just the stored column.
+        # Users without a profile (rare) are scored as normal.
+        if HealthLog.user.is_cached(self) and User.userprofile.is_cached(self.user):
+            try:
+                return self.user.userprofile.bmi_status
+            except UserProfile.DoesNotExist:
+                return "Normal"
+        status = UserProfile.objects.filter(user_id=self.user_id).values_list('bmi_status', flat=True).first()
+        return status or "Normal"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so the rollups can subtract the old values on edit
+        from . import rollups
+        instance._rollup_snapshot = rollups.snapshot(instance)
+        return instance
+
     def save(self, *args, **kwargs):
+        from . import rollups, rolling
         self.calculate_metrics()
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            old = getattr(self, '_rollup_snapshot', None) if self.pk else None
+            if self.pk and old is None:
+                old = rollups.load_snapshot(self.pk)
+            super().save(*args, **kwargs)
+            if old:
+                rollups.apply(old, -1)
+            new = rollups.snapshot(self)
+            rollups.apply(new, +1)
+            rolling.update(self.user_id, old, new)
+        self._rollup_snapshot = new
+
+    def delete(self, *args, **kwargs):
+        from . import rollups, rolling
+        with transaction.atomic():
+            old = getattr(self, '_rollup_snapshot', None) or rollups.load_snapshot(self.pk)
+            result = super().delete(*args, **kwargs)
+            if old:
+                rollups.apply(old, -1)
+                rolling.update(old['user_id'], old, None)
+        return result
+
+    def __str__(self):
+        return f"{self.user.username} - {self.date}"
+
+
+# 3. Rollups: running totals so the dashboard doesn't scan the whole history.
+# Built for existing logs by migration core.0018, kept in sync by
+# HealthLog.save()/delete() (see core/rollups.py) and rebuilt/verified with
+# `manage.py rebuild_rollups`.
+class RollupFields(models.Model):
+    log_count = models.IntegerField(default=0)
+    sleep_sum = models.FloatField(default=0.0)
+    score_sum = models.IntegerField(default=0)
+    workout_count = models.IntegerField(default=0)
+
+    # Latest log in this bucket, ordered by (date, id)
+    latest_date = models.DateField(null=True, blank=True)
+    latest_log_id = models.BigIntegerField(null=True, blank=True)
+    latest_suggestion = models.TextField(blank=True, null=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def avg_sleep(self):
+        return self.sleep_sum / self.log_count if self.log_count else 0
+
+    @property
+    def avg_health_score(self):
+        return self.score_sum / self.log_count if self.log_count else 0
+
+
+class UserSummary(RollupFields):
+    # All-time totals, one row per user
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='health_summary')
+    # Bumped by every write to the user's logs (rollups.apply/rebuild save this row)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}'s Summary"
+
+
+class HealthRollup(RollupFields):
+    PERIODS = (
+        ('DAY', 'Daily'),
+        ('WEEK', 'Weekly'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    period = models.CharField(max_length=4, choices=PERIODS)
+    # First day of the bucket (the Monday for weekly buckets)
+    bucket_start = models.DateField()
+
+    class Meta:
+        unique_together = ('user', 'period', 'bucket_start')
+
+    def __str__(self):
+        return f"{self.user.username} - {self.period} {self.bucket_start}"
+
+# 4. PDF reports are rendered by `manage.py run_report_jobs`, not in the request, unless
+# no worker is running (see core/reports.py)
+class ReportJob(models.Model):
+    PENDING, RUNNING, DONE, FAILED = 'PENDING', 'RUNNING', 'DONE', 'FAILED'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Stamp of the user's logs the report was built from; a new stamp means a new report
+    version = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    # Relative to MEDIA_ROOT
+    path = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('user', 'version')
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.user.username} report {self.version} ({self.status})"
+
+
+class WorkerHeartbeat(models.Model):
+    # When each kind of background worker last showed it is running; one row per worker kind
+    name = models.CharField(max_length=40, unique=True)
+    beat_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} seen {self.beat_at}"
+
+# 5. Snapshot of everyone's health scores, for "how do I compare?" (see core/percentiles.py)
+class ScoreDistribution(models.Model):
+    # 'all' in either column means the segment is not split on it
+    bmi_status = models.CharField(max_length=12)
+    age_band = models.CharField(max_length=8)
+    # cumulative[s] = number of logs scoring s or less, for s in 0..100
+    cumulative = models.JSONField()
+    total = models.BigIntegerField()
+    built_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('bmi_status', 'age_band')
+
+    def __str__(self):
+        return f"Scores for {self.bmi_status}/{self.age_band} ({self.total} logs)"
+
+# 6. AI coach answers precomputed overnight by `manage.py run_coach_batch` (see core/coach_batch.py)
+class CoachSummary(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='coach_summary')
+    # ai_cache.make_key() of the model and prompt it answers; served only while the user's prompt is unchanged
+    inputs_key = models.CharField(max_length=100)
+    model = models.CharField(max_length=100)
+    content = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"{self.user.username} - {self.date}"
\ No newline at end of file
+        return f"Coach summary for {self.user.username}"
+
+# 7. Logs older than ARCHIVE_AFTER_DAYS, compacted per user and month by
+# `manage.py archive_logs` (see core/archive.py). The rollup fields cover the
+# month's logs like a HealthRollup would; the dashboard, trends and reports add
+# these rows to what is left in HealthLog.
+class ArchivedMonth(RollupFields):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # First day of the month
+    month = models.DateField()
+    food_count = models.IntegerField(default=0)
+    water_sum = models.FloatField(default=0.0)
+    calories_intake_sum = models.BigIntegerField(default=0)  # FOOD logs
+    calories_burned_sum = models.BigIntegerField(default=0)  # EXERCISE logs
+    score_min = models.IntegerField(null=True, blank=True)
+    score_max = models.IntegerField(null=True, blank=True)
+    sleep_min = models.FloatField(null=True, blank=True)
+    sleep_max = models.FloatField(null=True, blank=True)
+    # score_counts[s] = logs that scored s, for s in 0..100
+    score_counts = models.JSONField(default=list)
+    # Gzipped NDJSON of the original rows, relative to MEDIA_ROOT; blank if they were discarded
+    archive_path = models.CharField(max_length=255, blank=True)
+    # Whether the month's rows are kept in that file (ARCHIVE_KEEP_RAW when it was first archived);
+    # later runs on the month follow it, so the file always holds every row or none
+    keep_raw = models.BooleanField(default=True)
+    archived_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'month')
+
+    def __str__(self):
+        return f"{self.user.username} - archived {self.month:%Y-%m}"
+
+# 8. Cross-day features (window sums, streaks) per user, kept in sync on every
+# log write by core/rolling.py and rebuilt with the other rollups.
+class RollingState(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='rolling_state')
+    # The user's latest logged day; the window and the streaks end there
+    end_date = models.DateField(null=True, blank=True)
+    # Ring of per-day sums for the window up to end_date, slot = date.toordinal() % rolling.WINDOW_DAYS;
+    # each slot is [log_count, sleep_sum, water_sum, calories_intake_sum, calories_burned_sum]
+    days = models.JSONField(default=list)
+    # Consecutive days right before end_date with a log / meeting the water target
+    logging_run = models.IntegerField(default=0)
+    hydration_run = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}'s rolling state"
+
+# 9. Nutrients behind the food search on the log form, loaded from
+# core/data/foods.csv by `manage.py load_foods` and searched in memory (see core/foods.py)
+class Food(models.Model):
+    name = models.CharField(max_length=120, unique=True)
+    serving = models.CharField(max_length=40)  # e.g. "1 medium", the portion offered first
+    serving_grams = models.FloatField()
+    # Per 100 g
+    calories = models.FloatField()
+    protein = models.FloatField()
+    carbs = models.FloatField()
+    fats = models.FloatField()
+
+    def __str__(self):
+        return self.name
+
+
+# Cached AI coach responses are keyed on their inputs; drop the user's entry as soon as they change
+@receiver(post_save, sender=HealthLog)
+@receiver(post_delete, sender=HealthLog)
+@receiver(post_save, sender=UserProfile)
+def invalidate_ai_cache(sender, instance, **kwargs):
+    from . import ai_cache
+    ai_cache.invalidate(instance.user_id)
+
+# Log writes move the user's data_changed_at (profile saves set it themselves); ETags
+# and the cached dashboard/profile fragments (core/fragments.py) are keyed on it
+@receiver(post_save, sender=HealthLog)
+@receiver(post_delete, sender=HealthLog)
+def touch_data_changed(sender, instance, **kwargs):
+    UserProfile.touch([instance.user_id])
+
+# The in-memory food search index is rebuilt on next use (see core/foods.py)
+@receiver(post_save, sender=Food)
+@receiver(post_delete, sender=Food)
+def reset_food_index(sender, **kwargs):
+    from . import foods
+    foods.reset()
@@ -0,0 +1,172 @@
+import itertools
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, Max, Min, OuterRef, Q, Subquery, Value, When
+from django.utils import timezone
+
+from .models import ArchivedMonth, HealthLog, ScoreDistribution, UserProfile
+
+# "How do I compare?": the score of a user's latest log ranked against everyone's logs,
+# read from ScoreDistribution snapshots that `manage.py build_percentiles`
+# rebuilds periodically. Scores are whole numbers 0..100, so each segment is
+# an exact 101-bucket cumulative histogram and a lookup is two list reads.
+
+ALL = 'all'
+MAX_SCORE = 100
+CHUNK_SIZE = 100_000  # log ids per GROUP BY while building
+MIN_SEGMENT = 100  # smaller segments are ranked against everyone instead
+TOUCH_BATCH = 2000  # users per UPDATE when a new snapshot moves their percentile
+
+# (label, lowest age, first age past the band)
+AGE_BANDS = (
+    ('under 18', None, 18),
+    ('18-29', 18, 30),
+    ('30-39', 30, 40),
+    ('40-49', 40, 50),
+    ('50-64', 50, 65),
+    ('65+', 65, None),
+)
+
+
+def age_band(age):
+    for label, low, high in AGE_BANDS:
+        if (low is None or age >= low) and (high is None or age < high):
+            return label
+
+
+def _age_band_expression(field):
+    # age_band() in SQL, so the database groups by band
+    whens = []
+    for label, low, high in AGE_BANDS:
+        bounds = {}
+        if low is not None:
+            bounds[f'{field}__gte'] = low
+        if high is not None:
+            bounds[f'{field}__lt'] = high
+        whens.append(When(then=Value(label), **bounds))
+    return Case(*whens, default=Value(None), output_field=CharField())
+
+
+def _segments(bmi_status, band):
+    # Each log counts towards its own segment and the wider ones around it
+    segments = {(ALL, ALL)}
+    if bmi_status is not None:
+        segments.add((bmi_status, ALL))
+        if band is not None:
+            segments.update({(bmi_status, band), (ALL, band)})
+    return segments
+
+
+def count_scores(chunk_size=CHUNK_SIZE):
+    """{(bmi_status, age_band): [logs with score 0, 1, ..., 100]} over every log, archived ones included.
+
+    Walks the primary key in ranges of `chunk_size` ids with one GROUP BY each,
+    so no query scans more than a slice of the table and memory is one small
+    histogram per segment however many logs there are.
+    """
+    counts = {}
+    # Archived months carry their own score histogram
+    archived = ArchivedMonth.objects.values_list(
+        'user__userprofile__bmi_status', 'user__userprofile__age', 'score_counts'
+    )
+    for bmi_status, age, histogram in archived.iterator(chunk_size=2000):
+        for segment in _segments(bmi_status, age_band(age) if age is not None else None):
+            total = counts.setdefault(segment, [0] * (MAX_SCORE + 1))
+            for score, n in enumerate(histogram):
+                total[score] += n
+
+    bounds = HealthLog.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return counts
+
+    for low in range(bounds['low'], bounds['high'] + 1, chunk_size):
+        rows = (
+            HealthLog.objects.filter(id__gte=low, id__lt=low + chunk_size)
+            .annotate(band=_age_band_expression('user__userprofile__age'))
+            .values_list('user__userprofile__bmi_status', 'band', 'health_score')
+            .annotate(n=Count('id'))
+            .order_by()
+        )
+        for bmi_status, band, score, n in rows:
+            score = min(MAX_SCORE, max(0, score))
+            for segment in _segments(bmi_status, band):
+                counts.setdefault(segment, [0] * (MAX_SCORE + 1))[score] += n
+    return counts
+
+
+def latest_score(latest_log_id='latest_log_id'):
+    """Subquery for the score of the user's latest log (the one ranked on the dashboard).
+
+    `latest_log_id` is the path to UserSummary.latest_log_id from the annotated
+    model. NULL while that log is archived.
+    """
+    return Subquery(HealthLog.objects.filter(id=OuterRef(latest_log_id)).values('health_score')[:1])
+
+
+def _moved(old, new):
+    # Users whose dashboard percentile differs between two snapshots (lists of rows)
+    profiles = (UserProfile.objects.annotate(latest_score=latest_score('user__health_summary__latest_log_id'))
+                .filter(latest_score__isnull=False).only('user_id', 'bmi_status', 'age'))
+    for profile in profiles.iterator(chunk_size=2000):
+        if _ranked(profile, profile.latest_score, old) != _ranked(profile, profile.latest_score, new):
+            yield profile.user_id
+
+
+def build(chunk_size=CHUNK_SIZE):
+    """Replace the snapshot with a fresh one. Returns the number of logs counted."""
+    counts = count_scores(chunk_size)
+    built_at = timezone.now()
+    with transaction.atomic():
+        old = list(ScoreDistribution.objects.all())
+        ScoreDistribution.objects.all().delete()
+        new = ScoreDistribution.objects.bulk_create([
+            ScoreDistribution(bmi_status=bmi_status, age_band=band, cumulative=list(itertools.accumulate(histogram)),
+                              total=sum(histogram), built_at=built_at)
+            for (bmi_status, band), histogram in counts.items()
+        ])
+    # The dashboard's cached stats (and its ETag) show the percentile; only the
+    # users it moved for need them rebuilt
+    moved = _moved(old, new)
+    while batch := list(itertools.islice(moved, TOUCH_BATCH)):
+        UserProfile.touch(batch)
+    return sum(counts.get((ALL, ALL), []))
+
+
+def rank(cumulative, score):
+    """Percent of logs scoring below `score`, with ties counted as half."""
+    score = min(MAX_SCORE, max(0, round(score)))
+    below = cumulative[score - 1] if score else 0
+    equal = cumulative[score] - below
+    return round(100 * (below + equal / 2) / cumulative[-1])
+
+
+def _snapshots(profile):
+    # The user's segment and the everyone fallback, in one indexed query
+    return ScoreDistribution.objects.filter(
+        Q(bmi_status=profile.bmi_status, age_band=age_band(profile.age)) | Q(bmi_status=ALL, age_band=ALL)
+    )
+
+
+def percentile(profile, score):
+    """{'rank': percent, 'segment': who it is compared with}, or None before the first snapshot.
+
+    `score` is one log's, like the scores in the snapshot. One indexed query for
+    the user's segment and the everyone fallback.
+    """
+    return _ranked(profile, score, list(_snapshots(profile)))
+
+
+async def apercentile(profile, score):
+    return _ranked(profile, score, [row async for row in _snapshots(profile)])
+
+
+def _ranked(profile, score, snapshots):
+    band = age_band(profile.age)
+    rows = {(row.bmi_status, row.age_band): row for row in snapshots}
+    row = rows.get((profile.bmi_status, band))
+    segment = f"people aged {band} in the {profile.bmi_status} BMI range"
+    if row is None or row.total < MIN_SEGMENT:
+        row, segment = rows.get((ALL, ALL)), "everyone"
+    if row is None or not row.total:
+        return None
+    return {'rank': rank(row.cumulative, score), 'segment': segment}
@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.db.models import F
+from django.template.loader import get_template
+from django.utils import timezone
+
+from . import metrics
+from .models import ArchivedMonth, HealthLog, ReportJob, UserSummary, WorkerHeartbeat
+
+# PDF reports are built by a worker (`manage.py run_report_jobs`) from a queue
+# kept in the ReportJob table, and stored under MEDIA_ROOT/reports/. Finished
+# files are keyed on a stamp of the user's logs, so downloading an unchanged
+# history again is just a file read. Workers record a heartbeat; while none
+# has for REPORT_WORKER_TIMEOUT seconds, a download renders its job in the
+# request instead, so a deploy without a worker still serves reports.
+# xhtml2pdf (with reportlab) takes about a second to import, so it is loaded
+# by the first render, or by core/warmup.py.
+
+TEMPLATE = 'core/pdf_report.html'
+# Bump when pdf_report.html changes, so old files are not served
+TEMPLATE_VERSION = 2
+REPORT_DIR = 'reports'
+HEARTBEAT = 'run_report_jobs'
+HEARTBEAT_INTERVAL = 10  # seconds between a worker's heartbeats; keep well under REPORT_WORKER_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+def version_for(user):
+    # UserSummary.updated_at moves on every log write (and archive run); the name and email are printed on the report
+    summary = UserSummary.objects.filter(user=user).values_list('updated_at', 'log_count').first()
+    parts = [TEMPLATE_VERSION, summary, user.first_name, user.last_name, user.username, user.email]
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def file_path(job):
+    return os.path.join(settings.MEDIA_ROOT, job.path)
+
+
+def is_ready(job):
+    return job.status == ReportJob.DONE and os.path.exists(file_path(job))
+
+
+def request_report(user):
+    """Return the ReportJob for the user's current logs, queueing it if needed."""
+    job, created = ReportJob.objects.get_or_create(user=user, version=version_for(user))
+    if created:
+        return job
+
+    max_attempts = getattr(settings, 'REPORT_MAX_ATTEMPTS', 3)
+    requeue = (
+        (job.status == ReportJob.DONE and not is_ready(job))  # file was cleaned up
+        or (job.status == ReportJob.FAILED and job.attempts < max_attempts)
+    )
+    if requeue:
+        ReportJob.objects.filter(pk=job.pk, status=job.status).update(status=ReportJob.PENDING, error='')
+        job.status = ReportJob.PENDING
+    return job
+
+
+def heartbeat():
+    WorkerHeartbeat.objects.update_or_create(name=HEARTBEAT, defaults={'beat_at': timezone.now()})
+
+
+def worker_alive():
+    since = timezone.now() - timedelta(seconds=getattr(settings, 'REPORT_WORKER_TIMEOUT', 60))
+    return WorkerHeartbeat.objects.filter(name=HEARTBEAT, beat_at__gte=since).exists()
+
+
+def run_inline(job):
+    """Build a PENDING job in this process, for when no worker is running. Returns the job.
+
+    Claimed like claim_next() does, so a worker that starts meanwhile doesn't build it too.
+    """
+    claimed = ReportJob.objects.filter(pk=job.pk, status=ReportJob.PENDING).update(
+        status=ReportJob.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1
+    )
+    if not claimed:
+        job.refresh_from_db()
+        return job
+    return run_job(job)
+
+
+def preload():
+    from xhtml2pdf import pisa  # noqa: F401
+
+
+def render(user, dest):
+    from xhtml2pdf import pisa
+
+    # Only the columns the template prints; the history can be long
+    logs = HealthLog.objects.filter(user=user).order_by('-date', '-id').only(
+        'date', 'log_type', 'exercise_type', 'calories_burned', 'calories_intake', 'health_score'
+    )
+    # Months moved out of HealthLog by `manage.py archive_logs` are listed as monthly totals
+    archived = ArchivedMonth.objects.filter(user=user).order_by('-month')
+    with metrics.span('pdf_template'):
+        html = get_template(TEMPLATE).render({'logs': logs, 'archived_months': archived, 'user': user})
+    with metrics.span('pdf'):
+        status = pisa.CreatePDF(html, dest=dest)
+    if status.err:
+        raise RuntimeError(f"xhtml2pdf reported {status.err} error(s)")
+
+
+def claim_next():
+    # A conditional UPDATE takes the job, so any number of workers can share the
+    # queue without row locks. RUNNING jobs older than REPORT_JOB_TIMEOUT belong
+    # to a worker that died and are taken over.
+    stale = timezone.now() - timedelta(seconds=getattr(settings, 'REPORT_JOB_TIMEOUT', 600))
+    candidates = (
+        list(ReportJob.objects.filter(status=ReportJob.PENDING).order_by('created_at').values_list('pk', 'status')[:10])
+        + list(ReportJob.objects.filter(status=ReportJob.RUNNING, started_at__lt=stale).values_list('pk', 'status')[:10])
+    )
+    for pk, status in candidates:
+        claimed = ReportJob.objects.filter(pk=pk, status=status).exclude(
+            status=ReportJob.RUNNING, started_at__gte=stale
+        ).update(status=ReportJob.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1)
+        if claimed:
+            return ReportJob.objects.select_related('user').get(pk=pk)
+    return None
+
+
+def _remove(job):
+    try:
+        os.remove(file_path(job))
+    except OSError:
+        pass
+
+
+def run_job(job):
+    # Write to a temporary name and rename, so a reader never sees half a file
+    job.path = os.path.join(REPORT_DIR, str(job.user_id), f"{job.version}.pdf")
+    target = file_path(job)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial = f"{target}.{os.getpid()}.part"
+    try:
+        with open(partial, 'wb') as dest:
+            render(job.user, dest)
+        os.replace(partial, target)
+    except Exception as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        job.status, job.error = ReportJob.FAILED, str(e)
+    else:
+        job.status, job.error = ReportJob.DONE, ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'path', 'finished_at'])
+
+    if job.status == ReportJob.DONE:
+        # Older finished reports of this user can never be served again. Queued and
+        # running ones are left alone: another worker may be writing to them right now.
+        older = ReportJob.objects.filter(user_id=job.user_id, created_at__lte=job.created_at,
+                                         status__in=[ReportJob.DONE, ReportJob.FAILED])
+        for old in older.exclude(pk=job.pk):
+            if old.path and old.path != job.path:
+                _remove(old)
+            old.delete()
+    return job
+
+
+def work(once=False, poll_interval=1.0, max_jobs=None):
+    """Run queued report jobs until stopped (or until the queue is empty with once=True).
+
+    Returns the number of jobs processed. A worker exits after `max_jobs` jobs
+    so a process supervisor can hand its memory back to the OS.
+    """
+    processed, beaten_at = 0, None
+    while max_jobs is None or processed < max_jobs:
+        close_old_connections()
+        if beaten_at is None or time.monotonic() - beaten_at >= HEARTBEAT_INTERVAL:
+            heartbeat()
+            beaten_at = time.monotonic()
+        job = claim_next()
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        try:
+            run_job(job)
+        except DatabaseError as e:
+            # The job's row went away while it rendered (or the database did); keep serving the queue
+            logger.warning("Report job %s could not be saved: %s", job.pk, e)
+        processed += 1
+    return processed
@@ -0,0 +1,218 @@
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Q, Sum
+
+from .models import HealthLog, RollingState
+
+# Features that look across days -- the 7-day sleep average, the weekly calorie
+# balance, logging and hydration streaks -- kept per user in RollingState, so
+# reading them is one row. The state holds per-day sums for the WINDOW_DAYS
+# days up to the user's latest logged day, in a ring indexed by
+# date.toordinal() % WINDOW_DAYS, plus how long each streak had run before that
+# day. HealthLog.save()/delete() update it in O(1) through update(). The two
+# changes the ring can't absorb -- the latest day losing its last log, and a
+# back-dated log that joins a streak to the one before it -- recompute the
+# state from the days it covers, reading back only as far as the streaks go.
+# Streaks stop at months moved out by `manage.py archive_logs`.
+
+WINDOW_DAYS = 7
+HYDRATED_GLASSES = 8  # the scorer's water target, met on average by the day's logs
+SEARCH_DAYS = 31  # days read per query when recomputing
+# The per-day sums in each ring slot, in order
+SLOT = ('log_count', 'sleep_sum', 'water_sum', 'calories_intake_sum', 'calories_burned_sum')
+STREAKS = ('logging', 'hydration')
+STATE_FIELDS = ('end_date', 'days', 'logging_run', 'hydration_run')
+
+
+def _slot(day):
+    return day.toordinal() % WINDOW_DAYS
+
+
+def _empty():
+    return [0] * len(SLOT)
+
+
+def _qualifies(streak, sums):
+    # Whether a day with these sums continues the streak
+    if not sums[0]:
+        return False
+    return streak == 'logging' or sums[2] >= HYDRATED_GLASSES * sums[0]
+
+
+def _add(sums, snap, sign):
+    exercise = snap['log_type'] == 'EXERCISE'
+    values = (1, snap['sleep_hours'], snap['water_intake'],
+              0 if exercise else snap['calories_intake'], snap['calories_burned'] if exercise else 0)
+    for i, value in enumerate(values):
+        # Rounded so adding and taking away the same float gets back to exactly 0
+        sums[i] = round(sums[i] + sign * value, 6)
+
+
+def _step(state, snap, sign):
+    """Apply one log (a rollup snapshot) to `state` in memory. False when it has to be recomputed instead."""
+    day, end = snap['date'], state.end_date
+    if end is None or day > end:
+        if sign < 0:
+            return False
+        if end is None or not state.days:
+            state.days = [_empty() for _ in range(WINDOW_DAYS)]
+            state.logging_run = state.hydration_run = 0
+        else:
+            # A later day: the old end day joins the runs (or a gap ends them) and the ring moves on
+            gap = (day - end).days
+            for streak in STREAKS:
+                run = getattr(state, f'{streak}_run')
+                continued = gap == 1 and _qualifies(streak, state.days[_slot(end)])
+                setattr(state, f'{streak}_run', run + 1 if continued else 0)
+            for offset in range(1, min(gap, WINDOW_DAYS) + 1):
+                state.days[_slot(end + timedelta(days=offset))] = _empty()
+        state.end_date = day
+        _add(state.days[_slot(day)], snap, sign)
+        return True
+
+    age = (end - day).days
+    sums = state.days[_slot(day)] if age < WINDOW_DAYS else None
+    before = {streak: _qualifies(streak, sums) for streak in STREAKS} if sums else {}
+    if sums:
+        _add(sums, snap, sign)
+        if sums[0] < 0:
+            return False
+    if age == 0:
+        # The end day itself isn't part of the runs; if it emptied, the state moves back
+        return sums[0] > 0
+
+    for streak in STREAKS:
+        run = getattr(state, f'{streak}_run')
+        if age > run + 1:
+            continue  # a day that breaks the streak lies in between
+        if sums is None:
+            return False
+        after = _qualifies(streak, sums)
+        if after == before[streak]:
+            continue
+        if after:
+            return False  # the day that broke the streak now continues it
+        setattr(state, f'{streak}_run', age - 1)
+    return True
+
+
+def update(user_id, old=None, new=None):
+    """Move one log from `old` to `new` (rollup snapshots; None for an insert or a delete).
+
+    Must run inside the transaction of the HealthLog write, after it.
+    """
+    state = RollingState.objects.select_for_update().filter(user_id=user_id).first()
+    # New before old, so editing the only log of the latest day never empties it on the way
+    changes = [(snap, sign) for snap, sign in ((new, +1), (old, -1)) if snap]
+    if state is not None and all(_step(state, snap, sign) for snap, sign in changes):
+        state.save()
+    else:
+        rebuild(user_id)
+
+
+def _day_sums(user_id, first, last):
+    rows = (
+        HealthLog.objects.filter(user_id=user_id, date__gte=first, date__lte=last)
+        .values('date').order_by()
+        .annotate(log_count=Count('id'), sleep_sum=Sum('sleep_hours'), water_sum=Sum('water_intake'),
+                  calories_intake_sum=Sum('calories_intake', filter=~Q(log_type='EXERCISE')),
+                  calories_burned_sum=Sum('calories_burned', filter=Q(log_type='EXERCISE')))
+    )
+    return {row['date']: [round(row[field] or 0, 6) for field in SLOT] for row in rows}
+
+
+def compute(user_id):
+    """A fresh (unsaved) RollingState for the user, read from HealthLog SEARCH_DAYS days at a time."""
+    end = HealthLog.objects.filter(user_id=user_id).order_by('-date').values_list('date', flat=True).first()
+    state = RollingState(user_id=user_id, end_date=end)
+    if end is None:
+        return state
+
+    state.days = [_empty() for _ in range(WINDOW_DAYS)]
+    running = set(STREAKS)
+    last = end
+    while True:
+        first = last - timedelta(days=SEARCH_DAYS - 1)
+        sums = _day_sums(user_id, first, last)
+        for offset in range(SEARCH_DAYS):
+            day = last - timedelta(days=offset)
+            age = (end - day).days
+            day_sums = sums.get(day, _empty())
+            if age < WINDOW_DAYS:
+                state.days[_slot(day)] = day_sums
+            elif not running:
+                return state
+            if age:
+                for streak in list(running):
+                    if _qualifies(streak, day_sums):
+                        setattr(state, f'{streak}_run', getattr(state, f'{streak}_run') + 1)
+                    else:
+                        running.discard(streak)
+        last = first - timedelta(days=1)
+
+
+def rebuild(user_id):
+    state = compute(user_id)
+    if state.end_date is None:
+        RollingState.objects.filter(user_id=user_id).delete()
+        return None
+    RollingState.objects.update_or_create(
+        user_id=user_id, defaults={field: getattr(state, field) for field in STATE_FIELDS}
+    )
+    return state
+
+
+def verify(user_id):
+    """Compare the stored state against compute(). Returns a list of problems."""
+    stored = RollingState.objects.filter(user_id=user_id).first()
+    expected = compute(user_id)
+    label = f"user {user_id} rolling state"
+    if expected.end_date is None:
+        return []  # a leftover row is reported by rollups.verify()
+    if stored is None:
+        return [f"{label}: missing"]
+    problems = []
+    for field in ('end_date', 'logging_run', 'hydration_run'):
+        if getattr(stored, field) != getattr(expected, field):
+            problems.append(f"{label}: {field} is {getattr(stored, field)!r}, expected {getattr(expected, field)!r}")
+    for day in range(WINDOW_DAYS):
+        # Slots are only compared for days inside the window
+        date = expected.end_date - timedelta(days=day)
+        have, want = stored.days[_slot(date)], expected.days[_slot(date)]
+        if any(abs(a - b) > 1e-6 for a, b in zip(have, want)):
+            problems.append(f"{label}: sums for {date} are {have}, expected {want}")
+    return problems
+
+
+def features(state):
+    """Cross-day numbers at the user's latest logged day, or None before the first log.
+
+    {'end_date', 'days_logged', 'avg_sleep', 'avg_water', 'calorie_balance',
+    'logging_streak', 'hydration_streak'}; the averages are per log over the
+    WINDOW_DAYS days up to end_date, and the balance is calories eaten minus burned.
+    """
+    if state is None or state.end_date is None:
+        return None
+    count, sleep, water, intake, burned = (sum(sums[i] for sums in state.days) for i in range(len(SLOT)))
+    latest = state.days[_slot(state.end_date)]
+    return {
+        'end_date': state.end_date,
+        'days_logged': sum(1 for sums in state.days if sums[0]),
+        'avg_sleep': round(sleep / count, 1) if count else 0,
+        'avg_water': round(water / count, 1) if count else 0,
+        'calorie_balance': round(intake - burned),
+        'logging_streak': state.logging_run + 1,
+        'hydration_streak': state.hydration_run + 1 if _qualifies('hydration', latest) else 0,
+    }
+
+
+def for_user(user_id):
+    # Computed on the fly for users whose state hasn't been built yet (see `manage.py rebuild_rollups`)
+    state = RollingState.objects.filter(user_id=user_id).first()
+    return features(state if state is not None else compute(user_id))
+
+
+async def afor_user(user_id):
+    state = await RollingState.objects.filter(user_id=user_id).afirst()
+    return features(state if state is not None else await sync_to_async(compute)(user_id))
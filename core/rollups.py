@@ -0,0 +1,246 @@
+from datetime import timedelta
+
+from django.db import transaction
+
+from . import rolling
+from .models import ArchivedMonth, HealthLog, HealthRollup, RollingState, UserProfile, UserSummary
+
+# Fields of a HealthLog the rollups (and core/rolling.py) care about
+SNAPSHOT_FIELDS = ('id', 'user_id', 'date', 'log_type', 'sleep_hours', 'health_score', 'suggestion',
+                   'water_intake', 'calories_intake', 'calories_burned')
+
+
+def week_start(day):
+    # Weekly buckets start on Monday
+    return day - timedelta(days=day.weekday())
+
+
+# period -> (bucket start for a date, bucket length in days)
+BUCKETS = {
+    'DAY': (lambda day: day, 1),
+    'WEEK': (week_start, 7),
+}
+
+
+def snapshot(log):
+    # Plain dict of the rollup fields, or None if some of them were deferred
+    values = log.__dict__
+    if any(field not in values for field in SNAPSHOT_FIELDS):
+        return None
+    return {field: values[field] for field in SNAPSHOT_FIELDS}
+
+
+def load_snapshot(pk):
+    return HealthLog.objects.filter(pk=pk).values(*SNAPSHOT_FIELDS).first()
+
+
+def _add(row, snap, sign):
+    row.log_count += sign
+    row.sleep_sum += sign * snap['sleep_hours']
+    row.score_sum += sign * snap['health_score']
+    if snap['log_type'] == 'EXERCISE':
+        row.workout_count += sign
+
+
+def _set_latest(row, snap):
+    row.latest_date = snap['date'] if snap else None
+    row.latest_log_id = snap['id'] if snap else None
+    row.latest_suggestion = snap['suggestion'] if snap else None
+
+
+def _find_latest(user_id, span):
+    logs = HealthLog.objects.filter(user_id=user_id)
+    if span:
+        logs = logs.filter(date__gte=span[0], date__lt=span[1])
+    latest = logs.order_by('-date', '-id').values(*SNAPSHOT_FIELDS).first()
+    if latest is None and not span:
+        # Every remaining log is archived
+        month = ArchivedMonth.objects.filter(user_id=user_id).order_by('-month').values_list(
+            'latest_log_id', 'latest_date', 'latest_suggestion'
+        ).first()
+        if month:
+            latest = dict(zip(('id', 'date', 'suggestion'), month))
+    return latest
+
+
+def _locked_rows(snap):
+    # The all-time summary plus one row per bucket, locked for the rest of the transaction
+    summary, _ = UserSummary.objects.select_for_update().get_or_create(user_id=snap['user_id'])
+    yield summary, None
+    for period, (start_of, length) in BUCKETS.items():
+        start = start_of(snap['date'])
+        row, _ = HealthRollup.objects.select_for_update().get_or_create(
+            user_id=snap['user_id'], period=period, bucket_start=start
+        )
+        yield row, (start, start + timedelta(days=length))
+
+
+def apply(snap, sign):
+    """Add (sign=+1) or remove (sign=-1) one log from its user's rollups.
+
+    Must run inside the same transaction as the HealthLog write.
+    """
+    for row, span in _locked_rows(snap):
+        _add(row, snap, sign)
+
+        if sign > 0:
+            if row.latest_date is None or (snap['date'], snap['id']) >= (row.latest_date, row.latest_log_id):
+                _set_latest(row, snap)
+        elif row.latest_log_id == snap['id']:
+            # The latest log went away (or is being replaced): look up the next one
+            _set_latest(row, _find_latest(snap['user_id'], span))
+
+        if span and row.log_count <= 0:
+            row.delete()
+        else:
+            row.save()
+
+
+def _archived_summaries(user_ids):
+    # UserSummary totals of each user's archived months; one small row per user
+    months = ArchivedMonth.objects.order_by('user_id', 'month')
+    if user_ids is not None:
+        months = months.filter(user_id__in=user_ids)
+    summaries = {}
+    for month in months.iterator(chunk_size=2000):
+        summary = summaries.setdefault(month.user_id, UserSummary(user_id=month.user_id))
+        for field in ('log_count', 'sleep_sum', 'score_sum', 'workout_count'):
+            setattr(summary, field, getattr(summary, field) + getattr(month, field))
+        _set_latest(summary, {'date': month.latest_date, 'id': month.latest_log_id,
+                              'suggestion': month.latest_suggestion})
+    return summaries
+
+
+def compute(user_ids=None, since=None, until=None):
+    """Recompute rollups straight from HealthLog (plus archived months for the summary).
+
+    Streams the table ordered by user and yields (user_id, rows) one user at a
+    time, where rows maps None -> UserSummary and (period, start) -> HealthRollup.
+    since/until limit the logs read to a date range; the summary is then partial.
+    """
+    logs = HealthLog.objects.order_by('user_id', 'date', 'id')
+    if user_ids is not None:
+        logs = logs.filter(user_id__in=user_ids)
+    if since is not None:
+        logs = logs.filter(date__gte=since)
+    if until is not None:
+        logs = logs.filter(date__lt=until)
+    archived = _archived_summaries(user_ids) if since is None and until is None else {}
+
+    current, rows = None, None
+    for snap in logs.values(*SNAPSHOT_FIELDS).iterator(chunk_size=2000):
+        if snap['user_id'] != current:
+            if current is not None:
+                yield current, rows
+            current = snap['user_id']
+            rows = {None: archived.pop(current, None) or UserSummary(user_id=current)}
+
+        targets = [rows[None]]
+        for period, (start_of, _) in BUCKETS.items():
+            key = (period, start_of(snap['date']))
+            if key not in rows:
+                rows[key] = HealthRollup(user_id=current, period=period, bucket_start=key[1])
+            targets.append(rows[key])
+
+        for row in targets:
+            _add(row, snap, +1)
+            # Logs arrive in (date, id) order, so each one is the latest so far
+            # (only archived months can hold a later one, until they are archived too)
+            if row.latest_date is None or (snap['date'], snap['id']) >= (row.latest_date, row.latest_log_id):
+                _set_latest(row, snap)
+
+    if current is not None:
+        yield current, rows
+    # Users with nothing left but archived months
+    for user_id, summary in archived.items():
+        yield user_id, {None: summary}
+
+
+def _scoped(model, user_ids):
+    rows = model.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    return rows
+
+
+def rebuild(user_ids=None):
+    # Replace each user's rollups atomically, so the dashboard never sees a half-built state
+    count = 0
+    for user_id, rows in compute(user_ids):
+        with transaction.atomic():
+            HealthRollup.objects.filter(user_id=user_id).delete()
+            UserSummary.objects.filter(user_id=user_id).delete()
+            rows[None].save()
+            HealthRollup.objects.bulk_create([row for key, row in rows.items() if key is not None])
+            rolling.rebuild(user_id)
+        count += 1
+
+    # Users whose logs are all gone
+    _scoped(HealthRollup, user_ids).exclude(user_id__in=HealthLog.objects.values('user_id')).delete()
+    _scoped(RollingState, user_ids).exclude(user_id__in=HealthLog.objects.values('user_id')).delete()
+    _scoped(UserSummary, user_ids).exclude(user_id__in=HealthLog.objects.values('user_id')).exclude(
+        user_id__in=ArchivedMonth.objects.values('user_id')
+    ).delete()
+
+    # Bulk writes (imports, rescoring) skip the model signals, so move the cached pages on here
+    UserProfile.touch(user_ids)
+    return count
+
+
+def rebuild_buckets(user_id, start, end):
+    """Recompute the user's DAY and WEEK rollups that overlap [start, end) from HealthLog.
+
+    For logs that left the table without going through delete() (archiving);
+    the summary is left alone.
+    """
+    first = week_start(start)
+    until = week_start(end - timedelta(days=1)) + timedelta(days=7)
+    with transaction.atomic():
+        HealthRollup.objects.filter(user_id=user_id, bucket_start__gte=first, bucket_start__lt=until).delete()
+        for _, rows in compute([user_id], since=first, until=until):
+            HealthRollup.objects.bulk_create([row for key, row in rows.items() if key is not None])
+
+
+COMPARED_FIELDS = ('log_count', 'score_sum', 'workout_count', 'latest_date', 'latest_log_id', 'latest_suggestion')
+
+
+def _diff(label, stored, expected):
+    if stored is None:
+        return [f"{label}: missing"]
+    problems = [
+        f"{label}: {field} is {getattr(stored, field)!r}, expected {getattr(expected, field)!r}"
+        for field in COMPARED_FIELDS
+        if getattr(stored, field) != getattr(expected, field)
+    ]
+    if abs(stored.sleep_sum - expected.sleep_sum) > 1e-6:
+        problems.append(f"{label}: sleep_sum is {stored.sleep_sum}, expected {expected.sleep_sum}")
+    return problems
+
+
+def verify(user_ids=None):
+    """Compare stored rollups against a fresh computation. Returns a list of problems."""
+    problems = []
+    for user_id, rows in compute(user_ids):
+        summary = UserSummary.objects.filter(user_id=user_id).first()
+        problems += _diff(f"user {user_id} summary", summary, rows[None])
+
+        stored = {(r.period, r.bucket_start): r for r in HealthRollup.objects.filter(user_id=user_id)}
+        for key, expected in rows.items():
+            if key is not None:
+                problems += _diff(f"user {user_id} {key[0]} {key[1]}", stored.pop(key, None), expected)
+        for key in stored:
+            problems.append(f"user {user_id} {key[0]} {key[1]}: unexpected bucket")
+        problems += rolling.verify(user_id)
+
+    orphans = _scoped(UserSummary, user_ids).exclude(user_id__in=HealthLog.objects.values('user_id')).exclude(
+        user_id__in=ArchivedMonth.objects.values('user_id')
+    )
+    for summary in orphans.exclude(log_count=0):
+        problems.append(f"user {summary.user_id} summary: has no logs but log_count is {summary.log_count}")
+    orphans = _scoped(HealthRollup, user_ids).exclude(user_id__in=HealthLog.objects.values('user_id'))
+    for rollup in orphans:
+        problems.append(f"user {rollup.user_id} {rollup.period} {rollup.bucket_start}: unexpected bucket")
+    orphans = _scoped(RollingState, user_ids).exclude(user_id__in=HealthLog.objects.values('user_id'))
+    for state in orphans:
+        problems.append(f"user {state.user_id} rolling state: has no logs")
+    return problems
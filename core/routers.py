@@ -0,0 +1,119 @@
+import contextvars
+import logging
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+# Read replicas for read-only page views. ReplicaMiddleware marks safe (GET/HEAD)
+# requests as allowed to read from a replica; everything else -- writes, POST
+# handling, management commands and the report worker -- uses the primary.
+# After a successful POST the browser carries a short-lived cookie that keeps
+# the user on the primary, so they see their own new log even while the
+# replicas are behind. A replica that cannot be connected to is skipped for
+# DATABASE_REPLICA_RETRY seconds.
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'db_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class _Reads:
+    # One replica per request, picked on the first read, so a page sees a single snapshot
+    alias = None
+
+
+_reads = contextvars.ContextVar('replica_reads', default=None)
+_down = {}  # alias -> time.monotonic() until which it is skipped
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def _usable(alias):
+    if _down.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError as e:
+        _down[alias] = time.monotonic() + getattr(settings, 'DATABASE_REPLICA_RETRY', 30)
+        logger.warning("Replica %s is unavailable, reading from the primary: %s", alias, e)
+        return False
+    return True
+
+
+def pick_replica():
+    """A reachable replica alias, or the primary when none is."""
+    candidates = list(replicas())
+    random.shuffle(candidates)
+    return next((alias for alias in candidates if _usable(alias)), DEFAULT_DB_ALIAS)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        reads = _reads.get()
+        if reads is None or not replicas() or model._meta.app_label not in getattr(
+            settings, 'DATABASE_REPLICA_APPS', ('core', 'auth')
+        ):
+            return None
+        if reads.alias is None:
+            reads.alias = pick_replica()
+        return reads.alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        aliases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """Lets safe requests read from a replica, and pins a user to the primary after they write."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _reads_for(self, request):
+        safe = request.method in SAFE_METHODS
+        return _Reads() if safe and PIN_COOKIE not in request.COOKIES else None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _reads.set(self._reads_for(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _reads.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        # The ORM's worker threads run in a copy of this context, so they see the same _Reads
+        token = _reads.set(self._reads_for(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _reads.reset(token)
+        return self.pin(request, response)
+
+    def pin(self, request, response):
+        safe = request.method in SAFE_METHODS
+        if not safe and response.status_code < 400 and replicas():
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 10),
+                httponly=True, samesite='Lax',
+            )
+        return response
@@ -0,0 +1,102 @@
+from collections import defaultdict
+
+from django.db import models, transaction
+from django.db.models import Case, Q, Value, When
+from django.db.models.functions import Concat, Greatest, Least, RTrim
+
+from . import rollups
+from .models import HealthLog, UserProfile
+
+DEFAULT_SUGGESTION = "Good routine. Keep it up!"
+
+
+def rules(bmi_status):
+    """The HealthLog.calculate_metrics rules as (condition, points, tip) for one BMI status.
+
+    Conditions are Q objects over HealthLog columns, so a whole table can be
+    scored with a single UPDATE. The branches in calculate_metrics never
+    overlap, so every rule can be applied independently. Keep this in sync
+    with calculate_metrics -- ScoringParityTests checks them against each other.
+    """
+    heavy = bmi_status in ["Overweight", "Obese"]
+    exercise = Q(log_type='EXERCISE')
+    food = Q(log_type='FOOD')
+
+    active = [
+        # Sleep
+        (Q(sleep_hours__gte=7, sleep_hours__lte=9), 20, None),
+        (Q(sleep_hours__lt=5), -10, "Your sleep is very low. Prioritize rest."),
+        # Water
+        (Q(water_intake__gte=8), 15, None),
+        (~Q(water_intake__gte=8), 0, "Drink more water (Target: 8 glasses)."),
+        # Exercise
+        (exercise & Q(calories_burned__gt=1200), 15, "Great workout!"),
+        (exercise & Q(calories_burned__gt=1300), 10, "Excellent effort towards weight management!") if heavy else None,
+        # Diet
+        (food & Q(protein__gt=70), 10, None),
+    ]
+    if heavy:
+        active.append((food & Q(calories_intake__gt=2200), -10,
+                       f"Calorie intake is high for your BMI status ({bmi_status})."))
+    elif bmi_status == "Underweight":
+        active.append((food & Q(calories_intake__lt=1500), -10, "You need more calories to reach a healthy weight."))
+    return [rule for rule in active if rule]
+
+
+def score_expressions(bmi_status):
+    # Column expressions for health_score and suggestion
+    active = rules(bmi_status)
+
+    score = Value(50)
+    for condition, points, _ in active:
+        if points:
+            score = score + Case(When(condition, then=Value(points)), default=Value(0))
+    score = Least(Value(100), Greatest(Value(0), score), output_field=models.IntegerField())
+
+    tips = [(condition, tip) for condition, _, tip in active if tip]
+    # Each tip carries a trailing space; RTrim drops the last one, like " ".join
+    joined = Concat(*[
+        Case(When(condition, then=Value(tip + " ")), default=Value(""), output_field=models.TextField())
+        for condition, tip in tips
+    ], output_field=models.TextField())
+    any_tip = Q()
+    for condition, _ in tips:
+        any_tip |= condition
+    suggestion = Case(When(any_tip, then=RTrim(joined)), default=Value(DEFAULT_SUGGESTION),
+                      output_field=models.TextField())
+    return {'health_score': score, 'suggestion': suggestion}
+
+
+def _update(logs, bmi_status):
+    return logs.update(**score_expressions(bmi_status))
+
+
+def rescore(user_ids=None, chunk_size=500):
+    """Recompute health_score and suggestion for every log of the given users (default: everyone).
+
+    Users are grouped by BMI status and each group is rescored with one
+    UPDATE per chunk of users, so rows never travel through Python.
+    Returns the number of logs updated.
+    """
+    profiles = UserProfile.objects.values_list('user_id', 'bmi_status').order_by()
+    if user_ids is not None:
+        profiles = profiles.filter(user_id__in=user_ids)
+
+    updated = 0
+    with transaction.atomic():
+        groups = defaultdict(list)
+        for user_id, status in profiles.iterator(chunk_size=5000):
+            groups[status].append(user_id)
+            if len(groups[status]) >= chunk_size:
+                updated += _update(HealthLog.objects.filter(user_id__in=groups.pop(status)), status)
+        for status, ids in groups.items():
+            updated += _update(HealthLog.objects.filter(user_id__in=ids), status)
+
+        # calculate_metrics treats users without a profile as "Normal"
+        orphans = HealthLog.objects.exclude(user_id__in=UserProfile.objects.values('user_id'))
+        if user_ids is not None:
+            orphans = orphans.filter(user_id__in=user_ids)
+        updated += _update(orphans, "Normal")
+
+        rollups.rebuild(user_ids)
+    return updated
@@ -0,0 +1,86 @@
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from . import rollups
+from .models import HealthLog, UserProfile
+
+EXERCISES = ['Running', 'Gym', 'Sport', 'Yoga']
+
+
+def random_profile(rng, user):
+    height = round(rng.gauss(170, 10), 1)
+    # Spread users across all BMI classes
+    bmi = rng.choice([17.5, 22, 22, 27, 32]) + rng.uniform(-1, 1)
+    profile = UserProfile(
+        user=user,
+        age=rng.randint(18, 75),
+        height=height,
+        weight=round(bmi * (height / 100) ** 2, 1),
+    )
+    profile.update_bmi()  # bulk_create skips save()
+    return profile
+
+
+def random_log(rng, user, day):
+    log = HealthLog(
+        user=user,
+        date=day,
+        log_type=rng.choice(['EXERCISE', 'FOOD']),
+        sleep_hours=round(min(11, max(3, rng.gauss(7, 1.3))), 1),
+        water_intake=float(rng.randint(3, 12)),
+    )
+    if log.log_type == 'EXERCISE':
+        log.exercise_type = rng.choice(EXERCISES)
+        log.calories_burned = rng.randint(150, 1800)
+    else:
+        log.calories_intake = rng.randint(1200, 3200)
+        log.protein = round(rng.uniform(30, 150), 1)
+        log.carbs = round(rng.uniform(100, 350), 1)
+        log.fats = round(rng.uniform(30, 120), 1)
+    log.calculate_metrics()
+    return log
+
+
+def generate(users, logs_per_user, days=365, seed=None, prefix='synthetic', password='synthetic-pass', batch_size=1000):
+    """Create `users` users, each with a profile and `logs_per_user` logs spread over the last `days` days.
+
+    Everything is written with bulk_create, so rollups are rebuilt at the end.
+    Returns the list of created users.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    # Hashing is slow, so every synthetic user shares one hash
+    password_hash = make_password(password)
+
+    start = User.objects.filter(username__startswith=f"{prefix}_").count()
+    created = []
+    for offset in range(0, users, batch_size):
+        batch = [
+            User(username=f"{prefix}_{start + i}", email=f"{prefix}_{start + i}@example.com",
+                 first_name=f"User{start + i}", password=password_hash)
+            for i in range(offset, min(users, offset + batch_size))
+        ]
+        User.objects.bulk_create(batch)
+        # bulk_create doesn't return ids on every backend, so read them back
+        batch = list(User.objects.filter(username__in=[u.username for u in batch]).order_by('id'))
+
+        # post_save doesn't fire for bulk_create, so profiles are created here
+        profiles = [random_profile(rng, user) for user in batch]
+        UserProfile.objects.bulk_create(profiles)
+
+        logs = []
+        for user, profile in zip(batch, profiles):
+            user.userprofile = profile  # lets calculate_metrics skip the profile query
+            for _ in range(logs_per_user):
+                logs.append(random_log(rng, user, today - timedelta(days=rng.randrange(days))))
+            if len(logs) >= batch_size:
+                HealthLog.objects.bulk_create(logs, batch_size=batch_size)
+                logs = []
+        HealthLog.objects.bulk_create(logs, batch_size=batch_size)
+
+        rollups.rebuild([user.id for user in batch])
+        created += batch
+    return created
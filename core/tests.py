@@ -1,3 +1,1549 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import importlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import (
+    ai_cache, ai_stream, archive, benchmarks, coach_batch, coach_prompt, foods, fragments, history, importer, llm,
+    metrics, percentiles, reports, rolling, rollups, routers, scoring, synthetic, trends,
+)
+from .fake_llm import FakeLLMServer
+from .models import (
+    ArchivedMonth, CoachSummary, Food, HealthLog, HealthRollup, ReportJob, ScoreDistribution, UserProfile, UserSummary,
+    WorkerHeartbeat,
+)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw-12345')
+
+    def add(self, **fields):
+        fields.setdefault('log_type', 'FOOD')
+        return HealthLog.objects.create(user=self.user, **fields)
+
+    def test_rollups_follow_add_edit_delete(self):
+        first = self.add(sleep_hours=8, water_intake=9)
+        second = self.add(log_type='EXERCISE', sleep_hours=4, calories_burned=1500)
+
+        summary = UserSummary.objects.get(user=self.user)
+        self.assertEqual(summary.log_count, 2)
+        self.assertEqual(summary.workout_count, 1)
+        self.assertEqual(summary.score_sum, first.health_score + second.health_score)
+        self.assertEqual(summary.latest_log_id, second.id)
+        self.assertEqual(HealthRollup.objects.filter(user=self.user, period='DAY').get().log_count, 2)
+
+        edited = HealthLog.objects.get(pk=second.pk)
+        edited.sleep_hours = 8
+        edited.save()
+        summary.refresh_from_db()
+        self.assertEqual(summary.sleep_sum, 16)
+        self.assertEqual(summary.latest_suggestion, edited.suggestion)
+
+        HealthLog.objects.get(pk=second.pk).delete()
+        summary.refresh_from_db()
+        self.assertEqual(summary.log_count, 1)
+        self.assertEqual(summary.workout_count, 0)
+        self.assertEqual(summary.latest_log_id, first.id)
+        self.assertEqual(rollups.verify(), [])
+
+    def test_rebuild_repairs_drift(self):
+        self.add(sleep_hours=8)
+        self.add(sleep_hours=6)
+        UserSummary.objects.filter(user=self.user).update(log_count=99)
+        HealthRollup.objects.filter(user=self.user).delete()
+        self.assertNotEqual(rollups.verify(), [])
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(rollups.verify(), [])
+        self.assertEqual(UserSummary.objects.get(user=self.user).log_count, 2)
+
+    def test_migration_builds_rollups_for_existing_logs(self):
+        from django.apps import apps
+        backfill = importlib.import_module('core.migrations.0018_backfill_rollups').backfill
+
+        # Logs from before the rollups existed, plus one counted from zero by the first write after
+        day = datetime.date(2024, 3, 4)
+        HealthLog.objects.bulk_create([
+            HealthLog(user=self.user, log_type=log_type, date=day + datetime.timedelta(days=n), sleep_hours=n,
+                      health_score=50 + n)
+            for n in range(10) for log_type in ('FOOD', 'EXERCISE')
+        ])
+        self.add(sleep_hours=8, date=day)
+        self.assertEqual(UserSummary.objects.get(user=self.user).log_count, 1)
+
+        backfill(apps, None)
+        summary = UserSummary.objects.get(user=self.user)
+        self.assertEqual(summary.log_count, 21)
+        self.assertEqual(summary.workout_count, 10)
+        self.assertEqual(HealthRollup.objects.filter(user=self.user, period='WEEK').count(), 2)
+        # RollingState is left to core/rolling.py
+        self.assertEqual([p for p in rollups.verify() if 'rolling state' not in p], [])
+
+    def test_dashboard_reads_summary(self):
+        self.add(sleep_hours=8, water_intake=9)
+        self.add(log_type='EXERCISE', sleep_hours=6, calories_burned=1500)
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['avg_sleep'], 7.0)
+        self.assertEqual(response.context['total_workouts'], 1)
+
+
+class QueryBudgetTests(TestCase):
+    # Query counts for the heavy views must stay within budget and must not grow with history
+    def setUp(self):
+        reports.heartbeat()  # PDFs are queued for a worker, as in production
+
+    def query_count(self, user, name):
+        self.client.force_login(user)
+        with benchmarks.stub_llm(), CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return len(captured)
+
+    def test_heavy_views_have_flat_query_counts(self):
+        small = synthetic.generate(1, 3, seed=1, prefix='small')[0]
+        large = synthetic.generate(1, 60, seed=1, prefix='large')[0]
+        for name in ('dashboard', 'download_pdf', 'ai_coach'):
+            with self.subTest(view=name):
+                count = self.query_count(small, name)
+                self.assertLessEqual(count, benchmarks.BUDGETS[name][0])
+                self.assertEqual(self.query_count(large, name), count)
+
+    def test_every_view_stays_within_query_budget(self):
+        results = benchmarks.run([5], iterations=1)
+        self.assertEqual([r['violations'] for r in results if r['queries'] > r['budget_queries']], [])
+
+
+class ImportTests(TestCase):
+    CSV = (
+        "date,log_type,sleep_hours,water_intake,exercise_type,calories_burned,calories_intake,protein,carbs,fats\n"
+        "2023-01-02,EXERCISE,8,9,Running,1500,0,0,0,0\n"
+        "2023-01-03,FOOD,6,4,,0,2400,80,200,70\n"
+        "2023-01-04,SWIMMING,6,4,,0,0,0,0,0\n"
+        "not-a-date,FOOD,,4,,0,0,0,0,0\n"
+    )
+
+    def setUp(self):
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'pw-12345')
+
+    def test_csv_import_is_idempotent(self):
+        result = importer.import_logs(self.user, BytesIO(self.CSV.encode()), 'csv', batch_size=2)
+        self.assertEqual((result.rows, result.created, result.error_count), (4, 2, 2))
+        self.assertEqual([line for line, _ in result.errors], [4, 5])
+
+        log = HealthLog.objects.get(user=self.user, date='2023-01-02')
+        self.assertEqual(log.health_score, 100)
+        self.assertEqual(UserSummary.objects.get(user=self.user).log_count, 2)
+
+        again = importer.import_logs(self.user, BytesIO(self.CSV.encode()), 'csv')
+        self.assertEqual((again.created, again.skipped), (0, 2))
+        self.assertEqual(HealthLog.objects.filter(user=self.user).count(), 2)
+
+    def test_identical_rows_in_one_file_are_all_imported(self):
+        day = "2023-01-03,FOOD,6,4,,0,2400,80,200,70\n"
+        data = (self.CSV.splitlines(keepends=True)[0] + day * 2).encode()
+        result = importer.import_logs(self.user, BytesIO(data), 'csv', batch_size=1)
+        self.assertEqual((result.created, result.skipped), (2, 0))
+
+        again = importer.import_logs(self.user, BytesIO(data + day.encode()), 'csv')
+        self.assertEqual((again.created, again.skipped), (1, 2))
+        self.assertEqual(HealthLog.objects.filter(user=self.user).count(), 3)
+
+    def test_ndjson_upload(self):
+        body = b'{"external_id": 7, "date": "2022-05-01", "log_type": "FOOD", "sleep_hours": 7.5, "water_intake": 8}\n'
+        upload = BytesIO(body)
+        upload.name = 'history.ndjson'
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('import_logs'), {'file': upload})
+        self.assertEqual(response.context['result'].created, 1)
+        self.assertEqual(HealthLog.objects.get(user=self.user).sleep_hours, 7.5)
+
+    def test_bytes_that_are_not_utf8_are_row_errors(self):
+        upload = BytesIO(b'log_type,sleep_hours\n\xff\xfeFOOD,7\nFOOD,8\n')
+        upload.name = 'latin1.csv'
+        self.client.force_login(self.user)
+
+        response = self.client.post(reverse('import_logs'), {'file': upload})
+        result = response.context['result']
+        self.assertEqual((result.rows, result.created, result.error_count), (2, 1, 1))
+        self.assertEqual(result.errors[0][0], 2)
+        self.assertIn("UTF-8", result.errors[0][1])
+
+        result = importer.import_logs(self.user, BytesIO(b'{"log_type": "FOOD"}\n{"log_type": "\xe9"}\n'), 'ndjson')
+        self.assertEqual((result.created, result.error_count), (1, 1))
+        self.assertEqual(result.errors[0][0], 2)
+
+        result = importer.import_logs(self.user, BytesIO(b'log_type,sleep_hours\nFOOD,\x00\n'), 'csv')
+        self.assertEqual(result.error_count, 1)
+
+
+class ScoringParityTests(TestCase):
+    def test_batch_rescore_matches_calculate_metrics(self):
+        users = synthetic.generate(12, 40, seed=4, prefix='parity')
+        # Boundary values for every threshold in calculate_metrics
+        for user in users[:4]:
+            for sleep, water, burned, intake, protein in [(7, 8, 1200, 2200, 70), (9, 7.9, 1300, 1500, 70.1),
+                                                          (4.9, 8, 1301, 2201, 0), (5, 0, 0, 1499, 100)]:
+                for log_type in ('EXERCISE', 'FOOD'):
+                    HealthLog.objects.create(user=user, log_type=log_type, sleep_hours=sleep, water_intake=water,
+                                             calories_burned=burned, calories_intake=intake, protein=protein)
+
+        expected = {}
+        for log in HealthLog.objects.select_related('user__userprofile'):
+            log.calculate_metrics()
+            expected[log.id] = (log.health_score, log.suggestion)
+        HealthLog.objects.update(health_score=-1, suggestion='')
+
+        self.assertEqual(scoring.rescore(), len(expected))
+        actual = {log_id: (score, tip) for log_id, score, tip in
+                  HealthLog.objects.values_list('id', 'health_score', 'suggestion')}
+        self.assertEqual(actual, expected)
+        self.assertEqual(rollups.verify(), [])
+
+    def test_profile_change_rescores_history(self):
+        user = User.objects.create_user('carol', 'carol@example.com', 'pw-12345')
+        log = HealthLog.objects.create(user=user, log_type='FOOD', calories_intake=2500, water_intake=8)
+        self.assertNotIn("BMI status", log.suggestion)
+
+        profile = UserProfile.objects.get(user=user)
+        profile.weight = 100
+        profile.save()
+        log.refresh_from_db()
+        self.assertIn("BMI status (Obese)", log.suggestion)
+
+
+class AICacheTests(TestCase):
+    def setUp(self):
+        ai_cache.get_cache().clear()
+        llm.reset()
+        self.user = User.objects.create_user('dave', 'dave@example.com', 'pw-12345')
+        HealthLog.objects.create(user=self.user, log_type='FOOD', sleep_hours=8)
+        self.client.force_login(self.user)
+
+    def test_reload_is_served_from_cache_until_data_changes(self):
+        with mock.patch('core.llm.acomplete', return_value="<p>Coach</p>") as ask:
+            self.client.get(reverse('ai_coach'))
+            response = self.client.get(reverse('ai_coach'))
+            self.assertEqual(ask.call_count, 1)
+            self.assertEqual(response.context['ai_response'], "<p>Coach</p>")
+
+            HealthLog.objects.create(user=self.user, log_type='FOOD', sleep_hours=6)
+            self.client.get(reverse('ai_coach'))
+            self.assertEqual(ask.call_count, 2)
+
+    def test_errors_are_not_cached(self):
+        with mock.patch('core.llm.acomplete', side_effect=llm.LLMUnavailable("down")):
+            response = self.client.get(reverse('ai_coach'))
+        self.assertIn("Average health score", response.context['ai_response'])
+        with mock.patch('core.llm.acomplete', return_value="<p>Back</p>"):
+            response = self.client.get(reverse('ai_coach'))
+        self.assertEqual(response.context['ai_response'], "<p>Back</p>")
+
+    def test_concurrent_misses_share_one_call(self):
+        calls = []
+
+        def slow_compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return "answer"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            ai_cache.get_or_compute(self.user.id, ["same prompt"], slow_compute))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ["answer"] * 5)
+
+    def test_only_the_owner_releases_the_lock(self):
+        cache = ai_cache.get_cache()
+        lock_key = ai_cache.make_key("slow prompt") + ":lock"
+        cache.add(lock_key, "another process", 60)  # still computing elsewhere
+
+        with mock.patch.object(ai_cache, 'LOCK_TIMEOUT', 0.3):
+            value = ai_cache.get_or_compute(self.user.id, ["slow prompt"], lambda: "gave up waiting")
+        self.assertEqual(value, "gave up waiting")
+        self.assertEqual(cache.get(lock_key), "another process")
+
+        ai_cache.get_or_compute(self.user.id, ["fresh prompt"], lambda: "answer")
+        self.assertIsNone(cache.get(ai_cache.make_key("fresh prompt") + ":lock"))
+
+
+class AIStreamTests(TestCase):
+    def setUp(self):
+        ai_cache.get_cache().clear()
+        llm.reset()
+        self.user = User.objects.create_user('erin', 'erin@example.com', 'pw-12345')
+        HealthLog.objects.create(user=self.user, log_type='FOOD', sleep_hours=8)
+        self.client.force_login(self.user)
+        self.cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+    def stream(self, disconnect_after=None):
+        # Drive the ASGI app directly; returns the response body events
+        sent = []
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if disconnect_after and sum(b'event: token' in m.get('body', b'') for m in sent) >= disconnect_after:
+                disconnected.set()
+
+        scope = {'type': 'http', 'method': 'GET', 'path': ai_stream.STREAM_PATH,
+                 'headers': [(b'cookie', self.cookie.encode())]}
+        async_to_sync(ai_stream.application)(scope, receive, send)
+        return sent
+
+    def test_tokens_stream_and_are_cached(self):
+        with FakeLLMServer(reply="<p>Sleep more, drink water.</p>") as server, \
+                override_settings(GROQ_BASE_URL=server.url):
+            sent = self.stream()
+        body = b"".join(m.get('body', b'') for m in sent)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(body.count(b"event: token"), 4)
+        self.assertIn(b"event: done", body)
+        self.assertEqual(len(server.requests), 1)
+        self.assertTrue(server.requests[0]['body']['stream'])
+
+        # The finished answer is cached for the next page load
+        with override_settings(AI_STREAMING=True):
+            response = self.client.get(reverse('ai_coach'))
+        self.assertEqual(response.context['ai_response'], "<p>Sleep more, drink water.</p>")
+
+    def test_client_disconnect_stops_streaming(self):
+        reply = " ".join(f"word{i}" for i in range(200))
+        with FakeLLMServer(reply=reply, token_delay=0.01) as server, override_settings(GROQ_BASE_URL=server.url):
+            sent = self.stream(disconnect_after=2)
+            # The upstream connection is dropped instead of being read to the end
+            for _ in range(100):
+                if server.disconnects:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(server.disconnects, 1)
+        body = b"".join(m.get('body', b'') for m in sent)
+        self.assertLess(body.count(b"event: token"), 10)
+        self.assertNotIn(b"event: done", body)
+
+    def test_requires_login(self):
+        self.cookie = ""
+        sent = self.stream()
+        self.assertEqual(sent[0]['status'], 403)
+
+    def test_page_defers_to_stream(self):
+        with override_settings(AI_STREAMING=True):
+            response = self.client.get(reverse('ai_coach'))
+        self.assertEqual(response.context['stream_url'], ai_stream.STREAM_PATH)
+
+
+@override_settings(LLM_BACKOFF_BASE=0.01, LLM_MAX_RETRIES=2)
+class LLMClientTests(TestCase):
+    def setUp(self):
+        llm.reset()
+
+    def test_transient_failures_are_retried(self):
+        with FakeLLMServer(reply="ok", fail_every=2) as server, override_settings(GROQ_BASE_URL=server.url):
+            self.assertEqual(llm.complete("hi"), "ok")
+            # The second request fails with a 500 and the retry succeeds
+            before = llm.metrics()['retries']
+            self.assertEqual(llm.complete("hi"), "ok")
+            self.assertEqual(llm.metrics()['retries'], before + 1)
+            self.assertEqual(len(server.requests), 3)
+            self.assertIs(llm.get_client(), llm.get_client())
+
+    def test_no_api_key_means_unavailable(self):
+        with FakeLLMServer(reply="ok") as server, override_settings(GROQ_BASE_URL=server.url, GROQ_API_KEY=None):
+            with self.assertRaisesMessage(llm.LLMUnavailable, "GROQ_API_KEY is not set"):
+                llm.complete("hi")
+            self.assertEqual(server.requests, [])
+
+    def test_breaker_opens_and_serves_fallback(self):
+        breaker = llm.get_provider('groq').breaker
+        with FakeLLMServer(fail_every=1) as server, override_settings(GROQ_BASE_URL=server.url):
+            for _ in range(breaker.threshold):
+                with self.assertRaises(llm.LLMUnavailable):
+                    llm.complete("hi")
+            calls = len(server.requests)
+            self.assertEqual(breaker.state, 'open')
+
+            # Once open, nothing reaches the provider
+            with self.assertRaises(llm.LLMUnavailable):
+                llm.complete("hi")
+            self.assertEqual(len(server.requests), calls)
+            self.assertEqual(calls, breaker.threshold * 3)
+
+    def test_concurrency_cap(self):
+        with mock.patch.object(llm, '_slots', threading.BoundedSemaphore(1)):
+            with llm.slot(1):
+                with self.assertRaises(llm.LLMUnavailable):
+                    llm.complete("hi", deadline=0.05)
+
+
+def stubs(**providers):
+    # LLM_PROVIDERS of stub providers, e.g. stubs(fast={'LATENCY': 0.01})
+    return {name: {'BACKEND': 'core.llm.StubProvider', 'REPLY': f"<p>{name}</p>", **options}
+            for name, options in providers.items()}
+
+
+@override_settings(LLM_MAX_RETRIES=0, LLM_HEDGE_DELAY=0.05)
+class LLMProviderTests(TestCase):
+    def setUp(self):
+        llm.reset()
+
+    def test_failed_provider_hands_over_to_the_next(self):
+        with override_settings(LLM_PROVIDERS=stubs(bad={'FAIL_EVERY': 1}, good={}), LLM_ROUTE=['bad', 'good']):
+            before = llm.metrics()['failovers']
+            self.assertEqual(llm.complete("hi"), "<p>good</p>")
+            self.assertEqual(llm.metrics()['failovers'], before + 1)
+            self.assertEqual(async_to_sync(llm.acomplete)("hi"), "<p>good</p>")
+
+    def test_slow_provider_is_hedged(self):
+        with override_settings(LLM_PROVIDERS=stubs(slow={'LATENCY': 1.0}, fast={'LATENCY': 0.01}),
+                               LLM_ROUTE=['slow', 'fast']):
+            before = llm.metrics()['hedge_wins']
+            started = time.monotonic()
+            self.assertEqual(llm.complete("hi"), "<p>fast</p>")
+            self.assertLess(time.monotonic() - started, 0.5)
+            self.assertEqual(async_to_sync(llm.acomplete)("hi"), "<p>fast</p>")
+
+            async def collect():
+                return "".join([token async for token in llm.stream("hi")])
+
+            llm.reset()
+            self.assertEqual(async_to_sync(collect)(), "<p>fast</p>")
+            self.assertEqual(llm.metrics()['hedge_wins'], before + 3)
+
+            # Without hedging the first provider's answer is awaited
+            llm.reset()
+            with override_settings(LLM_HEDGE=False):
+                self.assertEqual(llm.complete("hi"), "<p>slow</p>")
+
+    def test_losing_call_keeps_its_slot_until_it_ends(self):
+        slots = threading.BoundedSemaphore(2)
+        with override_settings(LLM_PROVIDERS=stubs(slow={'LATENCY': 0.5}, fast={'LATENCY': 0.01}),
+                               LLM_ROUTE=['slow', 'fast']), mock.patch.object(llm, '_slots', slots):
+            self.assertEqual(llm.complete("hi"), "<p>fast</p>")
+            # The slow call is still running upstream, so only the fast call's slot is free again
+            self.assertTrue(slots.acquire(blocking=False))
+            self.assertFalse(slots.acquire(blocking=False))
+            slots.release()
+            time.sleep(0.6)
+            self.assertTrue(slots.acquire(blocking=False) and slots.acquire(blocking=False))
+
+    def test_async_hedge_needs_a_slot_of_its_own(self):
+        with override_settings(LLM_PROVIDERS=stubs(slow={'LATENCY': 0.2}, fast={'LATENCY': 0.01}),
+                               LLM_ROUTE=['slow', 'fast']):
+            with mock.patch.object(llm, '_slots', threading.BoundedSemaphore(1)):
+                # The page's one slot is the primary's, so there's no hedge
+                reply = async_to_sync(llm.acomplete)("hi", wait_for_slot=True)
+                self.assertEqual(reply, "<p>slow</p>")
+            slots = threading.BoundedSemaphore(2)
+            with mock.patch.object(llm, '_slots', slots):
+                reply = async_to_sync(llm.acomplete)("hi", wait_for_slot=True)
+                self.assertEqual(reply, "<p>fast</p>")
+                self.assertTrue(slots.acquire(blocking=False) and slots.acquire(blocking=False))
+
+    def test_traffic_goes_to_the_fastest_healthy_provider(self):
+        with override_settings(LLM_PROVIDERS=stubs(a={'LATENCY': 0.05}, b={'LATENCY': 0.005}),
+                               LLM_ROUTE=['a', 'b'], LLM_HEDGE=False):
+            self.assertEqual([p.name for p in llm.route()], ['a', 'b'])
+            for _ in range(3):
+                llm.complete("hi")
+            self.assertEqual([p.name for p in llm.route()], ['b', 'a'])
+            self.assertEqual(llm.metrics()['providers']['b']['successes'], 2)
+
+            breaker = llm.get_provider('b').breaker
+            for _ in range(breaker.threshold):
+                breaker.record_failure()
+            self.assertEqual([p.name for p in llm.route()], ['a'])
+
+    def test_stub_is_deterministic(self):
+        with override_settings(LLM_PROVIDERS=stubs(stub={'REPLY': "<p>{digest}</p>", 'FAIL_EVERY': 3}),
+                               LLM_ROUTE=['stub'], LLM_BREAKER_THRESHOLD=10):
+            self.assertEqual(llm.complete("a"), llm.complete("a"))
+            with self.assertRaises(llm.LLMUnavailable):
+                llm.complete("a")
+            self.assertNotEqual(llm.complete("a"), llm.complete("b"))
+
+
+class LoadTestTests(TransactionTestCase):
+    def test_coach_under_concurrent_users(self):
+        results = benchmarks.run_load(users=3, requests=2, scenarios=['flaky', 'failover'])
+        flaky, failover = results
+        self.assertEqual(flaky['requests'], 6)
+        self.assertEqual(flaky['fallbacks'], 1)  # every 4th call fails
+        # Either provider may go first (the faster one is preferred), but every request is answered
+        self.assertEqual(failover['fallbacks'], 0)
+        self.assertEqual(sum(failover['answered_by'].values()), 6)
+
+
+class ReportTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = User.objects.create_user('fay', 'fay@example.com', 'pw-12345')
+        self.client.force_login(self.user)
+        HealthLog.objects.create(user=self.user, log_type='FOOD', sleep_hours=8, calories_intake=1800)
+        reports.heartbeat()  # a worker is running
+
+    def drain(self):
+        while (job := reports.claim_next()) is not None:
+            reports.run_job(job)
+
+    def test_report_is_queued_then_served_from_disk(self):
+        response = self.client.get(reverse('download_pdf'))
+        self.assertTemplateUsed(response, 'core/report_status.html')
+        self.assertEqual(self.client.get(reverse('download_pdf'), {'format': 'json'}).status_code, 202)
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.PENDING)
+
+        self.drain()
+        job = ReportJob.objects.get()
+        self.assertEqual(job.status, ReportJob.DONE)
+        self.assertEqual(self.client.get(reverse('download_pdf'), {'format': 'json'}).json()['status'], 'done')
+
+        with mock.patch.object(reports, 'render') as render:
+            response = self.client.get(reverse('download_pdf'))
+        render.assert_not_called()
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+    def test_new_logs_make_a_new_report(self):
+        self.client.get(reverse('download_pdf'))
+        self.drain()
+        old = ReportJob.objects.get()
+
+        HealthLog.objects.create(user=self.user, log_type='EXERCISE', calories_burned=500)
+        self.assertTemplateUsed(self.client.get(reverse('download_pdf')), 'core/report_status.html')
+        self.drain()
+
+        new = ReportJob.objects.get()
+        self.assertNotEqual(new.version, old.version)
+        self.assertFalse(os.path.exists(reports.file_path(old)))
+        self.assertTrue(os.path.exists(reports.file_path(new)))
+
+    def test_failed_jobs_are_retried_on_request(self):
+        self.client.get(reverse('download_pdf'))
+        with mock.patch.object(reports, 'render', side_effect=RuntimeError("boom")):
+            self.drain()
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.FAILED)
+
+        self.client.get(reverse('download_pdf'))
+        self.drain()
+        job = ReportJob.objects.get()
+        self.assertEqual((job.status, job.attempts), (ReportJob.DONE, 2))
+
+    def test_stale_running_jobs_are_taken_over(self):
+        self.client.get(reverse('download_pdf'))
+        job = reports.claim_next()
+        self.assertIsNone(reports.claim_next())
+        with override_settings(REPORT_JOB_TIMEOUT=0):
+            self.assertEqual(reports.claim_next().pk, job.pk)
+
+    def test_running_jobs_survive_a_newer_report(self):
+        self.client.get(reverse('download_pdf'))
+        running = reports.claim_next()  # another worker, still rendering
+        HealthLog.objects.create(user=self.user, log_type='EXERCISE', calories_burned=500)
+        self.client.get(reverse('download_pdf'))
+        reports.run_job(reports.claim_next())
+        self.assertEqual(ReportJob.objects.count(), 2)
+
+        reports.run_job(running)
+        self.assertEqual(ReportJob.objects.get(pk=running.pk).status, ReportJob.DONE)
+
+    def test_worker_survives_a_vanished_job(self):
+        self.client.get(reverse('download_pdf'))
+        real_render = reports.render
+
+        def render_and_delete(user, dest):
+            ReportJob.objects.all().delete()
+            real_render(user, dest)
+
+        with mock.patch.object(reports, 'render', side_effect=render_and_delete), \
+                self.assertLogs('core.reports', 'WARNING'):
+            # One job only: the failed save has spoilt this test's transaction, which a worker doesn't have
+            self.assertEqual(reports.work(once=True, max_jobs=1), 1)
+
+    def test_without_a_worker_the_download_builds_the_report(self):
+        with override_settings(REPORT_WORKER_TIMEOUT=0):
+            response = self.client.get(reverse('download_pdf'))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.DONE)
+
+        WorkerHeartbeat.objects.all().delete()
+        HealthLog.objects.create(user=self.user, log_type='EXERCISE', calories_burned=500)
+        self.assertEqual(self.client.get(reverse('download_pdf'), {'format': 'json'}).json()['status'], 'done')
+
+    def test_workers_record_a_heartbeat(self):
+        WorkerHeartbeat.objects.all().delete()
+        self.assertFalse(reports.worker_alive())
+        reports.work(once=True)
+        self.assertTrue(reports.worker_alive())
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = synthetic.generate(1, 30, days=90, seed=3, prefix='exp')[0]
+        self.client.force_login(self.user)
+
+    def body(self, response):
+        self.assertFalse(hasattr(response, 'content'))  # streamed, never built in memory
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_round_trips_through_import(self):
+        text = self.body(self.client.get(reverse('export_logs')))
+        self.assertEqual(len(text.splitlines()), 31)
+
+        copy = User.objects.create_user('copy', 'copy@example.com', 'pw-12345')
+        result = importer.import_logs(copy, BytesIO(text.encode()), 'csv')
+        self.assertEqual((result.created, result.error_count), (30, 0))
+        fields = ('date', 'log_type', 'sleep_hours', 'calories_intake', 'health_score')
+        self.assertEqual(
+            sorted(HealthLog.objects.filter(user=copy).values_list(*fields)),
+            sorted(HealthLog.objects.filter(user=self.user).values_list(*fields)),
+        )
+        # Importing the same file again adds nothing
+        self.assertEqual(importer.import_logs(copy, BytesIO(text.encode()), 'csv').created, 0)
+
+    def test_ndjson_export(self):
+        response = self.client.get(reverse('export_logs'), {'format': 'ndjson'})
+        rows = [json.loads(line) for line in self.body(response).splitlines()]
+        self.assertEqual(len(rows), 30)
+        self.assertEqual(sorted(r['external_id'] for r in rows),
+                         sorted(HealthLog.objects.filter(user=self.user).values_list('id', flat=True)))
+        self.assertEqual(self.client.get(reverse('export_logs'), {'format': 'xml'}).status_code, 400)
+
+    def test_bulk_export_is_staff_only_and_partitioned(self):
+        other = synthetic.generate(1, 10, days=90, seed=4, prefix='exp2')[0]
+        self.assertEqual(self.client.get(reverse('export_all')).status_code, 302)
+
+        self.user.is_staff = True
+        self.user.save()
+        rows = [json.loads(line) for line in self.body(
+            self.client.get(reverse('export_all'), {'format': 'ndjson', 'days': 7})
+        ).splitlines()]
+        self.assertEqual(len(rows), 40)
+        self.assertEqual({r['username'] for r in rows}, {self.user.username, other.username})
+        self.assertEqual([r['date'] for r in rows], sorted(r['date'] for r in rows))
+
+        start, end = rows[5]['date'], rows[-5]['date']
+        ranged = self.body(self.client.get(reverse('export_all'), {'start': start, 'end': end}))
+        expected = HealthLog.objects.filter(date__gte=start, date__lte=end).count()
+        self.assertEqual(len(ranged.splitlines()), expected + 1)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('gus', 'gus@example.com', 'pw-12345')
+        self.client.force_login(self.user)
+        HealthLog.objects.create(user=self.user, log_type='FOOD', sleep_hours=8, calories_intake=1800)
+
+    def get(self, name):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse(name))
+        return response, len(captured)
+
+    def test_unchanged_dashboard_skips_its_queries(self):
+        first, cold = self.get('dashboard')
+        second, warm = self.get('dashboard')
+        self.assertLess(warm, cold)
+        self.assertEqual(first.context['stats_html'], second.context['stats_html'])
+
+    def test_writes_show_up_immediately(self):
+        self.get('dashboard')
+        HealthLog.objects.create(user=self.user, log_type='EXERCISE', exercise_type='Yoga', calories_burned=321)
+        self.assertContains(self.get('dashboard')[0], "321 kcal")
+
+        # Bulk paths skip the model signals and bump through rollups.rebuild
+        csv_text = "date,log_type,calories_intake\n2024-01-01,FOOD,1234\n"
+        importer.import_logs(self.user, BytesIO(csv_text.encode()), 'csv')
+        HealthLog.objects.filter(calories_intake=1234).update(date='2099-01-01')
+        rollups.rebuild([self.user.id])
+        self.assertContains(self.get('dashboard')[0], "1234 kcal")
+
+    def test_writes_from_other_processes_show_up(self):
+        self.get('dashboard')
+        _, warm = self.get('dashboard')
+        # All a write in rebuild_rollups, archive_logs or build_percentiles leaves behind is in the database
+        UserProfile.touch([self.user.id])
+        _, after_write = self.get('dashboard')
+        self.assertGreater(after_write, warm)
+        self.assertEqual(self.get('dashboard')[1], warm)
+
+    def test_cached_table_carries_the_current_csrf_token(self):
+        self.client.get(reverse('dashboard'))
+        # A new session gets a new CSRF secret; the cached delete form must still work
+        client = self.client_class(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        page = client.get(reverse('dashboard')).content.decode()
+        self.assertNotIn(fragments.CSRF_PLACEHOLDER, page)
+        token = page.split('name="csrfmiddlewaretoken" value="')[1].split('"')[0]
+
+        log = HealthLog.objects.get(user=self.user)
+        client.post(reverse('delete_log', args=[log.id]), {'csrfmiddlewaretoken': token})
+        self.assertFalse(HealthLog.objects.filter(pk=log.pk).exists())
+
+    def test_profile_bmi_block_follows_profile_changes(self):
+        self.assertContains(self.get('profile')[0], "Normal")
+        profile = UserProfile.objects.get(user=self.user)
+        profile.weight = 120
+        profile.save()
+        self.assertContains(self.get('profile')[0], "Obese")
+
+
+class HotPathQueryTests(TestCase):
+    LOG = {'log_type': 'FOOD', 'sleep_hours': 8, 'water_intake': 8, 'exercise_type': 'None', 'calories_burned': 0,
+           'calories_intake': 2000, 'protein': 80, 'carbs': 200, 'fats': 60}
+
+    def setUp(self):
+        self.user = User.objects.create_user('hal', 'hal@example.com', 'pw-12345')
+
+    def test_login_does_not_touch_the_profile(self):
+        # user lookup, session insert (3), last_login update, session update (3)
+        with self.assertNumQueries(9):
+            self.client.post(reverse('login'), {'username': 'hal', 'password': 'pw-12345'})
+
+    def test_sessions_from_before_profile_backend_stay_logged_in(self):
+        model_backend = 'django.contrib.auth.backends.ModelBackend'
+        with override_settings(AUTHENTICATION_BACKENDS=[model_backend]):
+            self.client.post(reverse('login'), {'username': 'hal', 'password': 'pw-12345'})
+        self.assertEqual(self.client.session['_auth_user_backend'], model_backend)
+
+        self.assertEqual(self.client.get(reverse('history')).status_code, 200)
+        # The async pages need the profile preloaded; the session moves over to ProfileBackend
+        self.assertEqual(self.client.get(reverse('dashboard')).status_code, 200)
+        self.assertEqual(self.client.session['_auth_user_backend'], 'core.backends.ProfileBackend')
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+    def test_add_log_reuses_the_request_profile(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('add_log'), self.LOG)
+        # session, user+profile, then the insert, the three rollup rows, the rolling state and
+        # the profile's data_changed_at inside one savepoint
+        with self.assertNumQueries(14):
+            response = self.client.post(reverse('add_log'), self.LOG)
+        self.assertEqual(response.context['result'].health_score, 95)
+
+    def test_profile_writes_only_when_something_changed(self):
+        self.client.force_login(self.user)
+        form = {'first_name': '', 'last_name': '', 'email': 'hal@example.com', 'age': 25, 'height': 170, 'weight': 70}
+        with self.assertNumQueries(2):
+            self.client.get(reverse('profile'))
+        with self.assertNumQueries(2):
+            self.client.post(reverse('profile'), form)
+
+        self.client.post(reverse('profile'), dict(form, weight=95))
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.bmi, profile.bmi_status), (profile.get_bmi(), "Obese"))
+
+
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        # Few distinct dates, so many rows tie on date and the id breaks the tie
+        self.user = synthetic.generate(1, 45, days=4, seed=5, prefix='hist')[0]
+        synthetic.generate(1, 10, days=4, seed=6, prefix='other')
+        self.client.force_login(self.user)
+        self.expected = list(HealthLog.objects.filter(user=self.user).order_by('-date', '-id').values_list('id', flat=True))
+
+    def test_api_walks_every_log_once_in_order(self):
+        seen, url, pages = [], reverse('api_logs') + '?limit=10', 0
+        while url:
+            with self.assertNumQueries(3):  # session, user, one page; no COUNT(*)
+                data = self.client.get(url).json()
+            seen += [row['id'] for row in data['results']]
+            url, pages = data['next'], pages + 1
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(pages, 5)
+
+    def test_history_page_links_to_older_logs(self):
+        first = self.client.get(reverse('history'))
+        self.assertEqual([log.id for log in first.context['logs']], self.expected[:history.PAGE_SIZE])
+        second = self.client.get(reverse('history'), {'cursor': first.context['next_cursor']})
+        self.assertEqual([log.id for log in second.context['logs']], self.expected[history.PAGE_SIZE:2 * history.PAGE_SIZE])
+        self.assertContains(second, 'Newest')
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get(reverse('api_logs'), {'cursor': 'nope'}).status_code, 400)
+        self.assertRedirects(self.client.get(reverse('history'), {'cursor': 'nope'}), reverse('history'))
+
+    def test_pages_seek_through_the_user_date_index(self):
+        cursor = history.encode_cursor(HealthLog.objects.get(pk=self.expected[20]))
+        day, log_id = history.decode_cursor(cursor)
+        plan = HealthLog.objects.filter(user=self.user, date__lte=day).order_by('-date', '-id')[:21].explain()
+        self.assertIn('core_log_user_date_id_idx', plan)
+
+
+class TrendTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ivy', 'ivy@example.com', 'pw-12345')
+        self.client.force_login(self.user)
+
+    def add(self, day, **fields):
+        fields.setdefault('log_type', 'FOOD')
+        return HealthLog.objects.create(user=self.user, date=day, **fields)
+
+    def test_buckets_are_averaged_in_the_database(self):
+        monday = datetime.date(2024, 1, 1)
+        self.add(monday, sleep_hours=6)
+        self.add(monday + datetime.timedelta(days=2), sleep_hours=8)
+        self.add(monday + datetime.timedelta(days=7), sleep_hours=9)
+        self.add(monday, log_type='EXERCISE', sleep_hours=7, calories_burned=400)
+
+        data = self.client.get(reverse('api_trends'), {
+            'metric': 'sleep_hours', 'bucket': 'week', 'start': '2024-01-01', 'end': '2024-01-31',
+        }).json()
+        self.assertEqual(data['points'], [['2024-01-01', 7.0], ['2024-01-08', 9.0]])
+
+        burned = trends.series(self.user, 'calories_burned', monday, monday, 'day')
+        self.assertEqual(burned['points'], [(monday, 400)])
+        self.assertEqual(self.client.get(reverse('api_trends'), {'metric': 'weight'}).status_code, 400)
+
+    def test_long_histories_are_downsampled(self):
+        # Ten years of daily logs
+        start = datetime.date.today() - datetime.timedelta(days=3650)
+        HealthLog.objects.bulk_create([
+            HealthLog(user=self.user, date=start + datetime.timedelta(days=i), log_type='FOOD',
+                      health_score=50 + (i * 7919) % 50)
+            for i in range(3651)
+        ])
+        with self.assertNumQueries(5):  # session, user, archived months, first date, one GROUP BY
+            data = self.client.get(reverse('api_trends'), {'bucket': 'day', 'points': 200}).json()
+        self.assertEqual(data['buckets'], 3651)
+        self.assertEqual(len(data['points']), 200)
+        self.assertEqual(data['points'][0][0], start.isoformat())
+
+        self.assertEqual(trends.series(self.user, 'health_score')['bucket'], 'month')
+        self.assertContains(self.client.get(reverse('dashboard')), 'id="trend-line"')
+
+    def test_lttb_keeps_the_extremes(self):
+        points = [(x, 0) for x in range(1000)]
+        points[500] = (500, 100)
+        points[700] = (700, -100)
+        sampled = trends.lttb(points, 20)
+        self.assertEqual(len(sampled), 20)
+        self.assertEqual((sampled[0], sampled[-1]), (points[0], points[-1]))
+        self.assertIn((500, 100), sampled)
+        self.assertIn((700, -100), sampled)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.user = synthetic.generate(1, 5, seed=3, prefix='metrics')[0]
+        self.client.force_login(self.user)
+
+    def test_views_are_recorded_and_exposed(self):
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(reverse('dashboard'))
+        queries = len(captured)
+        with self.settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            text = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('healthyio_requests_total{method="GET",status="200",view="dashboard"} 1', text)
+        self.assertIn('healthyio_request_duration_seconds_count{view="dashboard"} 1', text)
+        self.assertIn(f'healthyio_request_queries_sum{{view="dashboard"}} {float(queries)}', text)
+        self.assertIn('healthyio_request_template_seconds_bucket{view="dashboard",le="+Inf"} 1', text)
+        self.assertIn('healthyio_llm_breaker_open{provider="groq"} 0', text)
+
+    def test_spans_and_server_timing(self):
+        with self.settings(METRICS_SERVER_TIMING=True), benchmarks.stub_llm():
+            response = self.client.get(reverse('ai_coach'))
+        header = response['Server-Timing']
+        self.assertRegex(header, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('llm;dur=', header)
+        self.assertIn('healthyio_span_seconds_count{span="llm"} 1', metrics.render())
+
+    def test_slow_requests_are_logged(self):
+        with self.settings(METRICS_SLOW_REQUEST_MS=0), self.assertLogs('core.metrics', 'WARNING') as logs:
+            self.client.get(reverse('tips'))
+        self.assertIn('Slow request GET /tips/ (tips)', logs.output[0])
+
+    def test_metrics_need_staff_a_token_or_an_allowed_ip(self):
+        # The test client comes from 127.0.0.1, like every visitor behind a local proxy
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with self.settings(METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer scrape-secret'}).status_code, 200)
+        with self.settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+    # Two separate SQLite databases; nothing replicates, so where a read went is visible
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        routers._down.clear()
+        self.user = User.objects.create_user('rho', 'rho@example.com', 'pw-12345')
+        # The replica has the account but none of the logs yet
+        User.objects.using('replica').bulk_create([self.user])
+        UserProfile.objects.using('replica').bulk_create([UserProfile.objects.get(user=self.user)])
+        HealthLog.objects.create(user=self.user, date=datetime.date(2024, 5, 1), log_type='FOOD')
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        routers._down.clear()
+
+    def logs_seen(self):
+        return len(self.client.get(reverse('api_logs')).json()['results'])
+
+    def test_reads_go_to_the_replica_until_the_user_writes(self):
+        self.assertEqual(self.logs_seen(), 0)
+        export = self.client.get(reverse('export_logs'), {'format': 'ndjson'})
+        self.assertEqual(b"".join(export.streaming_content), b"")
+
+        response = self.client.post(reverse('add_log'), HotPathQueryTests.LOG)
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        self.assertEqual(self.logs_seen(), 2)
+
+        # Once the pin expires, reads are back on the replica
+        del self.client.cookies[routers.PIN_COOKIE]
+        self.assertEqual(self.logs_seen(), 0)
+
+    def test_unreachable_replica_is_skipped(self):
+        replica = connections['replica']
+        with mock.patch.object(replica, 'ensure_connection', side_effect=OperationalError("down")) as connect:
+            with self.assertLogs('core.routers', 'WARNING'):
+                self.assertEqual(self.logs_seen(), 1)
+            self.assertEqual(self.logs_seen(), 1)
+        self.assertEqual(connect.call_count, 1)  # not retried until DATABASE_REPLICA_RETRY has passed
+
+    def test_writes_and_commands_use_the_primary(self):
+        self.assertEqual(HealthLog.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(routers.ReplicaRouter().db_for_write(HealthLog), 'default')
+
+
+class PercentileTests(TestCase):
+    def setUp(self):
+        self.users = synthetic.generate(3, 40, seed=5, prefix='pct')
+        UserProfile.objects.filter(user=self.users[0]).update(age=34)
+
+    def test_chunked_build_counts_every_log(self):
+        percentiles.build(chunk_size=7)
+        chunked = {(d.bmi_status, d.age_band): d.cumulative for d in ScoreDistribution.objects.all()}
+        percentiles.build()
+        whole = {(d.bmi_status, d.age_band): d.cumulative for d in ScoreDistribution.objects.all()}
+        self.assertEqual(chunked, whole)
+
+        everyone = ScoreDistribution.objects.get(bmi_status='all', age_band='all')
+        scores = list(HealthLog.objects.values_list('health_score', flat=True))
+        self.assertEqual(everyone.total, len(scores))
+        self.assertEqual(everyone.cumulative[60], sum(1 for s in scores if s <= 60))
+        profile = UserProfile.objects.get(user=self.users[0])
+        self.assertTrue(ScoreDistribution.objects.filter(bmi_status=profile.bmi_status, age_band='30-39').exists())
+
+    def test_rebuild_touches_only_users_whose_percentile_moved(self):
+        percentiles.build()
+        changed = dict(UserProfile.objects.values_list('user_id', 'data_changed_at'))
+        percentiles.build()
+        self.assertEqual(dict(UserProfile.objects.values_list('user_id', 'data_changed_at')), changed)
+
+        # Lots of perfect days push everyone's latest log down the ranking
+        HealthLog.objects.bulk_create([HealthLog(user=self.users[0], log_type='FOOD', health_score=100)
+                                       for _ in range(200)])
+        percentiles.build()
+        moved = {user_id for user_id, at in UserProfile.objects.values_list('user_id', 'data_changed_at')
+                 if at != changed[user_id]}
+        self.assertEqual(moved, {user.id for user in self.users})
+
+    def test_rank(self):
+        cumulative = [0] * 49 + [10] * 51 + [20]  # ten logs scored 49, ten scored 100
+        self.assertEqual(percentiles.rank(cumulative, 49), 25)
+        self.assertEqual(percentiles.rank(cumulative, 75), 50)
+        self.assertEqual(percentiles.rank(cumulative, 100), 75)
+        self.assertEqual(percentiles.rank(cumulative, 0), 0)
+
+    def test_dashboard_shows_the_users_percentile(self):
+        user = self.users[0]
+        self.client.force_login(user)
+        self.assertNotContains(self.client.get(reverse('dashboard')), 'of days logged by')
+
+        percentiles.build()
+        profile = UserProfile.objects.get(user=user)
+        latest = HealthLog.objects.filter(user=user).latest('date', 'id')
+        expected = percentiles.percentile(profile, latest.health_score)
+        # 120 logs in all, too few to rank within one segment
+        self.assertEqual(expected['segment'], 'everyone')
+        self.assertContains(self.client.get(reverse('dashboard')),
+                            f"Your latest log scored higher than {expected['rank']}% of days logged by everyone")
+
+        with mock.patch.object(percentiles, 'MIN_SEGMENT', 1):
+            mine = percentiles.percentile(profile, 70)
+        self.assertEqual(mine['segment'], f"people aged 30-39 in the {profile.bmi_status} BMI range")
+
+
+class CoachBatchTests(TestCase):
+    def setUp(self):
+        ai_cache.get_cache().clear()
+        llm.reset()
+        self.users = []
+        for i in range(6):
+            user = User.objects.create_user(f'coach{i}', f'coach{i}@example.com', 'pw-12345', first_name=f'C{i}')
+            HealthLog.objects.create(user=user, log_type='FOOD', sleep_hours=6 + i % 3)
+            self.users.append(user)
+        idle = User.objects.create_user('idle', 'idle@example.com', 'pw-12345')
+        HealthLog.objects.create(user=idle, log_type='FOOD', date=datetime.date.today() - datetime.timedelta(days=60))
+
+    def run_batch(self, server, *args):
+        with override_settings(GROQ_BASE_URL=server.url):
+            call_command('run_coach_batch', '--rpm', '100000', '--tpm', '100000000', *args, stdout=StringIO())
+
+    def test_summaries_are_written_once_with_bounded_concurrency(self):
+        with FakeLLMServer(reply="<p>Nightly tip</p>", latency=0.05) as server:
+            self.run_batch(server, '--concurrency', '2')
+            self.assertEqual(len(server.requests), 6)
+            self.assertLessEqual(server.peak_in_flight, 2)
+            self.assertEqual(CoachSummary.objects.count(), 6)  # not the idle user
+
+            # Nothing changed, nothing sent; a new log means a new summary for that user only
+            self.run_batch(server)
+            self.assertEqual(len(server.requests), 6)
+            HealthLog.objects.create(user=self.users[0], log_type='EXERCISE', calories_burned=300)
+            self.run_batch(server)
+            self.assertEqual(len(server.requests), 7)
+
+    def test_failed_users_are_picked_up_by_the_next_run(self):
+        with FakeLLMServer(fail_every=3) as server, override_settings(LLM_MAX_RETRIES=0), \
+                self.assertLogs('core.coach_batch', 'WARNING'):
+            self.run_batch(server, '--concurrency', '1')
+        self.assertEqual(CoachSummary.objects.count(), 4)
+
+        with FakeLLMServer() as server:
+            self.run_batch(server)
+            self.assertEqual(len(server.requests), 2)
+        self.assertEqual(CoachSummary.objects.count(), 6)
+
+    def test_coach_page_serves_the_stored_summary(self):
+        with FakeLLMServer(reply="<p>Precomputed advice</p>") as server:
+            self.run_batch(server)
+        self.client.force_login(self.users[1])
+        with mock.patch.object(llm, 'acomplete', side_effect=AssertionError("no LLM call expected")):
+            self.assertContains(self.client.get(reverse('ai_coach')), "Precomputed advice")
+
+    def test_token_bucket_paces_calls(self):
+        bucket = coach_batch.TokenBucket(rate=50, capacity=1)
+
+        async def take(count):
+            for _ in range(count):
+                await bucket.acquire()
+
+        started = time.monotonic()
+        async_to_sync(take)(6)
+        self.assertGreaterEqual(time.monotonic() - started, 5 / 50)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = synthetic.generate(1, 300, days=3 * 365, seed=7, prefix='cold')[0]
+        self.before = archive.cutoff(days=365)
+
+    def snapshot(self):
+        summary = UserSummary.objects.get(user=self.user)
+        monthly = trends.series(self.user, 'calories_burned', bucket='month')['points']
+        return {
+            'summary': (summary.log_count, summary.score_sum, summary.workout_count, round(summary.sleep_sum, 6),
+                        summary.latest_log_id),
+            'monthly': [(day, round(value, 2)) for day, value in monthly],
+            'scores': percentiles.count_scores()[('all', 'all')],
+        }
+
+    def test_archived_months_are_combined_with_hot_rows(self):
+        before = self.snapshot()
+        total = HealthLog.objects.count()
+        call_command('archive_logs', '--days', '365', stdout=StringIO())
+
+        self.assertFalse(HealthLog.objects.filter(date__lt=self.before).exists())
+        months = ArchivedMonth.objects.filter(user=self.user)
+        self.assertEqual(HealthLog.objects.count() + sum(m.log_count for m in months), total)
+        self.assertTrue(all(os.path.exists(archive.file_path(m.archive_path)) for m in months))
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(rollups.verify(), [])
+
+        rollups.rebuild()
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(rollups.verify(), [])
+
+    def test_restore_puts_the_rows_back(self):
+        ids = set(HealthLog.objects.values_list('id', flat=True))
+        before = self.snapshot()
+        archive.archive(self.before)
+        # A run that stopped after writing a file but before deleting the rows
+        month = HealthLog.objects.order_by('date').values_list('date', flat=True).first().replace(day=1)
+        with mock.patch.object(rollups, 'rebuild_buckets', side_effect=RuntimeError("killed")):
+            with self.assertRaises(RuntimeError):
+                archive.archive_month(self.user.id, month)
+        archive.archive(archive.next_month(month))
+
+        call_command('archive_logs', '--restore', '--user', self.user.username, stdout=StringIO())
+        self.assertEqual(set(HealthLog.objects.values_list('id', flat=True)), ids)
+        self.assertFalse(ArchivedMonth.objects.exists())
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(rollups.verify(), [])
+
+    def test_discarded_rows_stay_archived(self):
+        archive.archive(self.before, keep_raw=False)
+        self.assertFalse(ArchivedMonth.objects.exclude(archive_path='').exists())
+        self.assertEqual(archive.restore(self.user.id), 0)
+        self.assertTrue(ArchivedMonth.objects.exists())
+
+    def test_a_month_keeps_the_mode_it_was_archived_with(self):
+        ids = set(HealthLog.objects.values_list('id', flat=True))
+        archive.archive(self.before, keep_raw=True)
+        month = ArchivedMonth.objects.filter(user=self.user).earliest('month')
+        late = HealthLog.objects.create(user=self.user, log_type='FOOD', date=month.month, sleep_hours=7)
+        archive.archive(self.before, keep_raw=False)
+
+        month.refresh_from_db()
+        self.assertTrue(month.keep_raw)
+        self.assertIn(late.id, {row['id'] for row in archive.read_rows(month.archive_path)})
+        archive.restore(self.user.id)
+        self.assertEqual(set(HealthLog.objects.values_list('id', flat=True)), ids | {late.id})
+        self.assertEqual(rollups.verify(), [])
+
+    def test_archiving_touches_the_user_once(self):
+        month = HealthLog.objects.order_by('date').values_list('date', flat=True).first().replace(day=1)
+        with mock.patch.object(UserProfile, 'touch') as touch, mock.patch.object(ai_cache, 'invalidate') as invalidate:
+            self.assertGreater(archive.archive_month(self.user.id, month), 1)
+        touch.assert_called_once_with([self.user.id])
+        invalidate.assert_called_once_with(self.user.id)
+
+    def export(self, fmt='csv'):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('export_logs'), {'format': fmt})
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_export_includes_archived_months(self):
+        _, before = self.export()
+        archive.archive(self.before)
+        # A run that stopped after writing a file but before deleting the rows: they are not exported twice
+        month = HealthLog.objects.order_by('date').values_list('date', flat=True).first().replace(day=1)
+        with mock.patch.object(rollups, 'rebuild_buckets', side_effect=RuntimeError("killed")):
+            with self.assertRaises(RuntimeError):
+                archive.archive_month(self.user.id, month)
+
+        response, after = self.export()
+        self.assertEqual(after, before)
+        self.assertNotIn('X-Omitted-Archived-Months', response)
+        self.assertEqual(len(self.export('ndjson')[1].splitlines()), 300)
+
+    def test_export_names_discarded_months(self):
+        archive.archive(self.before, keep_raw=False)
+        response, text = self.export()
+        months = ArchivedMonth.objects.filter(user=self.user).order_by('month')
+        self.assertEqual(response['X-Omitted-Archived-Months'], ",".join(f"{m.month:%Y-%m}" for m in months))
+        self.assertEqual(len(text.splitlines()), 1 + HealthLog.objects.filter(user=self.user).count())
+
+
+class StartupTests(SimpleTestCase):
+    def test_wsgi_start_up_leaves_pdf_and_llm_libraries_unloaded(self):
+        seconds, rss_mb, loaded = benchmarks.start_process('wsgi')
+        self.assertEqual(loaded, [])
+
+    def test_warm_up_loads_the_listed_services(self):
+        seconds, rss_mb, loaded = benchmarks.start_process('wsgi_preloaded')
+        self.assertEqual(set(loaded), set(benchmarks.LAZY_MODULES))
+
+
+class RollingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('rita', 'rita@example.com', 'pw-12345')
+        self.today = datetime.date.today()
+
+    def add(self, days_ago, **fields):
+        fields.setdefault('log_type', 'FOOD')
+        fields.setdefault('water_intake', 8)
+        return HealthLog.objects.create(user=self.user, date=self.today - datetime.timedelta(days=days_ago), **fields)
+
+    def window(self):
+        self.assertEqual(rolling.verify(self.user.id), [])
+        return rolling.for_user(self.user.id)
+
+    def test_streaks_and_window_follow_writes(self):
+        logs = {days_ago: self.add(days_ago, sleep_hours=7, calories_intake=2000) for days_ago in range(5)}
+        self.add(0, log_type='EXERCISE', sleep_hours=7, calories_burned=500)
+        dry = HealthLog.objects.get(pk=logs[2].pk)
+        dry.water_intake = 4
+        dry.save()
+        window = self.window()
+        self.assertEqual((window['logging_streak'], window['hydration_streak'], window['days_logged']), (5, 2, 5))
+        self.assertEqual(window['calorie_balance'], 5 * 2000 - 500)
+        self.assertEqual(window['avg_sleep'], 7)
+
+        # A back-dated edit that joins the two hydration streaks
+        dry.water_intake = 10
+        dry.save()
+        self.assertEqual(self.window()['hydration_streak'], 5)
+
+        # A gap in the middle cuts both streaks
+        logs[3].delete()
+        window = self.window()
+        self.assertEqual((window['logging_streak'], window['hydration_streak']), (3, 3))
+
+        # Emptying the latest day moves everything back a day
+        HealthLog.objects.filter(user=self.user, date=self.today).first().delete()
+        HealthLog.objects.filter(user=self.user, date=self.today).first().delete()
+        window = self.window()
+        self.assertEqual((window['end_date'], window['logging_streak']), (self.today - datetime.timedelta(days=1), 2))
+
+        for log in HealthLog.objects.filter(user=self.user):
+            log.delete()
+        self.assertIsNone(self.window())
+
+    def test_writes_on_the_latest_days_are_constant_time(self):
+        for days_ago in range(40, 0, -1):
+            self.add(days_ago)
+        log = HealthLog.objects.get(user=self.user, date=self.today - datetime.timedelta(days=3))
+        with mock.patch.object(rolling, 'compute', side_effect=AssertionError("recomputed")):
+            with CaptureQueriesContext(connection) as captured:
+                self.add(0)
+                log.sleep_hours = 9
+                log.save()
+            # Locking the state row and saving it, per write
+            self.assertEqual(sum('core_rollingstate' in query['sql'] for query in captured.captured_queries), 4)
+        self.assertEqual(self.window()['logging_streak'], 41)
+
+    def test_random_writes_match_a_recompute(self):
+        rng = random.Random(7)
+        for _ in range(150):
+            logs = list(HealthLog.objects.filter(user=self.user))
+            action = rng.random()
+            if action < 0.5 or not logs:
+                self.add(rng.randrange(20), water_intake=rng.choice([4, 8, 9]), sleep_hours=rng.choice([5, 7.5]))
+            elif action < 0.8:
+                log = rng.choice(logs)
+                log.date = self.today - datetime.timedelta(days=rng.randrange(20))
+                log.water_intake = rng.choice([4, 8, 9])
+                log.save()
+            else:
+                rng.choice(logs).delete()
+            self.assertEqual(rolling.verify(self.user.id), [])
+        rolling.rebuild(self.user.id)
+        self.assertEqual(rollups.verify([self.user.id]), [])
+
+    def test_dashboard_and_coach_prompt_read_the_window(self):
+        for days_ago in range(3):
+            self.add(days_ago, sleep_hours=8, calories_intake=1800)
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('dashboard')), "Logging streak")
+
+        prompt = coach_prompt.for_user(self.user, self.user.userprofile, rolling.for_user(self.user.id), 7)
+        self.assertIn("- Streaks: logging 3 days, hydration 3 days", prompt)
+        self.assertIn("balance +5400 kcal/week", prompt)
+
+
+class ConditionalRequestTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('gus', 'gus@example.com', 'pw-12345')
+        self.client.force_login(self.user)
+        self.client.get(reverse('dashboard'))  # sets the CSRF cookie, which is part of the ETag
+
+    def revalidate(self, name, **params):
+        first = self.client.get(reverse(name), params)
+        self.assertEqual(first.status_code, 200)
+        again = self.client.get(reverse(name), params, HTTP_IF_NONE_MATCH=first['ETag'])
+        return first, again
+
+    def test_unchanged_dashboard_is_not_modified(self):
+        first, again = self.revalidate('dashboard')
+        self.assertEqual(again.status_code, 304)
+        self.assertIn('private', first['Cache-Control'])
+        with self.assertNumQueries(2):  # session, user with profile
+            self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=first['ETag'])
+        response = self.client.get(reverse('dashboard'), HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        HealthLog.objects.create(user=self.user, log_type='FOOD', sleep_hours=8)
+        self.assertEqual(self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_profile_and_snapshot_changes_move_the_validators(self):
+        first = self.client.get(reverse('profile'))['ETag']
+        form = {'first_name': 'Gus', 'last_name': '', 'email': 'gus@example.com', 'age': 25, 'height': 170, 'weight': 70}
+        self.client.post(reverse('profile'), form)
+        second = self.client.get(reverse('profile'), HTTP_IF_NONE_MATCH=first)
+        self.assertEqual(second.status_code, 200)
+
+        HealthLog.objects.create(user=self.user, log_type='FOOD', sleep_hours=8)
+        dashboard = self.client.get(reverse('dashboard'))['ETag']
+        percentiles.build()  # the first snapshot gives the user a percentile
+        self.assertEqual(self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=dashboard).status_code, 200)
+        dashboard = self.client.get(reverse('dashboard'))['ETag']
+        percentiles.build()  # nothing moved
+        self.assertEqual(self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=dashboard).status_code, 304)
+
+    def test_report_is_revalidated_without_touching_the_queue(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        HealthLog.objects.create(user=self.user, log_type='FOOD', sleep_hours=8)
+        reports.heartbeat()
+        preparing = self.client.get(reverse('download_pdf'))
+        self.assertNotIn('ETag', preparing)
+        self.assertIn('no-store', preparing['Cache-Control'])
+
+        while (job := reports.claim_next()) is not None:
+            reports.run_job(job)
+        ready = self.client.get(reverse('download_pdf'))
+        self.assertEqual(ready['Content-Type'], 'application/pdf')
+        with mock.patch.object(reports, 'request_report') as request_report:
+            response = self.client.get(reverse('download_pdf'), HTTP_IF_NONE_MATCH=ready['ETag'])
+        self.assertEqual(response.status_code, 304)
+        request_report.assert_not_called()
+
+    def test_static_pages_keep_their_validators(self):
+        first, again = self.revalidate('tips')
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['ETag'], first['ETag'])
+        # Logged in, home redirects whatever the browser has cached
+        self.assertEqual(self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=first['ETag']).status_code, 302)
+
+        self.client.logout()
+        first, again = self.revalidate('home')
+        self.assertEqual(again.status_code, 304)
+
+
+class CoachPromptTests(TestCase):
+    def setUp(self):
+        self.user = synthetic.generate(1, 1500, days=730, seed=3, prefix='prompt')[0]
+        self.profile = self.user.userprofile
+
+    def prompt(self, days=90, budget=None):
+        return coach_prompt.for_user(self.user, self.profile, rolling.for_user(self.user.id), days, budget)
+
+    def test_long_history_fits_the_budget(self):
+        for days in (7, 30, 90):
+            prompt = self.prompt(days)
+            self.assertLessEqual(coach_prompt.estimate_tokens(prompt), settings.COACH_PROMPT_TOKENS)
+            self.assertIn(f"LAST {days} DAYS", prompt)
+            self.assertIn("- Macros (share of calories): protein ", prompt)
+            self.assertIn("Format with HTML tags.", prompt)
+
+        # A tight budget drops the least important lines, never the profile or the instructions
+        short = self.prompt(budget=150)
+        self.assertLessEqual(coach_prompt.estimate_tokens(short), 150)
+        self.assertIn("- Health score: avg ", short)
+        self.assertNotIn("Score by week", short)
+        self.assertIn("Format with HTML tags.", short)
+        with self.assertRaises(ValueError):
+            self.prompt(budget=20)
+
+    def test_prompt_only_changes_with_the_data(self):
+        prompt = self.prompt()
+        self.assertEqual(self.prompt(), prompt)
+        with CaptureQueriesContext(connection) as captured:
+            self.prompt()
+        self.assertEqual(len(captured), 2)  # the rolling state and one GROUP BY
+
+        HealthLog.objects.create(user=self.user, log_type='FOOD', protein=300)
+        self.assertNotEqual(self.prompt(), prompt)
+
+    def test_statistics(self):
+        user = User.objects.create_user('stat', 'stat@example.com', 'pw-12345', first_name='Stat')
+        today = datetime.date.today()
+        for days_ago, sleep in ((0, 8), (1, 7), (2, 6)):
+            HealthLog.objects.create(user=user, log_type='FOOD', date=today - datetime.timedelta(days=days_ago),
+                                     sleep_hours=sleep, water_intake=8, calories_intake=700,
+                                     protein=50, carbs=50, fats=0)
+        HealthLog.objects.create(user=user, log_type='EXERCISE', exercise_type='Yoga', calories_burned=700,
+                                 sleep_hours=8, water_intake=8)
+        prompt = coach_prompt.for_user(user, user.userprofile, rolling.for_user(user.id), 7)
+        self.assertIn("3 days logged, 4 logs, 1 workouts", prompt)
+        self.assertIn("trend +7.0h/week", prompt)
+        self.assertIn("target met on 3 of 3 days", prompt)
+        self.assertIn("balance +1400 kcal/week", prompt)
+        self.assertIn("protein 50%, carbs 50%, fats 0%", prompt)
+        self.assertIn("- Streaks: logging 3 days, hydration 3 days", prompt)
+        self.assertIn("- Workouts: Yoga 1", prompt)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        fragments.get_cache().clear()
+        self.user = User.objects.create_user('ivy', 'ivy@example.com', 'pw-12345', first_name='Ivy')
+        self.log = HealthLog.objects.create(user=self.user, log_type='FOOD', sleep_hours=8, water_intake=8)
+        self.client.force_login(self.user)
+        self.async_client.cookies = self.client.cookies
+
+    async def test_pages_with_the_async_client(self):
+        anonymous = await AsyncClient().get(reverse('dashboard'))
+        self.assertRedirects(anonymous, f"{reverse('login')}?next={reverse('dashboard')}", fetch_redirect_response=False)
+
+        await self.async_client.get(reverse('dashboard'))  # sets the CSRF cookie, which is part of the ETag
+        response = await self.async_client.get(reverse('dashboard'))
+        self.assertContains(response, "Ivy")
+        again = await self.async_client.get(reverse('dashboard'), headers={'If-None-Match': response['ETag']})
+        self.assertEqual(again.status_code, 304)
+
+        await self.async_client.post(reverse('add_log'), HotPathQueryTests.LOG)
+        self.assertEqual(await HealthLog.objects.filter(user=self.user).acount(), 2)
+
+        other = await sync_to_async(User.objects.create_user)('jon', 'jon@example.com', 'pw-12345')
+        theirs = await HealthLog.objects.acreate(user=other, log_type='FOOD')
+        response = await self.async_client.get(reverse('edit_log', args=[theirs.id]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_login_and_logout(self):
+        client = AsyncClient()
+        response = await client.post(reverse('login'), {'username': 'ivy', 'password': 'pw-12345'})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertEqual((await client.get(reverse('dashboard'))).status_code, 200)
+
+        await client.get(reverse('logout'))
+        self.assertEqual((await client.get(reverse('dashboard'))).status_code, 302)
+
+    def test_async_readers_match_the_sync_ones(self):
+        window = rolling.for_user(self.user.id)
+        self.assertEqual(async_to_sync(rolling.afor_user)(self.user.id), window)
+        self.assertEqual(async_to_sync(coach_prompt.afor_user)(self.user, self.user.userprofile, window),
+                         coach_prompt.for_user(self.user, self.user.userprofile, window))
+
+    def test_async_callers_share_one_call(self):
+        ai_cache.get_cache().clear()
+        calls = []
+
+        async def slow_compute():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "answer"
+
+        async def ask_five_times():
+            return await asyncio.gather(*(ai_cache.aget_or_compute(self.user.id, ["async prompt"], slow_compute)
+                                          for _ in range(5)))
+
+        self.assertEqual(async_to_sync(ask_five_times)(), ["answer"] * 5)
+        self.assertEqual(calls, [1])
+
+    def test_followers_take_over_when_the_leader_is_cancelled(self):
+        ai_cache.get_cache().clear()
+        calls = []
+
+        async def slow_compute():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "answer"
+
+        async def leader_goes_away():
+            leader = asyncio.ensure_future(ai_cache.aget_or_compute(self.user.id, ["left"], slow_compute))
+            await asyncio.sleep(0.02)
+            follower = asyncio.ensure_future(ai_cache.aget_or_compute(self.user.id, ["left"], slow_compute))
+            await asyncio.sleep(0.02)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual(async_to_sync(leader_goes_away)(), "answer")
+        self.assertEqual(calls, [1, 1])
+
+    def test_middleware_stays_on_the_event_loop(self):
+        async def get_response(request):
+            return None
+
+        for middleware in (metrics.MetricsMiddleware, routers.ReplicaMiddleware):
+            self.assertTrue(iscoroutinefunction(middleware(get_response)))
+            self.assertFalse(iscoroutinefunction(middleware(lambda request: None)))
+
+
+class FoodTests(TestCase):
+    def setUp(self):
+        # The bundled foods are already in the table, loaded by migration 0017
+        foods.reset()
+        self.addCleanup(foods.reset)
+
+    def names(self, query, limit=foods.DEFAULT_LIMIT):
+        return [food['name'] for food in foods.search(query, limit)]
+
+    def test_normalize(self):
+        self.assertEqual(foods.normalize("Crème Brûlée (baked)"), "creme brulee baked")
+        self.assertEqual(foods.normalize("  Dark chocolate (70-85%) "), "dark chocolate 70 85")
+
+    def test_prefix_of_any_word_matches(self):
+        self.assertIn("Chicken breast (grilled)", self.names("chick"))
+        self.assertIn("Chicken breast (grilled)", self.names("breast"))
+        self.assertIn("Chicken breast (grilled)", self.names("CHICKEN  Bre"))
+        self.assertEqual(self.names("xyz"), [])
+        self.assertEqual(self.names("  "), [])
+
+    def test_names_starting_with_the_query_come_first(self):
+        names = self.names("apple")
+        self.assertEqual(names[0], "Apple")
+        self.assertIn("Apple juice", names)
+        self.assertEqual(self.names("chick", 2), ["Chicken breast (grilled)", "Chicken curry"])
+
+    def test_api_needs_no_query(self):
+        foods.preload()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('api_foods'), {'q': 'banana'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        banana = response.json()['results'][0]
+        self.assertEqual((banana['name'], banana['serving'], banana['serving_grams'], banana['calories']),
+                         ("Banana", "1 medium", 118, 89))
+
+        self.assertEqual(self.client.get(reverse('api_foods'), {'q': 'b', 'limit': 'x'}).status_code, 400)
+        self.assertEqual(len(self.client.get(reverse('api_foods'), {'q': 'c', 'limit': 3}).json()['results']), 3)
+
+    def test_bad_file_leaves_the_foods_alone(self):
+        before = Food.objects.count()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write("name,serving,serving_grams,calories,protein,carbs,fats\nOat,1 cup,80,389,17,66,7\nRye,1 slice,x,1,1,1,1\n")
+        self.addCleanup(os.remove, f.name)
+        with self.assertRaisesMessage(ValueError, "line 3"):
+            foods.load(f.name)
+        self.assertEqual(Food.objects.count(), before)
+
+    def test_bundled_foods_come_with_the_migrations(self):
+        with open(foods.DATA_PATH, encoding='utf-8') as f:
+            self.assertEqual(Food.objects.count(), len(f.readlines()) - 1)
+
+    def test_an_empty_table_is_not_kept_as_the_index(self):
+        Food.objects.all().delete()
+        foods.reset()
+        response = self.client.get(reverse('api_foods'), {'q': 'banana'})
+        self.assertEqual(response.json()['results'], [])
+        self.assertFalse(response.has_header('Cache-Control'))
+
+        # Loaded by another process: no signal reaches this one
+        Food.objects.bulk_create(foods.read(foods.DATA_PATH))
+        response = self.client.get(reverse('api_foods'), {'q': 'banana'})
+        self.assertEqual(response.json()['results'][0]['name'], "Banana")
+        self.assertIn('max-age=3600', response['Cache-Control'])
+
+    def test_changes_reach_the_index(self):
+        self.assertEqual(self.names("quokka"), [])
+        Food.objects.create(name="Quokka berry", serving="1 cup", serving_grams=100, calories=50, protein=1,
+                            carbs=12, fats=0)
+        self.assertEqual(self.names("quokka"), ["Quokka berry"])
+
+    def test_benchmark(self):
+        result = benchmarks.run_foods(sizes=(500,), lookups=50, requests=5)[0]
+        self.assertEqual(result['foods'], 500)
+        self.assertGreater(result['entries'], 500)
+        self.assertGreater(result['index_mb'], 0)
@@ -0,0 +1,163 @@
+import datetime
+
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+
+from .models import ArchivedMonth, HealthLog
+
+# Time series of one metric per day/week/month, aggregated by the database,
+# then thinned with LTTB so the browser never gets more than a few hundred points.
+# Archived months (core/archive.py) only have monthly totals, so they show up
+# as one point on the first of the month whatever the bucket.
+
+# metric -> (label, rows it is averaged over)
+METRICS = {
+    'health_score': ("Health score", Q()),
+    'sleep_hours': ("Sleep (hours)", Q()),
+    'water_intake': ("Water (glasses)", Q()),
+    'calories_intake': ("Calories eaten", Q(log_type='FOOD')),
+    'calories_burned': ("Calories burned", Q(log_type='EXERCISE')),
+}
+
+# metric -> ArchivedMonth (sum, count) fields
+ARCHIVED_FIELDS = {
+    'health_score': ('score_sum', 'log_count'),
+    'sleep_hours': ('sleep_sum', 'log_count'),
+    'water_intake': ('water_sum', 'log_count'),
+    'calories_intake': ('calories_intake_sum', 'food_count'),
+    'calories_burned': ('calories_burned_sum', 'workout_count'),
+}
+
+BUCKETS = {
+    'day': F,  # already a DateField
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+MAX_POINTS = 300
+
+
+def pick_bucket(start, end):
+    # Roughly a few hundred buckets at most before downsampling
+    days = (end - start).days
+    if days <= 400:
+        return 'day'
+    if days <= 5 * 365:
+        return 'week'
+    return 'month'
+
+
+def archived_months(user, metric, end):
+    # [(month, sum, count)] of the user's archived months up to `end`; a few rows per year
+    sum_field, count_field = ARCHIVED_FIELDS[metric]
+    return list(ArchivedMonth.objects.filter(user=user, month__lte=end).order_by('month')
+                .values_list('month', sum_field, count_field))
+
+
+def aggregate(user, metric, start, end, bucket, archived=None):
+    """[(bucket start date, average value)] for the user's logs between start and end (inclusive).
+
+    One GROUP BY query over HealthLog; the (user, -date, -id) index covers the
+    range. Archived months are added from `archived` (see archived_months),
+    or looked up when it is None. A start of None means no lower bound.
+    """
+    _, condition = METRICS[metric]
+    logs = HealthLog.objects.filter(condition, user=user, date__lte=end)
+    if start is not None:
+        logs = logs.filter(date__gte=start)
+    rows = (
+        logs.annotate(bucket=BUCKETS[bucket]('date'))
+        .values('bucket')
+        .annotate(total=Sum(metric), count=Count(metric))
+        .order_by()
+        .values_list('bucket', 'total', 'count')
+    )
+    totals = {}
+    for day, total, count in rows:
+        # TruncWeek/TruncMonth come back as datetimes on some backends
+        totals[day.date() if isinstance(day, datetime.datetime) else day] = [total, count]
+
+    if archived is None:
+        archived = archived_months(user, metric, end)
+    for month, total, count in archived:
+        if count and (start is None or month >= start.replace(day=1)):
+            entry = totals.setdefault(month, [0, 0])
+            entry[0] += total
+            entry[1] += count
+    return [(day, total / count) for day, (total, count) in sorted(totals.items())]
+
+
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets downsampling of [(x, y)] to `threshold` points.
+
+    Keeps the first and last points and, from each bucket in between, the point
+    that forms the largest triangle with its neighbours, so peaks and dips survive.
+    """
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third corner of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(points))
+        next_points = points[next_start:next_end]
+        avg_x = sum(p[0] for p in next_points) / len(next_points)
+        avg_y = sum(p[1] for p in next_points) / len(next_points)
+
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        ax, ay = points[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def series(user, metric, start=None, end=None, bucket=None, max_points=MAX_POINTS):
+    """Bucketed, downsampled series for one metric. Returns a dict ready for JSON."""
+    if end is None:
+        end = datetime.date.today()
+    archived = archived_months(user, metric, end)
+    since = start
+    if start is None:
+        # The whole history: archived months come first, so only look for the first log without them
+        if archived:
+            start = archived[0][0]
+        else:
+            start = HealthLog.objects.filter(user=user).order_by('date').values_list('date', flat=True).first() or end
+    bucket = bucket or pick_bucket(start, end)
+
+    rows = aggregate(user, metric, since, end, bucket, archived)
+    sampled = lttb([(day.toordinal(), value) for day, value in rows], max_points)
+    return {
+        'metric': metric,
+        'label': METRICS[metric][0],
+        'bucket': bucket,
+        'start': start,
+        'end': end,
+        'buckets': len(rows),
+        'points': [(datetime.date.fromordinal(x), round(y, 2)) for x, y in sampled],
+    }
+
+
+def svg_points(points, width=600, height=160, padding=8):
+    # "x,y x,y ..." for an inline <polyline>; y grows downwards in SVG
+    if not points:
+        return ""
+    xs = [day.toordinal() for day, _ in points]
+    ys = [value for _, value in points]
+    x_span = (max(xs) - min(xs)) or 1
+    y_low, y_high = min(ys), max(ys)
+    y_span = (y_high - y_low) or 1
+    return " ".join(
+        f"{padding + (x - min(xs)) / x_span * (width - 2 * padding):.1f},"
+        f"{height - padding - (y - y_low) / y_span * (height - 2 * padding):.1f}"
+        for x, y in zip(xs, ys)
+    )
@@ -11,11 +11,19 @@ urlpatterns = [
     path('log/', views.add_log, name='add_log'),
     path('edit/<int:log_id>/', views.edit_log, name='edit_log'),
     path('delete/<int:log_id>/', views.delete_log, name='delete_log'),
+    path('history/', views.history_view, name='history'),
+    path('api/logs/', views.api_logs_view, name='api_logs'),
+    path('api/trends/', views.trends_api_view, name='api_trends'),
+    path('api/foods/', views.foods_api_view, name='api_foods'),
+    path('import/', views.import_logs_view, name='import_logs'),
+    path('export/', views.export_logs_view, name='export_logs'),
+    path('export/all/', views.export_all_view, name='export_all'),
     path('profile/', views.profile_view, name='profile'),
     path('tips/', views.tips_view, name='tips'),
     path('ai-coach/', views.ai_analysis_view, name='ai_coach'),
     path('change-password/', views.change_password, name='change_password'),
     path('download-report/', views.download_pdf, name='download_pdf'),
+    path('metrics/', views.metrics_view, name='metrics'),
 
     # --- PASSWORD RESET URLS ---
     path('password-reset/', 
@@ -1,86 +1,143 @@
+import datetime
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import login, logout, update_session_auth_hash
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm, PasswordChangeForm
-from django.db.models import Avg
-from .models import HealthLog
-from .forms import CustomUserCreationForm, CustomLoginForm, HealthLogForm, UserUpdateForm, ProfileUpdateForm
-from xhtml2pdf import pisa
-from django.http import HttpResponse
-from django.template.loader import get_template
-from groq import Groq 
+from .models import CoachSummary, HealthLog, ReportJob, UserProfile, UserSummary
+from .forms import CustomUserCreationForm, CustomLoginForm, HealthLogForm, UserUpdateForm, ProfileUpdateForm, HealthLogImportForm
+from . import ai_cache, async_auth, coach_prompt, conditional, exporter, foods, fragments, history, importer, llm, metrics, percentiles, reports, rolling, trends
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.cache import add_never_cache_headers, patch_cache_control
+from django.utils.html import escape
+from django.conf import settings
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.template.backends.utils import csrf_input
+from django.urls import reverse
 
 # --- CONFIGURATION ---
-# PASTE YOUR GROQ KEY HERE
-GROQ_API_KEY = "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"
+# Providers are settings.LLM_PROVIDERS / LLM_ROUTE, called through core/llm.py.
+# AI_MODEL is part of every AI cache key; any routed provider's answer is kept under it.
+AI_MODEL = llm.DEFAULT_MODEL
+AI_STREAM_PATH = '/ai-coach/stream/'  # served by core.ai_stream under ASGI
+DASHBOARD_CHART_POINTS = 120
+
+# The pages people use most are async views: under ASGI (healthyio_project/asgi.py)
+# they read through the async ORM on the event loop, and a page waiting on the
+# AI provider holds no thread. Auth and session access goes through
+# core/async_auth.py; the remaining sync steps (form validation that checks
+# passwords or usernames, saves that rescore logs) run in a thread, one hop each.
+# Under WSGI Django runs them in an event loop per request, so they work there too.
 
 
+@conditional.static_page(anonymous_only=True)
 def home(request):
     if request.user.is_authenticated:
         return redirect('dashboard')
     return render(request, 'core/home.html')
 
-def register_view(request):
+async def register_view(request):
+    await async_auth.aget_user(request)  # the header shows who is logged in
     if request.method == 'POST':
         form = CustomUserCreationForm(request.POST) # Use custom form
-        if form.is_valid():
-            user = form.save()
-            login(request, user)
+        if await sync_to_async(form.is_valid)():  # checks the username is free
+            user = await sync_to_async(form.save)()
+            await async_auth.alogin(request, user)
             return redirect('dashboard')
     else:
         form = CustomUserCreationForm()
     return render(request, 'core/register.html', {'form': form})
 
-def login_view(request):
+async def login_view(request):
+    await async_auth.aget_user(request)
     if request.method == 'POST':
         form = CustomLoginForm(request, data=request.POST) # Use custom form
-        if form.is_valid():
+        if await sync_to_async(form.is_valid)():  # reads the user and hashes the password
             user = form.get_user()
-            login(request, user)
+            await async_auth.alogin(request, user)
             return redirect('dashboard')
     else:
         form = CustomLoginForm()
     return render(request, 'core/login.html', {'form': form})
-def logout_view(request):
-    logout(request)
+async def logout_view(request):
+    await async_auth.alogout(request)
     return redirect('home')
 
-@login_required
-def dashboard(request):
-    logs = HealthLog.objects.filter(user=request.user).order_by('-date')
-    
-    # 1. Calculate Average Sleep
-    avg_sleep = logs.aggregate(Avg('sleep_hours'))['sleep_hours__avg'] or 0
-    
-    # 2. NEW: Calculate Average Health Score
-    avg_health_score = logs.aggregate(Avg('health_score'))['health_score__avg'] or 0
-    
-    total_workouts = logs.filter(log_type='EXERCISE').count()
-    latest_log = logs.first()
-    
-    user_name = request.user.first_name if request.user.first_name else request.user.email
+def _once(get_context):
+    # functools.cache for a coroutine function without arguments
+    result = []
+    async def wrapper():
+        if not result:
+            result.append(await get_context())
+        return result[0]
+    return wrapper
+
+@async_auth.login_required
+@conditional.user_data()
+async def dashboard(request):
+    # Stats come from the running totals kept by HealthLog.save()/delete(),
+    # so this is one row read no matter how long the history is.
+    @_once
+    async def stats():
+        summary = (await UserSummary.objects.filter(user=request.user)
+                   .annotate(latest_score=percentiles.latest_score()).afirst()
+                   or UserSummary(user=request.user))
+        latest_score = getattr(summary, 'latest_score', None)
+        profile = getattr(request.user, 'userprofile', None)
+        return {
+            'avg_sleep': round(summary.avg_sleep, 1),
+            'avg_health_score': int(summary.avg_health_score), # Convert to integer for clean look
+            'total_workouts': summary.workout_count,
+            'latest_suggestion': summary.latest_suggestion if summary.log_count else "Log data to get tips!",
+            # From the nightly snapshot (manage.py build_percentiles), not a scan of everyone's logs;
+            # the snapshot counts single logs, so it ranks the latest one, not the average
+            'percentile': await percentiles.apercentile(profile, latest_score)
+                          if latest_score is not None and profile else None,
+            # Streaks and the last week, kept up to date on every write (core/rolling.py)
+            'window': await rolling.afor_user(request.user.id) if summary.log_count else None,
+            'window_days': rolling.WINDOW_DAYS,
+        }
+
+    async def recent_logs():
+        return {'logs': [log async for log in HealthLog.objects.filter(user=request.user).order_by('-date', '-id')[:5]]}
+
+    async def trend_chart():
+        # Whole history, bucketed by the database and thinned to what the chart can show.
+        # Several queries (live buckets plus archived months), so one thread hop for all of them
+        data = await sync_to_async(trends.series)(request.user, 'health_score', max_points=DASHBOARD_CHART_POINTS)
+        return {'trend': data, 'svg_points': trends.svg_points(data['points']), 'metrics': trends.METRICS,
+                'chart_points': DASHBOARD_CHART_POINTS}
+
+    # Both blocks are cached per data version, so an unchanged dashboard costs no queries of its own
+    stats_html = await fragments.arender_cached(request, 'dashboard_stats', 'core/fragments/dashboard_stats.html', stats)
+    # The suggestion sits in the header, outside the stats block; a miss on both reads the summary once
+    latest_suggestion = await fragments.arender_cached(request, 'latest_suggestion', 'core/fragments/latest_suggestion.html', stats)
 
     context = {
-        'logs': logs[:5],
-        'avg_sleep': round(avg_sleep, 1),
-        'avg_health_score': int(avg_health_score), # Convert to integer for clean look
-        'total_workouts': total_workouts,
-        'latest_suggestion': latest_log.suggestion if latest_log else "Log data to get tips!",
-        'user_name': user_name
+        'stats_html': stats_html,
+        'recent_logs_html': await fragments.arender_cached(request, 'recent_logs', 'core/fragments/recent_logs.html', recent_logs),
+        'trend_chart_html': await fragments.arender_cached(request, 'trend_chart', 'core/fragments/trend_chart.html', trend_chart),
+        'latest_suggestion': latest_suggestion,
+        'user_name': request.user.first_name if request.user.first_name else request.user.email,
     }
     return render(request, 'core/dashboard.html', context)
 # ... existing imports ...
 
-@login_required
-def edit_log(request, log_id):
+@async_auth.login_required
+async def edit_log(request, log_id):
     # Get the specific log belonging to the user
-    log = get_object_or_404(HealthLog, id=log_id, user=request.user)
+    try:
+        log = await HealthLog.objects.aget(id=log_id, user=request.user)
+    except HealthLog.DoesNotExist:
+        raise Http404("No HealthLog matches the given query.")
+    log.user = request.user  # already loaded with its profile, which scoring needs
     
     if request.method == 'POST':
         # Create form with POST data AND the existing log instance
         form = HealthLogForm(request.POST, instance=log)
         if form.is_valid():
-            form.save()
+            await form.save(commit=False).asave()
             return redirect('dashboard')
     else:
         # Pre-fill form with existing data
@@ -99,8 +156,8 @@ def delete_log(request, log_id):
         log.delete()
     return redirect('dashboard')
 
-@login_required
-def add_log(request):
+@async_auth.login_required
+async def add_log(request):
     show_modal = False
     log_result = None
     
@@ -109,7 +166,7 @@ def add_log(request):
         if form.is_valid():
             log = form.save(commit=False)
             log.user = request.user
-            log.save()
+            await log.asave()  # scores the log and updates the rollups in one thread hop
             
             # TRIGGER THE MODAL instead of redirecting
             show_modal = True
@@ -127,6 +184,116 @@ def add_log(request):
     })
 
 @login_required
+def import_logs_view(request):
+    result = None
+    if request.method == 'POST':
+        form = HealthLogImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            fmt = form.cleaned_data['format'] or importer.guess_format(upload.name)
+            # Uploaded files are iterated line by line, so memory stays bounded
+            result = importer.import_logs(request.user, upload, fmt)
+            form = HealthLogImportForm()
+    else:
+        form = HealthLogImportForm()
+
+    return render(request, 'core/import_logs.html', {'form': form, 'result': result})
+
+@login_required
+def history_view(request):
+    # Keyset pagination: ?cursor= is where the previous page ended, so every page is one index seek
+    try:
+        logs, next_cursor = history.page(request.user, request.GET.get('cursor'))
+    except history.InvalidCursor:
+        return redirect('history')
+    return render(request, 'core/history.html', {
+        'logs': logs,
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'csrf_input': csrf_input(request),
+    })
+
+@login_required
+def api_logs_view(request):
+    # JSON version of the history page: {"results": [...], "next": url of the next page or null}
+    try:
+        logs, next_cursor = history.page(request.user, request.GET.get('cursor'),
+                                         history.page_size(request.GET.get('limit')), fields=history.API_FIELDS)
+    except history.InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    next_url = None
+    if next_cursor:
+        next_url = request.build_absolute_uri(f"{reverse('api_logs')}?cursor={next_cursor}&limit={len(logs)}")
+    results = [{field: getattr(log, field) for field in history.API_FIELDS} for log in logs]
+    return JsonResponse({'results': results, 'next': next_url})
+
+@login_required
+def trends_api_view(request):
+    # ?metric=health_score&start=YYYY-MM-DD&end=YYYY-MM-DD&bucket=day|week|month&points=300
+    metric = request.GET.get('metric', 'health_score')
+    bucket = request.GET.get('bucket') or None
+    if metric not in trends.METRICS:
+        return JsonResponse({'error': f"metric must be one of {', '.join(trends.METRICS)}"}, status=400)
+    if bucket is not None and bucket not in trends.BUCKETS:
+        return JsonResponse({'error': "bucket must be day, week or month"}, status=400)
+    try:
+        start, end = (datetime.date.fromisoformat(request.GET[name]) if request.GET.get(name) else None
+                      for name in ('start', 'end'))
+        points = max(3, min(1000, int(request.GET.get('points', trends.MAX_POINTS))))
+    except ValueError:
+        return JsonResponse({'error': "start and end must be YYYY-MM-DD, points a number"}, status=400)
+    return JsonResponse(trends.series(request.user, metric, start, end, bucket, points))
+
+def foods_api_view(request):
+    # Food autocomplete for the log form: ?q=chick&limit=10. Answered from the in-memory
+    # index (core/foods.py), and the same for everyone, so no login and no query per keystroke
+    try:
+        limit = max(1, min(foods.MAX_LIMIT, int(request.GET.get('limit', foods.DEFAULT_LIMIT))))
+    except ValueError:
+        return JsonResponse({'error': "limit must be a number"}, status=400)
+    index = foods.get_index()
+    response = JsonResponse({'results': [index.food(number) for number in index.search(request.GET.get('q', ''), limit)]})
+    if len(index):
+        # Not while there are no foods yet: browsers would keep the empty answers
+        patch_cache_control(response, public=True, max_age=foods.BROWSER_CACHE_SECONDS)
+    return response
+
+def _export_response(chunks, fmt, prefix):
+    response = StreamingHttpResponse(chunks, content_type=exporter.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{exporter.filename(prefix, fmt)}"'
+    return response
+
+@login_required
+def export_logs_view(request):
+    # Streamed straight from the database cursor, so memory stays flat however long the history is
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exporter.FORMATS:
+        return HttpResponseBadRequest("format must be csv or ndjson")
+    response = _export_response(exporter.user_export(request.user, fmt), fmt, 'healthyio-logs')
+    omitted = exporter.omitted_months(request.user)
+    if omitted:
+        # Archived as monthly totals only (ARCHIVE_KEEP_RAW = False); say so rather than leave a silent gap
+        response['X-Omitted-Archived-Months'] = ",".join(f"{month:%Y-%m}" for month in omitted)
+    return response
+
+@staff_member_required
+def export_all_view(request):
+    # Every user's logs for analytics, optionally limited to ?start=YYYY-MM-DD&end=YYYY-MM-DD.
+    # Live logs only: archived months are there as totals (ArchivedMonth), not rows
+    fmt = request.GET.get('format', 'csv')
+    try:
+        start, end = (importer.parse_date(request.GET[name]) if request.GET.get(name) else None
+                      for name in ('start', 'end'))
+        days = int(request.GET.get('days', 31))
+    except (ValueError, ValidationError):
+        return HttpResponseBadRequest("start and end must be dates, days a number")
+    if fmt not in exporter.FORMATS or days < 1:
+        return HttpResponseBadRequest("format must be csv or ndjson and days at least 1")
+    return _export_response(exporter.bulk_export(fmt, start, end, days), fmt, 'healthyio-all-logs')
+
+@login_required
+@conditional.static_page()
 def tips_view(request):
     # Static list of tips to display
     tips = [
@@ -145,41 +312,48 @@ def tips_view(request):
     ]
     return render(request, 'core/tips.html', {'tips': tips})
 
-@login_required
-def profile_view(request):
+@async_auth.login_required
+@conditional.user_data()
+async def profile_view(request):
     if request.method == 'POST':
         u_form = UserUpdateForm(request.POST, instance=request.user)
         p_form = ProfileUpdateForm(request.POST, instance=request.user.userprofile)
         
         if u_form.is_valid() and p_form.is_valid():
-            u_form.save()
-            p_form.save()
+            # Only write what changed; an unchanged profile save is skipped by UserProfile.save()
+            @sync_to_async
+            def save():
+                # One hop: a new weight or height rescores the user's logs
+                if u_form.has_changed():
+                    u_form.save()
+                    UserProfile.touch([request.user.id])  # the name and email are on the user's pages
+                p_form.save()
+            await save()
             return redirect('profile')
     else:
         u_form = UserUpdateForm(instance=request.user)
         p_form = ProfileUpdateForm(instance=request.user.userprofile)
     
-    # Calculate BMI for display
-    profile = request.user.userprofile
-    bmi = profile.get_bmi()
-    bmi_status = profile.get_bmi_status()
-    
+    # BMI block for display, cached per data version
+    async def bmi():
+        profile = request.user.userprofile
+        return {'bmi': profile.bmi, 'bmi_status': profile.bmi_status}
+
     context = {
         'u_form': u_form,
         'p_form': p_form,
-        'bmi': bmi,
-        'bmi_status': bmi_status
+        'bmi_html': await fragments.arender_cached(request, 'bmi', 'core/fragments/bmi.html', bmi),
     }
     return render(request, 'core/profile.html', context)
 
-@login_required
-def change_password(request):
+@async_auth.login_required
+async def change_password(request):
     if request.method == 'POST':
         form = PasswordChangeForm(request.user, request.POST)
-        if form.is_valid():
-            user = form.save()
+        if await sync_to_async(form.is_valid)():  # password hashing is slow on purpose
+            user = await sync_to_async(form.save)()
             # Important: Update session so user isn't logged out after password change
-            update_session_auth_hash(request, user) 
+            await async_auth.aupdate_session_auth_hash(request, user)
             return redirect('profile')
     else:
         form = PasswordChangeForm(request.user)
@@ -190,68 +364,94 @@ def change_password(request):
     return render(request, 'core/change_password.html', {'form': form})
 
 @login_required
+@conditional.user_data('pdf', reports.TEMPLATE_VERSION)
 def download_pdf(request):
-    logs = HealthLog.objects.filter(user=request.user).order_by('-date')
-    template_path = 'core/pdf_report.html'
-    context = {'logs': logs, 'user': request.user}
-    
-    # Create a Django response object, and specify content_type as pdf
-    response = HttpResponse(content_type='application/pdf')
-    # If you want to download immediately:
-    response['Content-Disposition'] = 'attachment; filename="health_report.pdf"'
-    
-    # Find the template and render it.
-    template = get_template(template_path)
-    html = template.render(context)
+    # The PDF is built by the report worker (manage.py run_report_jobs); an
+    # unchanged history is served straight from the file it wrote last time.
+    job = reports.request_report(request.user)
+    if job.status == ReportJob.PENDING and not reports.worker_alive():
+        # No worker is running, so nothing would ever build it: do it here
+        job = reports.run_inline(job)
+    ready = reports.is_ready(job)
 
-    # Create the PDF
-    pisa_status = pisa.CreatePDF(html, dest=response)
-
-    if pisa_status.err:
-        return HttpResponse('We had some errors <pre>' + html + '</pre>')
+    # The "being prepared" page polls ?format=json until the file is ready
+    if request.GET.get('format') == 'json':
+        response = JsonResponse({'status': job.status.lower(), 'error': job.error}, status=200 if ready else 202)
+    elif ready:
+        # Revalidated by ETag until the user's data changes, without touching the job queue or the file
+        return FileResponse(open(reports.file_path(job), 'rb'), as_attachment=True,
+                            filename='health_report.pdf', content_type='application/pdf')
+    else:
+        response = render(request, 'core/report_status.html', {'job': job})
+    # The status changes without the data changing, so these are never stored
+    add_never_cache_headers(response)
     return response
 
-@login_required
-def ai_analysis_view(request):
-    logs = HealthLog.objects.filter(user=request.user).order_by('-date')[:7]
+def metrics_view(request):
+    # Prometheus scrape target; this process's numbers only
+    if not metrics.allowed(request):
+        raise PermissionDenied
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def recent_logs(user, count=7):
+    return list(HealthLog.objects.filter(user=user).order_by('-date', '-id')[:count])
+
+async def arecent_logs(user, count=7):
+    return [log async for log in HealthLog.objects.filter(user=user).order_by('-date', '-id')[:count]]
+
+def rule_based_summary(logs):
+    # Degraded answer for when the AI provider is down: built from the logs' own suggestions
+    scores = [log.health_score for log in logs]
+    sleep = [log.sleep_hours for log in logs]
+    tips = []
+    for log in logs:
+        for tip in (log.suggestion or "").split(". "):
+            tip = tip.strip().rstrip(".")
+            if tip and tip not in tips:
+                tips.append(tip)
+
+    items = "".join(f"<li>{escape(tip)}.</li>" for tip in tips[:3])
+    return (
+        "<p><em>The AI coach is busy right now, so here is a quick summary of your recent logs.</em></p>"
+        f"<h3>Your week</h3><p>Average health score: <strong>{round(sum(scores) / len(scores))}</strong>, "
+        f"average sleep: <strong>{round(sum(sleep) / len(sleep), 1)}h</strong> over {len(logs)} logs.</p>"
+        f"<h3>Focus on</h3><ul>{items}</ul>"
+    )
+
+@async_auth.login_required
+async def ai_analysis_view(request):
     profile = request.user.userprofile # Get Profile Data
-    
-    if not logs:
+    window = await rolling.afor_user(request.user.id)
+
+    if window is None:
         return render(request, 'core/ai_analysis.html', {'error': "Not enough data!"})
 
-    data_summary = ""
-    for log in logs:
-        data_summary += f"- Date: {log.date}, Type: {log.log_type}, Score: {log.health_score}, Sleep: {log.sleep_hours}h, Water: {log.water_intake}gls\n"
-
-    # NEW: Add Profile Context to Prompt
-    prompt = f"""
-    Act as a professional Health Coach.
-    USER PROFILE:
-    - Name: {request.user.first_name}
-    - Age: {profile.age}
-    - Weight: {profile.weight}kg, Height: {profile.height}cm
-    - BMI: {profile.get_bmi()} ({profile.get_bmi_status()})
-
-    RECENT LOGS:
-    {data_summary}
-    
-    Based on their BMI status ({profile.get_bmi_status()}) and logs, provide:
-    1. A summary of their week.
-    2. Three actionable improvements specific to their body type.
-    3. Use a motivating tone.
-    Format with HTML tags.
-    """
-
-    # ... Call Groq AI (Keep your existing code here) ...
-    # (Just pasting the try/except block for brevity)
+    # Statistics over the last COACH_LOOKBACK_DAYS days, fitted to COACH_PROMPT_TOKENS (core/coach_prompt.py)
+    prompt = await coach_prompt.afor_user(request.user, profile, window)
+
+    # Written overnight by `manage.py run_coach_batch`; only used while the logs it saw are still the latest
+    stored = await CoachSummary.objects.filter(
+        user=request.user, inputs_key=ai_cache.make_key(AI_MODEL, prompt)
+    ).values_list('content', flat=True).afirst()
+    if stored is not None:
+        return render(request, 'core/ai_analysis.html', {'ai_response': stored})
+
+    # Under ASGI the page renders immediately and the answer streams in from ai_stream
+    if settings.AI_STREAMING:
+        cached = await ai_cache.get_cache().aget(ai_cache.make_key(AI_MODEL, prompt))
+        if cached is None:
+            return render(request, 'core/ai_analysis.html', {'stream_url': AI_STREAM_PATH})
+        return render(request, 'core/ai_analysis.html', {'ai_response': cached})
+
+    # The prompt holds every input (logs + profile), so it doubles as the cache key.
+    # Reloads are served from the cache and concurrent identical requests share one provider call.
+    # Waiting on the provider holds no thread, only one of the LLM_MAX_CONCURRENCY slots.
     try:
-        client = Groq(api_key=GROQ_API_KEY)
-        chat_completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.3-70b-versatile", 
+        ai_response = await ai_cache.aget_or_compute(
+            request.user.id, [AI_MODEL, prompt], lambda: llm.acomplete(prompt, wait_for_slot=True)
         )
-        ai_response = chat_completion.choices[0].message.content
-    except Exception as e:
-        ai_response = f"Error: {e}"
+    except llm.LLMUnavailable:
+        # Not cached, so the real answer shows up once the provider recovers
+        ai_response = rule_based_summary(await arecent_logs(request.user))
 
-    return render(request, 'core/ai_analysis.html', {'ai_response': ai_response})
\ No newline at end of file
+    return render(request, 'core/ai_analysis.html', {'ai_response': ai_response})
\ No newline at end of file
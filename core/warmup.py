@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.urls import get_resolver
+
+from . import foods, llm, reports
+
+# The PDF and LLM libraries are imported on first use, which keeps
+# `manage.py` commands and worker start-up fast. Under a prefork server that
+# loads the app before forking (gunicorn --preload) it is cheaper to import
+# them once in the parent, where the workers share the memory, and to spare
+# the first request in each worker the wait. wsgi.py and asgi.py call warm_up(),
+# which loads whatever PRELOAD_SERVICES lists.
+
+SERVICES = {
+    'urls': lambda: get_resolver().url_patterns,  # the views and everything they import
+    'pdf': reports.preload,
+    'llm': llm.preload,
+    'foods': foods.preload,  # builds the food search index, so the first search doesn't wait
+}
+
+
+def warm_up(services=None):
+    """Import the libraries behind `services` (default: PRELOAD_SERVICES) now."""
+    if services is None:
+        services = getattr(settings, 'PRELOAD_SERVICES', ())
+    for name in services:
+        SERVICES[name]()
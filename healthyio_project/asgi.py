@@ -13,4 +13,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'healthyio_project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up
+from core import ai_stream  # noqa: E402
+from core.warmup import warm_up  # noqa: E402
+
+warm_up()
+
+
+async def application(scope, receive, send):
+    # The AI coach stream is a plain ASGI app so it can notice client disconnects
+    if scope['type'] == 'http' and scope['path'] == ai_stream.STREAM_PATH:
+        await ai_stream.application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -34,6 +34,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its timings include the other middleware (sessions, auth)
+    'core.metrics.MetricsMiddleware',
+    'core.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,6 +48,11 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'healthyio_project.urls'
 
+# Loads request.user together with its profile in one query. ModelBackend stays
+# listed for sessions that were logged in before ProfileBackend: a session whose
+# backend isn't listed here is logged out. New logins are stored as ProfileBackend.
+AUTHENTICATION_BACKENDS = ['core.backends.ProfileBackend', 'django.contrib.auth.backends.ModelBackend']
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -78,6 +86,15 @@ DATABASES = {
     }
 }
 
+# Read replicas (core/routers.py). Add each replica to DATABASES with
+# 'TEST': {'MIRROR': 'default'} and list its alias here; GET requests then read
+# from a reachable replica, while writes and POST handling stay on the primary.
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+DATABASE_REPLICA_APPS = ['core', 'auth']  # sessions always use the primary
+DATABASE_REPLICA_PIN_SECONDS = 10  # reads stay on the primary this long after a user's POST
+DATABASE_REPLICA_RETRY = 30        # seconds before an unreachable replica is tried again
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -119,6 +136,98 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
+# Caches
+# LocMemCache evicts least-recently-used entries once MAX_ENTRIES is reached.
+# Point 'ai' at Redis/Memcached to share AI coach responses between processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'ai': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'healthyio-ai',
+        'TIMEOUT': 6 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'healthyio-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+AI_CACHE_ALIAS = 'ai'
+# Per-user page fragments (core/fragments.py). Entries are keyed on the user's
+# data_changed_at, read from the database, so any backend is correct; a shared
+# one (Redis/Memcached) just saves each process rendering a fragment once.
+FRAGMENT_CACHE_ALIAS = 'fragments'
+FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# AI coach provider. The key comes from the environment (or .env) only; without
+# one the AI coach shows its fallback. GROQ_BASE_URL can point at a local fake server for testing.
+GROQ_API_KEY = os.getenv('GROQ_API_KEY')
+GROQ_BASE_URL = os.getenv('GROQ_BASE_URL')
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+
+# LLM providers (core/llm.py). LLM_ROUTE picks which are used; each call goes to
+# the fastest healthy one. The stub answers locally, for load tests and offline work.
+LLM_PROVIDERS = {
+    'groq': {'BACKEND': 'core.llm.GroqProvider', 'MODEL': 'llama-3.3-70b-versatile'},
+    'gemini': {'BACKEND': 'core.llm.GeminiProvider', 'MODEL': 'gemini-1.5-flash'},
+    'stub': {'BACKEND': 'core.llm.StubProvider', 'LATENCY': 0.2},
+}
+LLM_ROUTE = os.getenv('LLM_ROUTE', 'groq').split(',')
+LLM_HEDGE = True              # also ask the next provider once the first is slower than its p95
+LLM_HEDGE_DELAY = 2.0         # seconds, until a provider has LLM_HEDGE_MIN_SAMPLES latencies
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_LATENCY_WINDOW = 200      # recent calls per provider used for routing and hedging
+
+# Shared LLM client (core/llm.py)
+LLM_TIMEOUT = 20              # seconds per call, retries included
+LLM_MAX_RETRIES = 2
+LLM_MAX_CONCURRENCY = 8       # calls in flight per process; also the connection pool size
+LLM_BREAKER_THRESHOLD = 5     # consecutive failures before the breaker opens
+LLM_BREAKER_RESET = 30        # seconds before a trial call is let through
+# Stream the AI coach page over Server-Sent Events (needs the ASGI server, see asgi.py)
+AI_STREAMING = os.getenv('AI_STREAMING', 'False') == 'True'
+# AI coach prompt (core/coach_prompt.py): days summarised, and the most prompt tokens it may use
+COACH_LOOKBACK_DAYS = 30      # 7, 30 or 90 all fit; longer windows only add weekly scores
+COACH_PROMPT_TOKENS = 500
+
+# Nightly AI coach run (core/coach_batch.py, `manage.py run_coach_batch`); match the provider's quotas
+COACH_BATCH_CONCURRENCY = 4
+COACH_BATCH_RPM = 30          # requests per minute
+COACH_BATCH_TPM = 6000        # tokens per minute, prompt and reply
+
+# PDF reports (core/reports.py, built by `manage.py run_report_jobs`)
+REPORT_JOB_TIMEOUT = 600      # seconds before a RUNNING job is assumed dead and taken over
+REPORT_WORKER_TIMEOUT = 60    # seconds without a worker heartbeat before downloads build the PDF themselves
+REPORT_MAX_ATTEMPTS = 3       # failed jobs are re-queued on download until this many tries
+
+# Request metrics (core/metrics.py), scraped from /metrics. Numbers are per
+# process: with several workers, scrape each one (or run a single-process server).
+# Staff users may always read /metrics; a scraper sends "Authorization: Bearer
+# <METRICS_TOKEN>". METRICS_ALLOWED_IPS is matched against REMOTE_ADDR, which
+# behind a reverse proxy on the same host is 127.0.0.1 for every visitor -- so
+# don't list loopback there unless nothing proxies to this server.
+METRICS_ENABLED = True
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_ALLOWED_IPS = []
+METRICS_SERVER_TIMING = DEBUG  # Server-Timing header with db/template/LLM times, shown in browser devtools
+METRICS_SLOW_REQUEST_MS = 1000
+METRICS_SLOW_SAMPLE_RATE = 1.0  # fraction of slow requests written to the 'core.metrics' log
+
+# Cold-data archival (core/archive.py, `manage.py archive_logs`): months that ended more
+# than this many days ago become monthly totals; the raw rows go to MEDIA_ROOT/archive/
+ARCHIVE_AFTER_DAYS = 365
+# With False the raw rows are dropped: those months are then only monthly totals,
+# and a user's export lists them in its X-Omitted-Archived-Months header instead
+ARCHIVE_KEEP_RAW = True
+
+# Libraries imported by wsgi.py/asgi.py at start-up instead of on first use (core/warmup.py).
+# With gunicorn --preload, ['urls', 'pdf', 'llm'] loads them once in the parent for all workers;
+# 'foods' builds the food search index (core/foods.py) up front.
+PRELOAD_SERVICES = []
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -0,0 +1,27 @@
+"""
+Settings for tests and benchmarks: SQLite instead of MySQL, fast password hashing.
+
+    python manage.py test --settings=healthyio_project.settings_test
+    python manage.py benchmark --settings=healthyio_project.settings_test
+"""
+from .settings import *  # noqa: F401,F403
+
+SECRET_KEY = SECRET_KEY or 'test-only-secret-key'
+# Tests talk to a local fake server (core/fake_llm.py), never to Groq
+GROQ_API_KEY = 'test-only-api-key'
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    # Stand-in read replica for the routing tests; nothing replicates into it,
+    # so it is only used where DATABASE_REPLICAS is overridden
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db_replica.sqlite3',
+    },
+}
+DATABASE_REPLICAS = []
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'healthyio_project.settings')
 
 application = get_wsgi_application()
+
+# Imported after Django is set up; loads PRELOAD_SERVICES before any fork
+from core.warmup import warm_up  # noqa: E402
+
+warm_up()